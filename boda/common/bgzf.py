@@ -0,0 +1,182 @@
+import os
+import struct
+import zlib
+import bisect
+from collections import OrderedDict
+
+import numpy as np
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+
+def is_bgzf(file_path):
+    """
+    Check whether a file is BGZF (blocked gzip) compressed.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        bool: True if the first block carries a BGZF 'BC' subfield.
+    """
+    with open(file_path, 'rb') as f:
+        header = f.read(18)
+    return len(header) == 18 and header[:4] == BGZF_MAGIC and header[12:14] == b'BC'
+
+def read_gzi(gzi_path):
+    """
+    Read a .gzi index written by `bgzip -i` or `samtools faidx`.
+
+    Args:
+        gzi_path (str): Path to the .gzi file.
+
+    Returns:
+        tuple: Arrays of compressed and uncompressed block start offsets, including the first block at (0, 0).
+    """
+    with open(gzi_path, 'rb') as f:
+        n_entries, = struct.unpack('<Q', f.read(8))
+        entries = np.frombuffer(f.read(16*n_entries), dtype='<u8').reshape(-1,2)
+    coffsets = np.concatenate([[0], entries[:,0]]).astype(np.int64)
+    uoffsets = np.concatenate([[0], entries[:,1]]).astype(np.int64)
+    return coffsets, uoffsets
+
+class BgzfReader:
+    """
+    Random-access reader for BGZF compressed files.
+
+    Reads decompress only the blocks that overlap the requested range. Recently
+    used blocks are kept in an LRU cache. The file handle is opened lazily so
+    readers can be sent to DataLoader workers.
+
+    Args:
+        file_path (str): Path to the BGZF file.
+        gzi_path (str, optional): Path to the .gzi index. Defaults to file_path + '.gzi'. If missing,
+            block offsets are found by scanning the block headers.
+        cache_blocks (int, optional): Number of decompressed blocks to cache. Default is 256.
+
+    Attributes:
+        coffsets (np.ndarray): Compressed offset of each block.
+        uoffsets (np.ndarray): Uncompressed offset of each block.
+
+    Methods:
+        read(offset, length): Read uncompressed bytes.
+    """
+
+    def __init__(self, file_path, gzi_path=None, cache_blocks=256):
+        self.file_path = file_path
+        self.gzi_path  = file_path + '.gzi' if gzi_path is None else gzi_path
+        self.cache_blocks = cache_blocks
+
+        self._handle = None
+        self._cache  = OrderedDict()
+        self.hits   = 0
+        self.misses = 0
+
+        if os.path.isfile(self.gzi_path):
+            self.coffsets, self.uoffsets = read_gzi(self.gzi_path)
+        else:
+            self.coffsets, self.uoffsets = self.scan_blocks()
+
+    @property
+    def handle(self):
+        if self._handle is None:
+            self._handle = open(self.file_path, 'rb')
+        return self._handle
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_handle'] = None
+        state['_cache']  = OrderedDict()
+        return state
+
+    def block_size(self, header):
+        """
+        Get the total compressed size of a block from its header.
+
+        Args:
+            header (bytes): At least the first 18 bytes of the block.
+
+        Returns:
+            int: Size of the block in bytes.
+        """
+        assert header[:4] == BGZF_MAGIC, "Not a BGZF block."
+        xlen, = struct.unpack('<H', header[10:12])
+        extra = header[12:12+xlen]
+        pos = 0
+        while pos < xlen:
+            si1, si2, slen = extra[pos], extra[pos+1], struct.unpack('<H', extra[pos+2:pos+4])[0]
+            if si1 == 66 and si2 == 67:
+                return struct.unpack('<H', extra[pos+4:pos+6])[0] + 1
+            pos += 4 + slen
+        raise ValueError("BGZF block is missing the BC subfield.")
+
+    def scan_blocks(self):
+        """
+        Find block offsets by walking the block headers.
+
+        Returns:
+            tuple: Arrays of compressed and uncompressed block start offsets.
+        """
+        coffsets, uoffsets = [], []
+        coffset, uoffset = 0, 0
+        file_size = os.path.getsize(self.file_path)
+        with open(self.file_path, 'rb') as f:
+            while coffset < file_size:
+                f.seek(coffset)
+                header = f.read(18 + 64)
+                bsize  = self.block_size(header)
+                f.seek(coffset + bsize - 4)
+                isize, = struct.unpack('<I', f.read(4))
+                if isize > 0:
+                    coffsets.append(coffset)
+                    uoffsets.append(uoffset)
+                coffset += bsize
+                uoffset += isize
+        return np.array(coffsets, dtype=np.int64), np.array(uoffsets, dtype=np.int64)
+
+    def get_block(self, block_idx):
+        """
+        Get a decompressed block, using the LRU cache.
+
+        Args:
+            block_idx (int): Index of the block.
+
+        Returns:
+            bytes: The decompressed block.
+        """
+        try:
+            data = self._cache.pop(block_idx)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            self.handle.seek(self.coffsets[block_idx])
+            header = self.handle.read(18 + 64)
+            bsize  = self.block_size(header)
+            self.handle.seek(self.coffsets[block_idx])
+            data = zlib.decompress(self.handle.read(bsize), 31)
+            if len(self._cache) >= self.cache_blocks:
+                self._cache.popitem(last=False)
+        self._cache[block_idx] = data
+        return data
+
+    def read(self, offset, length):
+        """
+        Read uncompressed bytes.
+
+        Args:
+            offset (int): Uncompressed offset to start reading from.
+            length (int): Number of bytes to read.
+
+        Returns:
+            bytes: The requested bytes. Shorter than `length` at the end of the file.
+        """
+        pieces = []
+        block_idx = bisect.bisect_right(self.uoffsets, offset) - 1
+        while length > 0 and block_idx < len(self.uoffsets):
+            data  = self.get_block(block_idx)
+            start = offset - self.uoffsets[block_idx]
+            chunk = data[start:start+length]
+            pieces.append(chunk)
+            offset += len(chunk)
+            length -= len(chunk)
+            block_idx += 1
+        return b''.join(pieces)
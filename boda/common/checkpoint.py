@@ -0,0 +1,122 @@
+import os
+import json
+import struct
+import hashlib
+
+import numpy as np
+
+def progress_path(output):
+    """
+    Get the path of the progress bitmap kept next to an output.
+
+    Args:
+        output (str): Output path.
+
+    Returns:
+        str: Path of the progress bitmap.
+    """
+    return f'{output}.progress'
+
+def sync_hdf5(f):
+    """
+    Flush an open HDF5 file and sync it to disk.
+
+    h5py's flush only hands the data to the operating system, which can still lose it
+    on preemption, so the file descriptor is also fsynced.
+
+    Args:
+        f (h5py.File): A writable file opened with the default (sec2) driver.
+    """
+    f.flush()
+    os.fsync(f.id.get_vfd_handle())
+
+class ProgressBitmap:
+    """
+    Durable record of which chunks of a job are finished, kept in a small file next to the output.
+
+    The file holds a header with the number of chunks and a hash of the job settings,
+    followed by one byte per chunk. A chunk must only be marked after its results are synced
+    to the output (see sync_hdf5), and each mark is synced to disk, so after a crash every
+    marked chunk is safely written. At worst the chunk in flight is computed again.
+
+    Args:
+        path (str): Path of the bitmap file.
+        n_chunks (int): Number of chunks in the job.
+        settings (dict, optional): JSON serializable settings that determine the output. Resuming
+            with different settings raises an error. Default is None.
+        resume (bool, optional): Load an existing bitmap instead of starting over. Default is False.
+
+    Attributes:
+        done (numpy.ndarray): Boolean array of finished chunks.
+        resumed (bool): Whether an existing bitmap was loaded.
+
+    Methods:
+        mark(chunk_id): Record a chunk as finished.
+        pending(): Indices of unfinished chunks.
+    """
+
+    MAGIC = b'BODAPRG1'
+    HEADER = struct.Struct('<8sQ32s')
+
+    def __init__(self, path, n_chunks, settings=None, resume=False):
+        self.path = path
+        self.n_chunks = int(n_chunks)
+        self.signature = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).digest()
+        self.resumed = resume and os.path.isfile(path)
+
+        if self.resumed:
+            with open(path, 'rb') as f:
+                magic, n_chunks, signature = self.HEADER.unpack(f.read(self.HEADER.size))
+                done = np.frombuffer(f.read(), dtype=np.uint8)
+            if magic != self.MAGIC:
+                raise ValueError(f"{path} is not a progress bitmap.")
+            if n_chunks != self.n_chunks or signature != self.signature or done.size != self.n_chunks:
+                raise ValueError(f"{path} was written by a job with different settings. Remove it to start over.")
+            self.done = done.astype(bool)
+        else:
+            with open(path, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.n_chunks, self.signature))
+                f.write(bytes(self.n_chunks))
+                f.flush()
+                os.fsync(f.fileno())
+            self.done = np.zeros(self.n_chunks, dtype=bool)
+
+        self.handle = open(path, 'r+b')
+
+    def mark(self, chunk_id):
+        """
+        Record a chunk as finished and sync the record to disk.
+
+        Args:
+            chunk_id (int): Chunk index.
+        """
+        self.handle.seek(self.HEADER.size + int(chunk_id))
+        self.handle.write(b'\x01')
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.done[chunk_id] = True
+
+    def pending(self):
+        """
+        Get the unfinished chunks.
+
+        Returns:
+            numpy.ndarray: Indices of unfinished chunks in order.
+        """
+        return np.flatnonzero(~self.done)
+
+    @property
+    def n_done(self):
+        return int(self.done.sum())
+
+    def report(self):
+        """
+        Summarize progress.
+
+        Returns:
+            str: A one line summary.
+        """
+        return f'{self.n_done} of {self.n_chunks} chunks done' + (' (resumed)' if self.resumed else '')
+
+    def close(self):
+        self.handle.close()
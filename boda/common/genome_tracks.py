@@ -0,0 +1,224 @@
+import re
+
+import numpy as np
+
+TRACK_FORMAT_VERSION = 1
+
+def track_length(contig_length, window_size, step_size):
+    """
+    Get the number of windows, and so track bins, tiled over a contig.
+
+    Args:
+        contig_length (int): Length of the contig.
+        window_size (int): Length of each window.
+        step_size (int): Distance between window starts.
+
+    Returns:
+        int: Number of windows that fit in the contig.
+    """
+    if contig_length < window_size:
+        return 0
+    return (contig_length - window_size) // step_size + 1
+
+def parse_region(region):
+    """
+    Parse a region string like chr1:10,000-20,000.
+
+    Args:
+        region (str): Contig, or contig:start-end with a 0-based start and exclusive end.
+
+    Returns:
+        tuple: Contig, start, and end. Start and end are None for whole contigs.
+    """
+    match = re.fullmatch(r'(.+?)(?::([\d,]+)-([\d,]+))?', region.strip())
+    if match is None:
+        raise ValueError(f"Can't parse region {region}.")
+    contig, start, end = match.groups()
+    if start is None:
+        return contig, None, None
+    return contig, int(start.replace(',', '')), int(end.replace(',', ''))
+
+class TrackWriter:
+    """
+    Write genome-wide activity tracks to a chunked, compressed HDF5 file.
+
+    The file has one group per contig and one dataset per cell type in it, e.g.
+    f['chr1/K562']. Bin i of a contig holds the prediction for the window starting at
+    i * step_size, and is centered on i * step_size + window_size // 2. Unscored bins,
+    e.g. windows left out for N content, are NaN. Like sat_mut.py outputs, each dataset
+    records the range of bins written in its 'written_rows' attribute, so outputs of work
+    queue chunks can be merged with src/merge_chunks.py.
+
+    Windows are expected in contig order. Only the datasets of the contig being written
+    are kept open, each with a chunk cache of a few chunks, so memory is bounded by the
+    chunk size and whole chunks are compressed once.
+
+    Args:
+        path (str): Output HDF5 path.
+        contig_lengths (dict): Lengths of the contigs to make tracks for.
+        cell_types (list): Names of the model outputs.
+        window_size (int): Length of the scored windows, without flanks.
+        step_size (int): Distance between window starts.
+        chunk_length (int, optional): Number of bins per HDF5 chunk. Default is 2**16.
+        dtype (str, optional): Storage dtype. Default is 'float16'.
+        compression (str, optional): HDF5 compression filter. Default is 'gzip'.
+        compression_opts (int, optional): Compression level. Default is 4.
+        attrs (dict, optional): Extra file attributes, e.g. run settings. Default is None.
+    """
+
+    def __init__(self, path, contig_lengths, cell_types, window_size, step_size,
+                 chunk_length=2**16, dtype='float16', compression='gzip', compression_opts=4,
+                 attrs=None):
+        import h5py
+
+        self.path = path
+        self.cell_types = list(cell_types)
+        self.dtype = np.dtype(dtype)
+        chunk_bytes = chunk_length * self.dtype.itemsize
+        self.file = h5py.File(path, 'w', rdcc_nbytes=max(2**20, 4 * chunk_bytes), rdcc_w0=1.)
+        self.file.attrs.update({
+            'format_version': TRACK_FORMAT_VERSION, 'window_size': window_size, 'step_size': step_size,
+            'offset': window_size // 2, 'cell_types': self.cell_types, **(attrs or {}),
+        })
+        self.n_bins = {}
+        for contig, length in contig_lengths.items():
+            n_bins = track_length(length, window_size, step_size)
+            group = self.file.create_group(contig)
+            group.attrs['contig_length'] = length
+            # Contigs shorter than a window get empty, unchunked datasets
+            storage = {} if n_bins == 0 else {
+                'chunks': (min(n_bins, chunk_length),), 'shuffle': compression is not None,
+                'compression': compression, 'compression_opts': compression_opts if compression == 'gzip' else None,
+            }
+            for cell_type in self.cell_types:
+                group.create_dataset(cell_type, (n_bins,), dtype=self.dtype, fillvalue=np.nan, **storage)
+            self.n_bins[contig] = n_bins
+        self.written_rows = {}
+        self.contig, self.datasets = None, None
+
+    def open_contig(self, contig):
+        """
+        Switch to the datasets of a contig, closing those of the previous one.
+
+        Args:
+            contig (str): Contig name.
+        """
+        if self.contig is not None:
+            self.datasets = None
+            self.file.flush()
+        self.contig = contig
+        self.datasets = [ self.file[contig][cell_type] for cell_type in self.cell_types ]
+
+    def write(self, contig, bins, values):
+        """
+        Write the predictions of windows in one contig.
+
+        Args:
+            contig (str): Contig name.
+            bins (numpy.ndarray): Increasing bin indices (window start // step_size).
+            values (numpy.ndarray): Predictions of shape (n_bins, n_cell_types).
+        """
+        if contig != self.contig:
+            self.open_contig(contig)
+        bins   = np.asarray(bins, dtype=np.int64)
+        values = np.asarray(values).astype(self.dtype)
+        # Consecutive bins are written as slices
+        breaks = np.concatenate([[0], np.nonzero(np.diff(bins) != 1)[0] + 1, [bins.shape[0]]])
+        for lo, hi in zip(breaks[:-1], breaks[1:]):
+            first, last = int(bins[lo]), int(bins[hi-1]) + 1
+            for i, dset in enumerate(self.datasets):
+                dset[first:last] = values[lo:hi, i]
+        lo, hi = self.written_rows.get(contig, (int(bins[0]), int(bins[0])+1))
+        self.written_rows[contig] = (min(lo, int(bins[0])), max(hi, int(bins[-1])+1))
+
+    def close(self):
+        """
+        Record the written bins of every dataset and close the file.
+        """
+        self.datasets = None
+        for contig in self.n_bins:
+            for cell_type in self.cell_types:
+                self.file[contig][cell_type].attrs['written_rows'] = self.written_rows.get(contig, (0, 0))
+        self.file.close()
+
+class TrackReader:
+    """
+    Region queries on tracks written by TrackWriter. Only the HDF5 chunks overlapping a
+    region are read and decompressed.
+
+    Args:
+        path (str): Track HDF5 path.
+
+    Attributes:
+        cell_types (list): Names of the tracks of each contig.
+        contigs (list): Contig names.
+        window_size (int): Length of the scored windows.
+        step_size (int): Distance between window starts.
+        offset (int): Distance from a window's start to the position it is reported at.
+    """
+
+    def __init__(self, path):
+        import h5py
+
+        self.path = path
+        self.file = h5py.File(path, 'r')
+        attrs = self.file.attrs
+        assert attrs.get('format_version') == TRACK_FORMAT_VERSION, f"{path} is not a track file."
+        self.cell_types  = [ str(x) for x in attrs['cell_types'] ]
+        self.contigs     = list(self.file.keys())
+        self.window_size = int(attrs['window_size'])
+        self.step_size   = int(attrs['step_size'])
+        self.offset      = int(attrs['offset'])
+
+    def contig_length(self, contig):
+        return int(self.file[contig].attrs['contig_length'])
+
+    def query(self, contig, start=None, end=None, cell_types=None):
+        """
+        Get the predictions of windows centered in a region.
+
+        Args:
+            contig (str): Contig name.
+            start (int, optional): 0-based start of the region. Default is the contig start.
+            end (int, optional): Exclusive end of the region. Default is the contig end.
+            cell_types (list, optional): Tracks to read. Default is all.
+
+        Returns:
+            tuple: Window center positions of shape (n,), and predictions of shape
+            (n, n_cell_types) as float32, NaN where no prediction was made.
+        """
+        cell_types = self.cell_types if cell_types is None else list(cell_types)
+        group  = self.file[contig]
+        n_bins = group[cell_types[0]].shape[0]
+        start  = 0 if start is None else start
+        end    = self.contig_length(contig) if end is None else end
+        # Bins whose center i * step_size + offset falls in [start, end)
+        lo = min(n_bins, max(0, -(-(start - self.offset) // self.step_size)))
+        hi = min(n_bins, max(lo, -(-(end - self.offset) // self.step_size)))
+        values = np.empty((hi - lo, len(cell_types)), dtype=np.float32)
+        for i, cell_type in enumerate(cell_types):
+            values[:, i] = group[cell_type][lo:hi]
+        positions = np.arange(lo, hi, dtype=np.int64) * self.step_size + self.offset
+        return positions, values
+
+    def fetch(self, region, cell_types=None):
+        """
+        Query a region given as a string.
+
+        Args:
+            region (str): Contig, or contig:start-end.
+            cell_types (list, optional): Tracks to read. Default is all.
+
+        Returns:
+            tuple: Positions and predictions, as from query.
+        """
+        return self.query(*parse_region(region), cell_types=cell_types)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
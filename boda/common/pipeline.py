@@ -0,0 +1,145 @@
+from collections import deque
+
+import torch
+
+def to_device(batch, device, non_blocking=False, keys=None):
+    """
+    Move the tensors in a batch to a device.
+
+    Args:
+        batch (torch.Tensor, dict, list, or tuple): The batch. Nested containers are traversed.
+        device (torch.device): Target device.
+        non_blocking (bool, optional): Copy asynchronously from pinned memory. Default is False.
+        keys (list, optional): Only move these top level keys (dict batches) or
+            positions (list/tuple batches). Default is None (move everything).
+
+    Returns:
+        The batch with tensors on the device.
+    """
+    def move(item):
+        if torch.is_tensor(item):
+            return item.to(device, non_blocking=non_blocking)
+        elif isinstance(item, dict):
+            return { key: move(value) for key, value in item.items() }
+        elif isinstance(item, (list, tuple)):
+            return type(item)( move(value) for value in item )
+        return item
+
+    if keys is None:
+        return move(batch)
+    elif isinstance(batch, dict):
+        return { key: move(value) if key in keys else value for key, value in batch.items() }
+    return type(batch)( move(value) if i in keys else value for i, value in enumerate(batch) )
+
+def record_stream(batch, stream):
+    """
+    Mark the CUDA tensors in a batch as used by a stream, so the caching allocator
+    doesn't reuse their memory while the stream still needs it.
+    """
+    if torch.is_tensor(batch):
+        if batch.is_cuda:
+            batch.record_stream(stream)
+    elif isinstance(batch, dict):
+        for value in batch.values():
+            record_stream(value, stream)
+    elif isinstance(batch, (list, tuple)):
+        for value in batch:
+            record_stream(value, stream)
+
+class DevicePrefetcher:
+    """
+    Iterate a DataLoader while the next batches are already being copied to the device.
+
+    Batches from a DataLoader with pin_memory=True are copied with non-blocking
+    transfers on a separate CUDA stream, up to depth batches ahead. The compute stream
+    only waits for a batch when it is used, so extraction in DataLoader workers, host to
+    device copies, and the model forward overlap. On other devices batches are moved
+    synchronously.
+
+    Args:
+        loader (torch.utils.data.DataLoader): Source of batches.
+        device (torch.device or str): Target device.
+        depth (int, optional): Number of batches in flight. Default is 2.
+        keys (list, optional): Only move these keys or positions of each batch, leaving
+            e.g. locations or records on the host. Default is None (move everything).
+    """
+
+    def __init__(self, loader, device, depth=2, keys=None):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.depth  = max(1, depth)
+        self.keys   = keys
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        if self.device.type != 'cuda':
+            for batch in self.loader:
+                yield to_device(batch, self.device, keys=self.keys)
+            return
+
+        stream = torch.cuda.Stream(self.device)
+        in_flight = deque()
+        batches = iter(self.loader)
+
+        def enqueue():
+            try:
+                batch = next(batches)
+            except StopIteration:
+                return False
+            with torch.cuda.stream(stream):
+                batch = to_device(batch, self.device, non_blocking=True, keys=self.keys)
+                event = torch.cuda.Event()
+                event.record(stream)
+            in_flight.append((batch, event))
+            return True
+
+        while len(in_flight) < self.depth and enqueue():
+            pass
+        while len(in_flight) > 0:
+            batch, event = in_flight.popleft()
+            current = torch.cuda.current_stream(self.device)
+            current.wait_event(event)
+            record_stream(batch, current)
+            enqueue()
+            yield batch
+
+class HostCopy:
+    """
+    Results being copied from the device to the host.
+
+    On CUDA, each tensor is copied into pinned host memory with a non-blocking transfer
+    queued behind the kernels that produce it, so the host doesn't wait for the device.
+    The copy is complete once result() returns, which can happen later or in another thread
+    (e.g. BackgroundWriter).
+
+    Args:
+        tensors (torch.Tensor or dict): Tensors to copy.
+    """
+
+    def __init__(self, tensors):
+        self.is_dict = isinstance(tensors, dict)
+        tensors = tensors if self.is_dict else {None: tensors}
+        self.event = None
+        if any( tensor.is_cuda for tensor in tensors.values() ):
+            self.host = {}
+            for key, tensor in tensors.items():
+                self.host[key] = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+                self.host[key].copy_(tensor.detach(), non_blocking=True)
+            self.event = torch.cuda.Event()
+            self.event.record()
+        else:
+            self.host = { key: tensor.detach() for key, tensor in tensors.items() }
+
+    def result(self):
+        """
+        Wait for the copy to finish.
+
+        Returns:
+            numpy.ndarray or dict: The copied arrays, in the form they were given.
+        """
+        if self.event is not None:
+            self.event.synchronize()
+        arrays = { key: tensor.numpy() for key, tensor in self.host.items() }
+        return arrays if self.is_dict else arrays[None]
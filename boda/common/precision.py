@@ -0,0 +1,177 @@
+import sys
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+PRECISIONS = ('fp32', 'bf16', 'fp16', 'auto')
+
+def model_device(model):
+    """
+    Get the device a model runs on.
+
+    Args:
+        model (nn.Module): The model.
+
+    Returns:
+        torch.device: The device of its first parameter or buffer, or the CPU.
+    """
+    try:
+        return torch.device(model.device)
+    except AttributeError:
+        pass
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        return tensor.device
+    return torch.device('cpu')
+
+def cpu_supports_bf16():
+    """
+    Check for native bfloat16 support (AVX512-BF16 or AMX) on this CPU.
+
+    Returns:
+        bool: True if bf16 kernels are available.
+    """
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+def resolve_precision(precision, device):
+    """
+    Pick the autocast dtype for a precision setting on a device.
+
+    'auto' uses bf16 on CPUs with native support (fp32 otherwise), bf16 on accelerators
+    that support it, and fp16 on CUDA devices.
+
+    Args:
+        precision (str): One of 'fp32', 'bf16', 'fp16', or 'auto'.
+        device (torch.device): Device the model runs on.
+
+    Returns:
+        torch.dtype: The reduced dtype, or None for fp32.
+
+    Raises:
+        ValueError: For unknown or unsupported settings.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {PRECISIONS}, got {precision}.")
+    device = torch.device(device)
+    if precision == 'fp32':
+        return None
+    if device.type == 'cpu':
+        if precision == 'fp16':
+            raise ValueError("fp16 autocast isn't supported on CPU, use bf16.")
+        if precision == 'auto' and not cpu_supports_bf16():
+            return None
+        return torch.bfloat16
+    if precision == 'auto':
+        return torch.float16 if device.type == 'cuda' else torch.bfloat16
+    return torch.bfloat16 if precision == 'bf16' else torch.float16
+
+class ReducedPrecision(nn.Module):
+    """
+    Run a model under autocast and return fp32 outputs.
+
+    Convolutions and matmuls run in the reduced dtype on whatever device the input is on.
+    Outputs are cast back to fp32, so reductions over windows, strands, or ensemble members
+    and differences such as alt - ref skews are computed in fp32 by the caller. Gradients
+    with respect to the input still work.
+
+    Args:
+        model (nn.Module): The fp32 model.
+        dtype (torch.dtype): torch.bfloat16 or torch.float16.
+
+    Attributes:
+        autocast_dtype (torch.dtype): The reduced dtype. Part of prediction cache keys.
+    """
+
+    def __init__(self, model, dtype):
+        super().__init__()
+        self.model = model
+        self.autocast_dtype = dtype
+        for attr in ['input_len', 'is_frozen']:
+            if hasattr(model, attr):
+                setattr(self, attr, getattr(model, attr))
+
+    @property
+    def device(self):
+        return model_device(self.model)
+
+    def forward(self, x):
+        with torch.autocast(device_type=x.device.type, dtype=self.autocast_dtype):
+            preds = self.model(x)
+        return preds.float()
+
+def precision_drift(model, reduced, sample):
+    """
+    Compare reduced precision predictions to fp32.
+
+    Args:
+        model (nn.Module): The fp32 model.
+        reduced (ReducedPrecision): The same model under autocast.
+        sample (torch.Tensor): Calibration inputs on the model's device.
+
+    Returns:
+        float: Maximum absolute difference of the predictions.
+    """
+    with torch.no_grad():
+        expected = model(sample).float()
+        observed = reduced(sample)
+    return (observed - expected).abs().max().item()
+
+def random_onehot_sample(n_samples, input_len, device, seed=0):
+    """
+    Random one-hot sequences for calibration.
+
+    Args:
+        n_samples (int): Number of sequences.
+        input_len (int): Sequence length.
+        device (torch.device): Device of the result.
+        seed (int, optional): Random seed. Default is 0.
+
+    Returns:
+        torch.Tensor: Sequences of shape (n_samples, 4, input_len).
+    """
+    generator = torch.Generator().manual_seed(seed)
+    tokens = torch.randint(0, 4, (n_samples, input_len), generator=generator)
+    return F.one_hot(tokens, 4).transpose(1, 2).float().to(device)
+
+def reduced_precision(model, precision='auto', tolerance=0.05, sample=None, n_samples=256, device=None):
+    """
+    Wrap a model for reduced precision inference after checking its accuracy.
+
+    The model is run in fp32 and in the reduced dtype on a calibration sample. If the
+    predictions drift apart by more than tolerance, the run is refused.
+
+    Args:
+        model (nn.Module): The fp32 model, on its inference device.
+        precision (str, optional): 'fp32', 'bf16', 'fp16', or 'auto'. Default is 'auto'.
+        tolerance (float, optional): Largest allowed absolute difference of predictions on
+            the calibration sample, in model output units. Default is 0.05.
+        sample (torch.Tensor, optional): Calibration inputs. Defaults to n_samples random
+            one-hot sequences of length model.input_len (or 600).
+        n_samples (int, optional): Size of the default sample. Default is 256.
+        device (torch.device, optional): Inference device. The model is moved there before
+            the check. Defaults to the model's device.
+
+    Returns:
+        nn.Module: ReducedPrecision wrapper, or the model itself for fp32 and int8 models.
+
+    Raises:
+        ValueError: If the drift exceeds tolerance.
+    """
+    device = model_device(model) if device is None else torch.device(device)
+    dtype  = resolve_precision(precision, device)
+    if dtype is None or getattr(model, 'quantization', None) is not None:
+        return model
+
+    model.to(device)
+
+    reduced = ReducedPrecision(model, dtype)
+    if sample is None:
+        sample = random_onehot_sample(n_samples, getattr(model, 'input_len', 600), device)
+    drift = precision_drift(model, reduced, sample.to(device))
+    if drift > tolerance:
+        raise ValueError(f"{dtype} predictions drift from fp32 by up to {drift:.4g} > {tolerance} on the calibration sample. Use --precision fp32 or raise the tolerance.")
+    print(f'Running in {dtype}, calibration drift {drift:.4g} (tolerance {tolerance})', file=sys.stderr)
+    return reduced
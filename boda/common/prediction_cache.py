@@ -0,0 +1,279 @@
+import os
+import json
+import sqlite3
+import hashlib
+from functools import partial
+from collections import OrderedDict
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+def artifact_fingerprint(artifact_paths, extra=None):
+    """
+    Hash model artifacts and optional settings into a cache namespace.
+
+    Local files are hashed by content. Other paths (e.g. gs:// URIs) are hashed by name.
+
+    Args:
+        artifact_paths (list): Paths to model artifacts.
+        extra (object, optional): JSON serializable settings that change predictions. Default is None.
+
+    Returns:
+        str: Hex digest.
+    """
+    hasher = hashlib.sha256()
+    for path in artifact_paths:
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                for block in iter(partial(f.read, 2**24), b''):
+                    hasher.update(block)
+        else:
+            hasher.update(path.encode())
+    hasher.update(json.dumps(extra).encode())
+    return hasher.hexdigest()
+
+def model_fingerprint(model, extra=None):
+    """
+    Hash a model's class, parameters, and buffers into a cache namespace.
+
+    Args:
+        model (nn.Module): The model.
+        extra (object, optional): JSON serializable settings that change predictions. Default is None.
+
+    Returns:
+        str: Hex digest.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(type(model).__name__.encode())
+    for name, tensor in sorted(model.state_dict().items()):
+        tensor = tensor.detach().cpu().contiguous()
+        hasher.update(f'{name}:{tensor.dtype}:{tuple(tensor.shape)}'.encode())
+        hasher.update(tensor.view(-1).view(torch.uint8).numpy().tobytes() if tensor.numel() > 0 else b'')
+    hasher.update(json.dumps(extra).encode())
+    return hasher.hexdigest()
+
+class PredictionCache:
+    """
+    Persistent key-value store of model predictions with an in-memory LRU in front.
+
+    Values live in an SQLite file, so several jobs can share one cache. Lookups and
+    inserts are batched. The connection is opened lazily so the cache can be sent to
+    other processes.
+
+    Args:
+        db_path (str): Path to the SQLite file. Created if missing.
+        lru_size (int, optional): Number of entries kept in memory. Default is 2**16.
+        timeout (float, optional): Seconds to wait for a lock held by another job. Default is 600.
+
+    Attributes:
+        memory_hits (int): Lookups served from memory.
+        disk_hits (int): Lookups served from the SQLite file.
+        misses (int): Lookups not found.
+
+    Methods:
+        get_many(keys): Look up values.
+        put_many(items): Store values.
+        report(): Summarize hit rates.
+    """
+
+    QUERY_SIZE = 500
+
+    def __init__(self, db_path, lru_size=2**16, timeout=600.):
+        self.db_path  = db_path
+        self.lru_size = lru_size
+        self.timeout  = timeout
+
+        self._connection = None
+        self._lru = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits   = 0
+        self.misses      = 0
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.db_path, timeout=self.timeout)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS predictions (key BLOB PRIMARY KEY, value BLOB) WITHOUT ROWID')
+            self._connection.commit()
+        return self._connection
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_lru'] = OrderedDict()
+        return state
+
+    def remember(self, key, value):
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get_many(self, keys, count=True):
+        """
+        Look up values, checking memory first and the SQLite file for the rest.
+
+        Args:
+            keys (list): Keys as bytes.
+            count (bool, optional): Whether the lookups count towards hit rates. Default is True.
+
+        Returns:
+            list: Values as bytes, or None for missing keys.
+        """
+        values = [ self._lru.get(key) for key in keys ]
+        for key, value in zip(keys, values):
+            if value is not None:
+                self._lru.move_to_end(key)
+        memory_hits, disk_hits = sum( value is not None for value in values ), 0
+
+        missing = list({ key for key, value in zip(keys, values) if value is None })
+        found = {}
+        for start in range(0, len(missing), self.QUERY_SIZE):
+            query = missing[start:start+self.QUERY_SIZE]
+            rows  = self.connection.execute(
+                f'SELECT key, value FROM predictions WHERE key IN ({",".join("?" * len(query))})', query
+            ).fetchall()
+            found.update(rows)
+
+        for i, key in enumerate(keys):
+            if values[i] is None:
+                if key in found:
+                    values[i] = found[key]
+                    disk_hits += 1
+                    self.remember(key, values[i])
+
+        if count:
+            self.memory_hits += memory_hits
+            self.disk_hits   += disk_hits
+            self.misses      += len(keys) - memory_hits - disk_hits
+        return values
+
+    def put_many(self, items):
+        """
+        Store values in memory and in the SQLite file.
+
+        Args:
+            items (list): (key, value) pairs of bytes.
+        """
+        for key, value in items:
+            self.remember(key, value)
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO predictions (key, value) VALUES (?, ?)', items)
+
+    @property
+    def hit_rate(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups > 0 else 0.
+
+    def report(self):
+        """
+        Summarize hit rates.
+
+        Returns:
+            str: A one line summary.
+        """
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return f'prediction cache: {lookups} lookups, {self.memory_hits} memory hits, ' + \
+               f'{self.disk_hits} disk hits, {self.misses} misses ({100*self.hit_rate:.1f}% hit rate)'
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+class CachedModel(nn.Module):
+    """
+    Wrap a model so predictions are looked up in a PredictionCache before running it.
+
+    Each input row is keyed by the namespace plus its contents. One-hot rows are keyed by
+    their token sequence, and other inputs by their raw values. Rows found in the cache
+    skip the model; only the rest are run and then stored. Inputs that require grad
+    bypass the cache.
+
+    Args:
+        model (nn.Module): The model. Should map (batch, ...) inputs to (batch, ...) outputs.
+        cache (PredictionCache): Where predictions are stored.
+        namespace (str): Identifies the model, e.g. from artifact_fingerprint or model_fingerprint.
+    """
+
+    def __init__(self, model, cache, namespace):
+        super().__init__()
+        self.model = model
+        self.cache = cache
+        self.namespace = namespace
+        self._shape_key = hashlib.blake2b(f'{namespace}:shape'.encode(), digest_size=16).digest()
+        self.out_shape = None
+
+    @property
+    def device(self):
+        try:
+            return self.model.device
+        except AttributeError:
+            return next(self.model.parameters()).device
+
+    def row_keys(self, x):
+        """
+        Get the cache key of each input row.
+
+        Args:
+            x (torch.Tensor): Input batch.
+
+        Returns:
+            list: Keys as bytes.
+        """
+        x = x.detach()
+        is_onehot = x.dim() == 3 and bool( ((x == 0) | (x == 1)).all() and (x.sum(dim=1) <= 1).all() )
+        if is_onehot:
+            rows = torch.where(x.sum(dim=1) == 0, x.shape[1], x.argmax(dim=1)).to(torch.uint8).cpu().numpy()
+        else:
+            rows = x.float().cpu().numpy()
+        rows = rows.reshape(rows.shape[0], -1)
+
+        autocast = getattr(getattr(self.model, 'module', self.model), 'autocast_dtype', None)
+        if autocast is None and torch.is_autocast_enabled():
+            autocast = torch.get_autocast_gpu_dtype()
+        header = f'{self.namespace}:{is_onehot}:{tuple(x.shape[1:])}:{autocast}'.encode()
+        hasher = hashlib.blake2b(header, digest_size=16)
+        keys = []
+        for row in rows:
+            row_hasher = hasher.copy()
+            row_hasher.update(row.tobytes())
+            keys.append(row_hasher.digest())
+        return keys
+
+    def forward(self, x):
+        """
+        Predict with cached values where available.
+
+        Args:
+            x (torch.Tensor): Input batch.
+
+        Returns:
+            torch.Tensor: float32 predictions.
+        """
+        if torch.is_grad_enabled() and x.requires_grad:
+            return self.model(x)
+
+        keys   = self.row_keys(x)
+        values = self.cache.get_many(keys)
+        if self.out_shape is None:
+            shape = self.cache.get_many([self._shape_key], count=False)[0]
+            self.out_shape = None if shape is None else tuple(json.loads(shape))
+
+        missing = [ i for i, value in enumerate(values) if value is None ]
+        if len(missing) > 0:
+            preds = self.model(x[missing])
+            if self.out_shape is None:
+                self.out_shape = tuple(preds.shape[1:])
+                self.cache.put_many([(self._shape_key, json.dumps(self.out_shape).encode())])
+            preds = preds.detach().float().cpu().numpy()
+            new_items = {}
+            for i, pred in zip(missing, preds):
+                values[i] = pred.tobytes()
+                new_items[keys[i]] = values[i]
+            self.cache.put_many(list(new_items.items()))
+
+        out = np.frombuffer(b''.join(values), dtype=np.float32).reshape(len(values), *self.out_shape)
+        return torch.from_numpy(out.copy()).to(x.device)
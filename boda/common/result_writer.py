@@ -0,0 +1,302 @@
+import os
+import csv
+import json
+import queue
+import threading
+
+import numpy as np
+import pandas as pd
+import torch
+
+def format_info_column(preds, feature_ids=None, tags=('ref', 'alt', 'skew')):
+    """
+    Format predictions as INFO strings of `{feature}__{tag}={value}` fields joined by ';'.
+
+    Numbers are converted to strings in one vectorized call per tag. Output matches
+    the per-column pandas formatting previously used by vcf_predict.py.
+
+    Args:
+        preds (dict): Arrays of shape (n_records, n_features) for each tag.
+        feature_ids (list, optional): Feature names. Defaults to feature indices.
+        tags (tuple, optional): Keys of preds, in output order. Default is ('ref', 'alt', 'skew').
+
+    Returns:
+        list: One INFO string per record.
+    """
+    n_records, n_features = preds[tags[0]].shape
+    feature_ids = range(n_features) if feature_ids is None else feature_ids
+    template = ';'.join( f'{feature}__{tag}=%s' for tag in tags for feature in feature_ids )
+    values = np.concatenate([ np.asarray(preds[tag]).astype(str) for tag in tags ], axis=1)
+    return [ template % tuple(row) for row in values.tolist() ]
+
+class TableResultWriter:
+    """
+    Write VCF records with an INFO column of predictions to a tab-separated table,
+    one chunk at a time.
+
+    Args:
+        path (str): Output path.
+        feature_ids (list, optional): Feature names for the INFO column. Default is None.
+        compression (str, optional): None, 'gzip', or 'bgzip'. Default is None.
+    """
+
+    def __init__(self, path, feature_ids=None, compression=None):
+        self.path = path
+        self.feature_ids = feature_ids
+        if compression == 'bgzip':
+            from Bio import bgzf
+            self.handle = bgzf.BgzfWriter(path, 'wb')
+        elif compression == 'gzip':
+            import gzip
+            self.handle = gzip.open(path, 'wt')
+        else:
+            self.handle = open(path, 'w')
+        self.n_rows = 0
+
+    def write(self, records, preds):
+        """
+        Append a chunk of results.
+
+        Args:
+            records (pd.DataFrame): VCF records of the chunk.
+            preds (dict): 'ref', 'alt', and 'skew' arrays of shape (n_records, n_features).
+        """
+        table = records.reset_index(drop=True)
+        table['INFO'] = format_info_column(preds, self.feature_ids)
+        text = table.to_csv(None, sep='\t', index=False, header=self.n_rows == 0, quoting=csv.QUOTE_NONE)
+        self.handle.write(text)
+        self.handle.flush()
+        self.n_rows += table.shape[0]
+
+    def close(self):
+        self.handle.close()
+
+class ColumnarResultWriter:
+    """
+    Write raw predictions as a directory of binary columns: one little endian array file
+    per prediction key, plus a tab-separated table of VCF records. Every chunk is appended
+    and flushed, so a crash loses at most the chunk being written. Read with
+    load_columnar_results.
+
+    Args:
+        path (str): Output directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.columns = None
+        self.records = open(os.path.join(path, 'records.tsv'), 'w')
+        self.n_rows = 0
+
+    def write(self, records, preds):
+        """
+        Append a chunk of results.
+
+        Args:
+            records (pd.DataFrame): VCF records of the chunk.
+            preds (dict): Arrays with the records on the first axis.
+        """
+        if self.columns is None:
+            self.columns = {}
+            meta = {}
+            for key, values in preds.items():
+                values = np.asarray(values)
+                meta[key] = {'dtype': values.dtype.newbyteorder('<').str, 'shape': list(values.shape[1:])}
+                self.columns[key] = open(os.path.join(self.path, f'{key}.bin'), 'wb')
+            with open(os.path.join(self.path, 'columns.json'), 'w') as f:
+                json.dump(meta, f)
+        for key, values in preds.items():
+            values = np.ascontiguousarray(values)
+            self.columns[key].write(values.astype(values.dtype.newbyteorder('<'), copy=False).tobytes())
+            self.columns[key].flush()
+        records.to_csv(self.records, sep='\t', index=False, header=self.n_rows == 0, quoting=csv.QUOTE_NONE)
+        self.records.flush()
+        self.n_rows += records.shape[0]
+
+    def close(self):
+        for handle in (self.columns or {}).values():
+            handle.close()
+        self.records.close()
+
+def load_columnar_results(path, mmap=True):
+    """
+    Load raw predictions written by ColumnarResultWriter.
+
+    Rows from a partially written last chunk are dropped.
+
+    Args:
+        path (str): Directory written by ColumnarResultWriter.
+        mmap (bool, optional): Memory-map the prediction arrays. Default is True.
+
+    Returns:
+        dict: Prediction arrays by key, plus the VCF records under 'vcf'.
+    """
+    with open(os.path.join(path, 'columns.json'), 'r') as f:
+        meta = json.load(f)
+    records = pd.read_csv(os.path.join(path, 'records.tsv'), sep='\t', quoting=csv.QUOTE_NONE)
+    results = {}
+    for key, info in meta.items():
+        dtype  = np.dtype(info['dtype'])
+        file_path = os.path.join(path, f'{key}.bin')
+        n_rows = os.path.getsize(file_path) // (dtype.itemsize * int(np.prod(info['shape'])))
+        if mmap:
+            results[key] = np.memmap(file_path, dtype=dtype, mode='r', shape=(n_rows, *info['shape']))
+        else:
+            results[key] = np.fromfile(file_path, dtype=dtype).reshape(-1, *info['shape'])[:n_rows]
+    n_rows = min([records.shape[0]] + [ values.shape[0] for values in results.values() ])
+    results = { key: values[:n_rows] for key, values in results.items() }
+    results['vcf'] = records.iloc[:n_rows]
+    return results
+
+class PickleResultWriter:
+    """
+    Collect raw predictions and save them with torch.save when closed, as a dict of
+    'ref' and 'alt' tensors and the 'vcf' records.
+
+    Args:
+        path (str): Output path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+        self.preds = {}
+
+    def write(self, records, preds):
+        self.records.append(records)
+        for key, values in preds.items():
+            self.preds.setdefault(key, []).append(torch.as_tensor(np.asarray(values)))
+
+    def close(self):
+        results = { key: torch.cat(values, dim=0) for key, values in self.preds.items() }
+        results['vcf'] = pd.concat(self.records) if len(self.records) > 0 else None
+        torch.save(results, self.path)
+
+class BackgroundWriter:
+    """
+    Run a result writer in a background thread so formatting and I/O overlap with inference.
+
+    Chunks are queued and written in order. The queue is bounded, so a slow writer blocks
+    inference instead of letting memory grow. Predictions can be given as a
+    boda.common.pipeline.HostCopy still in progress; the thread waits for the copy, so the
+    inference loop doesn't. Errors in the thread are raised by the next call to write or close.
+
+    Args:
+        writer: An object with write(records, preds) and close() methods.
+        max_pending (int, optional): Maximum number of queued chunks. Default is 8.
+    """
+
+    def __init__(self, writer, max_pending=8):
+        self.writer = writer
+        self.queue  = queue.Queue(maxsize=max_pending)
+        self.error  = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is None:
+                try:
+                    records, preds = item
+                    if hasattr(preds, 'result'):
+                        preds = preds.result()
+                    self.writer.write(records, preds)
+                except BaseException as e:
+                    self.error = e
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError("Result writer failed.") from self.error
+
+    def write(self, records, preds):
+        """
+        Queue a chunk of results.
+
+        Args:
+            records (pd.DataFrame): Records of the chunk.
+            preds (dict or HostCopy): Prediction arrays of the chunk.
+        """
+        self.check()
+        self.queue.put((records, preds))
+
+    def close(self):
+        """
+        Write all queued chunks and close the writer.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()
+        self.check()
+
+class ChunkReorderBuffer:
+    """
+    Restore file order of results streamed from StreamingVcfDataset by DataLoader workers.
+
+    Each worker reads whole chunks in increasing order, and chunk c goes to shard
+    c % n_shards. Workers mark the end of every chunk, including chunks with no records
+    left after filtering. Results are held until every earlier chunk of the job is marked
+    complete, and then passed on in file order. Memory therefore stays around one chunk
+    per worker.
+
+    Args:
+        emit (callable): Called with (records, preds) for each released chunk.
+        shard_ids (list): Shards read by this job.
+        n_shards (int): Total number of shards across jobs and workers.
+    """
+
+    def __init__(self, emit, shard_ids, n_shards):
+        self.emit = emit
+        self.shard_ids = set(shard_ids)
+        self.n_shards = n_shards
+        self.completed = {}
+        self.pending = {}
+        self.next_chunk = min(shard_ids)
+
+    def push(self, chunk_ids, records, preds):
+        """
+        Add results for a batch.
+
+        Args:
+            chunk_ids (numpy.ndarray): Chunk of each record.
+            records (pd.DataFrame): Records of the batch.
+            preds (dict): Prediction arrays of the batch.
+        """
+        chunk_ids = np.asarray(chunk_ids)
+        for chunk in np.unique(chunk_ids):
+            members = np.nonzero(chunk_ids == chunk)[0]
+            self.pending.setdefault(int(chunk), []).append(
+                (records.iloc[members], { key: values[members] for key, values in preds.items() })
+            )
+
+    def complete(self, chunk_ids):
+        """
+        Mark chunks as complete and release the results that are ready.
+
+        Args:
+            chunk_ids (list): Chunks whose records have all been pushed.
+        """
+        for chunk in chunk_ids:
+            shard = int(chunk) % self.n_shards
+            self.completed[shard] = max(self.completed.get(shard, -1), int(chunk))
+        self.release()
+
+    def release(self, finished=False):
+        while len(self.pending) > 0:
+            chunk = self.next_chunk
+            if not finished and self.completed.get(chunk % self.n_shards, -1) < chunk:
+                break
+            for records, preds in self.pending.pop(chunk, []):
+                self.emit(records, preds)
+            self.next_chunk += 1
+            while self.next_chunk % self.n_shards not in self.shard_ids:
+                self.next_chunk += 1
+
+    def finish(self):
+        """
+        Release all remaining results.
+        """
+        self.release(finished=True)
@@ -9,6 +9,7 @@ import tempfile
 import tarfile
 import subprocess
 import shutil
+import functools
 
 from collections.abc import Iterable
 
@@ -103,12 +104,20 @@ def dna2tensor(sequence_str, vocab_list=constants.STANDARD_NT):
     Returns:
         torch.Tensor: One-hot encoded tensor representation of the sequence.
     """
-    seq_tensor = np.zeros((len(vocab_list), len(sequence_str)))
-    for letterIdx, letter in enumerate(sequence_str):
-        seq_tensor[vocab_list.index(letter), letterIdx] = 1
-    seq_tensor = torch.Tensor(seq_tensor)
-    return seq_tensor
-    
+    return list2batch([sequence_str], vocab_list)[0]
+
+def list2batch(sequence_list, vocab_list=constants.STANDARD_NT):
+    """
+    Convert a list of equal length DNA sequences to a batch of one-hot encoded tensors.
+
+    Args:
+        sequence_list (list): List of DNA sequence strings.
+        vocab_list (list): List of DNA nucleotide characters.
+
+    Returns:
+        torch.Tensor: One-hot encoded tensor of shape (n_sequences, len(vocab_list), sequence_length).
+    """
+    return tokens2tensor(dna2tokens(sequence_list, vocab_list), num_classes=len(vocab_list))
 
 def create_paddingTensors(num_sequences, padding_len, num_st_samples=1, for_multi_sampling=True):
     """
@@ -250,6 +259,169 @@ def row_pad_sequence(row,
     else:
         return sequence
 
+@functools.lru_cache(maxsize=None)
+def _encode_table(vocab):
+    table = bytearray([len(vocab)] * 256)
+    for i, letter in enumerate(vocab):
+        table[ord(letter)] = i
+    return bytes(table)
+
+@functools.lru_cache(maxsize=None)
+def _decode_table(vocab, unknown='N'):
+    table = bytearray(unknown.encode('ascii') * 256)
+    for i, letter in enumerate(vocab):
+        table[i] = ord(letter)
+    return bytes(table)
+
+def dna2tokens(sequences, vocab_list=constants.STANDARD_NT):
+    """
+    Convert equal length DNA sequences to token indices with a lookup table.
+
+    Args:
+        sequences (list): List of DNA sequence strings of the same length.
+        vocab_list (list, optional): List of DNA nucleotide characters. Defaults to constants.STANDARD_NT.
+
+    Returns:
+        numpy.ndarray: A uint8 array of shape (n_sequences, sequence_length). Characters
+                       outside of vocab_list map to len(vocab_list).
+    """
+    n_seqs  = len(sequences)
+    joined  = ''.join(sequences).encode('ascii').translate(_encode_table(tuple(vocab_list)))
+    if n_seqs > 0 and len(joined) % n_seqs != 0:
+        raise ValueError('Sequences must have the same length')
+    seq_len = len(joined) // n_seqs if n_seqs > 0 else 0
+    return np.frombuffer(joined, dtype=np.uint8).reshape(n_seqs, seq_len).copy()
+
+def tokens2dna(tokens, vocab_list=constants.STANDARD_NT, unknown='N'):
+    """
+    Convert token indices to DNA sequences with a lookup table.
+
+    Args:
+        tokens (numpy.ndarray or torch.Tensor): Integer array of shape (n_sequences, sequence_length).
+        vocab_list (list, optional): List of DNA nucleotide characters. Defaults to constants.STANDARD_NT.
+        unknown (str, optional): Character for tokens equal to len(vocab_list). Defaults to 'N'.
+
+    Returns:
+        list: List of DNA sequence strings.
+    """
+    if torch.is_tensor(tokens):
+        tokens = tokens.cpu().numpy()
+    tokens = np.asarray(tokens, dtype=np.uint8)
+    n_seqs, seq_len = tokens.shape
+    buffer = tokens.tobytes().translate(_decode_table(tuple(vocab_list), unknown)).decode('ascii')
+    return [ buffer[i:i+seq_len] for i in range(0, n_seqs*seq_len, seq_len) ] \
+           if seq_len > 0 else [ '' for _ in range(n_seqs) ]
+
+def onehot2tokens(batch):
+    """
+    Convert one-hot encoded sequences to token indices.
+
+    Args:
+        batch (numpy.ndarray or torch.Tensor): Tensor of shape (batch_size, n_channels, sequence_length).
+
+    Returns:
+        numpy.ndarray: A uint8 array of shape (batch_size, sequence_length) holding the argmax channel.
+    """
+    if torch.is_tensor(batch):
+        return batch.argmax(dim=1).to(torch.uint8).cpu().numpy()
+    return np.asarray(batch).argmax(axis=1).astype(np.uint8)
+
+def pack_tokens(tokens):
+    """
+    Pack 2-bit token indices four to a byte.
+
+    Args:
+        tokens (numpy.ndarray or torch.Tensor): Integer array of shape (n_sequences, sequence_length)
+            with values below 4.
+
+    Returns:
+        numpy.ndarray: A uint8 array of shape (n_sequences, ceil(sequence_length / 4)). The first
+                       token of each group is held in the highest bits.
+    """
+    if torch.is_tensor(tokens):
+        tokens = tokens.cpu().numpy()
+    tokens = np.asarray(tokens, dtype=np.uint8)
+    if (tokens > 3).any():
+        raise ValueError('Only tokens below 4 can be packed')
+    n_seqs, seq_len = tokens.shape
+    padded = np.zeros((n_seqs, -(-seq_len // 4) * 4), dtype=np.uint8)
+    padded[:, :seq_len] = tokens
+    padded = padded.reshape(n_seqs, -1, 4)
+    return (padded[...,0] << 6) | (padded[...,1] << 4) | (padded[...,2] << 2) | padded[...,3]
+
+def unpack_tokens(packed, seq_len):
+    """
+    Unpack token indices packed with pack_tokens.
+
+    Args:
+        packed (numpy.ndarray): A uint8 array of shape (n_sequences, ceil(seq_len / 4)).
+        seq_len (int): Length of the packed sequences.
+
+    Returns:
+        numpy.ndarray: A uint8 array of shape (n_sequences, seq_len).
+    """
+    packed = np.asarray(packed, dtype=np.uint8)
+    shifts = np.array([6, 4, 2, 0], dtype=np.uint8)
+    tokens = (packed[..., None] >> shifts) & 3
+    return tokens.reshape(packed.shape[0], packed.shape[1] * 4)[:, :seq_len]
+
+def pad_dna2tokens(sequences,
+                   padded_seq_len=400,
+                   upStreamSeq=constants.MPRA_UPSTREAM,
+                   downStreamSeq=constants.MPRA_DOWNSTREAM,
+                   vocab_list=constants.STANDARD_NT):
+    """
+    Pad DNA sequences to a specified length and convert them to token indices.
+    Padding matches row_pad_sequence, but sequences are processed in groups of equal length.
+
+    Args:
+        sequences (list): List of DNA sequence strings.
+        padded_seq_len (int, optional): Desired padded sequence length. Defaults to 400.
+        upStreamSeq (str, optional): Upstream sequence. Defaults to constants.MPRA_UPSTREAM.
+        downStreamSeq (str, optional): Downstream sequence. Defaults to constants.MPRA_DOWNSTREAM.
+        vocab_list (list, optional): List of DNA nucleotide characters. Defaults to constants.STANDARD_NT.
+
+    Returns:
+        numpy.ndarray: A uint8 array of shape (n_sequences, padded_seq_len).
+    """
+    sequences = np.asarray(sequences, dtype=object)
+    seq_lens  = np.fromiter((len(seq) for seq in sequences), dtype=np.int64, count=len(sequences))
+    out_len   = max(padded_seq_len, seq_lens.max(initial=0))
+    if np.any((seq_lens != out_len) & (seq_lens > padded_seq_len)):
+        raise ValueError('Sequences longer than padded_seq_len must all have the same length')
+    
+    tokens = np.empty((len(sequences), out_len), dtype=np.uint8)
+    for seq_len in np.unique(seq_lens):
+        members = np.nonzero(seq_lens == seq_len)[0]
+        padding_len = out_len - seq_len
+        assert padding_len <= (len(upStreamSeq) + len(downStreamSeq)), 'Not enough padding available'
+        up_len   = padding_len // 2
+        up_pad   = upStreamSeq[len(upStreamSeq)-up_len:] if up_len > 0 else ''
+        down_pad = downStreamSeq[:padding_len - up_len]
+        tokens[members, :len(up_pad)] = dna2tokens([up_pad], vocab_list)
+        tokens[members, len(up_pad):len(up_pad)+seq_len] = dna2tokens(sequences[members].tolist(), vocab_list)
+        tokens[members, len(up_pad)+seq_len:] = dna2tokens([down_pad], vocab_list)
+    return tokens
+
+def tokens2tensor(tokens, num_classes=4, allow_unknown=False):
+    """
+    Convert token indices to one-hot encoded tensors.
+
+    Args:
+        tokens (numpy.ndarray or torch.Tensor): Integer array of shape (n_sequences, sequence_length).
+        num_classes (int, optional): Size of the vocabulary. Defaults to 4.
+        allow_unknown (bool, optional): Whether tokens equal to num_classes become all-zero columns
+            instead of raising an error. Defaults to False.
+
+    Returns:
+        torch.Tensor: A float32 tensor of shape (n_sequences, num_classes, sequence_length).
+    """
+    tokens = torch.as_tensor(tokens if torch.is_tensor(tokens) else np.asarray(tokens)).long()
+    if not allow_unknown and (tokens >= num_classes).any():
+        raise ValueError('Found tokens outside of the vocabulary')
+    onehot = F.one_hot(tokens, num_classes=num_classes+1)[..., :num_classes]
+    return onehot.transpose(1,2).type(torch.float32)
+
 def row_dna2tensor(row, in_column_name='padded_seq' , vocab=constants.STANDARD_NT):
     """
     Convert a DNA sequence row to a one-hot encoded tensor.
@@ -262,10 +434,7 @@ def row_dna2tensor(row, in_column_name='padded_seq' , vocab=constants.STANDARD_N
     Returns:
         torch.Tensor: One-hot encoded tensor representation of the sequence.
     """
-    sequence_str = row[in_column_name]
-    seq_idxs = torch.tensor([vocab.index(letter) for letter in sequence_str])
-    sequence_tensor = F.one_hot(seq_idxs, num_classes=4).transpose(1,0)
-    return sequence_tensor.type(torch.float32)
+    return dna2tensor(row[in_column_name], vocab)
 
 def generate_all_onehots(k=4, num_classes=4):
     """
@@ -320,11 +489,7 @@ def batch2list(batch, vocab_list=constants.STANDARD_NT):
     assert len(batch.shape) == 3, "Expects 3D tensor [batch, channel, length]"
     assert batch.shape[1] == len(constants.STANDARD_NT), 'Channel dim size must equal length of vocab_list'
     
-    batch_size = batch.shape[0]
-    idx_tensor = torch.argmax(batch, dim=1)
-    for seq_idx in range(batch_size):
-        idxs = idx_tensor[seq_idx, :].numpy()
-        yield ''.join([ vocab_list[idx] for idx in idxs ])
+    yield from tokens2dna(onehot2tokens(batch), vocab_list)
     
     
 def batch2fasta(batch, file_name):
@@ -342,16 +507,8 @@ def batch2fasta(batch, file_name):
         The batch should have the shape (batch_size, sequence_length, num_nucleotides).
     """
     with open(file_name, 'w') as ofile:
-        batch_size = batch.shape[0]
-        #seq_list = []
-        for seq_idx in range(batch_size):
+        for seq_idx, sequence_str in enumerate(tokens2dna(onehot2tokens(batch))):
             seq_name = 'sequence_' + str(seq_idx)
-            seq_tensor = batch[seq_idx, :, :]
-            idxs = torch.argmax(seq_tensor, dim=0).numpy()
-            sequence_str = ''
-            for idx in idxs:
-                sequence_str += constants.STANDARD_NT[idx]
-            #seq_list.append(sequence_str)
             ofile.write(">" + seq_name + "\n" + sequence_str + "\n")
             
 def reverse_complement_onehot(x, nt_order=constants.STANDARD_NT, 
@@ -380,6 +537,34 @@ def reverse_complement_onehot(x, nt_order=constants.STANDARD_NT,
     
     return torch.flip(x[..., permutation, :], dims=[-1])
 
+def reverse_complement_tokens(x, nt_order=constants.STANDARD_NT, 
+                              complements=constants.DNA_COMPLEMENTS):
+    """
+    Returns the reverse complement of a token-indexed DNA sequence tensor.
+    
+    Parameters
+    ----------
+    x : torch.tensor
+        An integer tensor of token indices with sequence length in the last dimension. 
+        Tokens equal to len(nt_order) are left as is.
+    
+    nt_order: list
+        A list of nucleotide tokens with same ordering as the token indices
+        
+    complements: dict
+        A dictionary specifying complementary nucleotides, one-to-one.
+        
+    Returns
+    -------
+    torch.tensor
+    """
+    
+    comp_alphabet = [ complements[nt] for nt in nt_order ]
+    permutation = [ nt_order.index(nt) for nt in comp_alphabet ] + [ len(nt_order) ]
+    permutation = torch.tensor(permutation, dtype=x.dtype, device=x.device)
+    
+    return torch.flip(permutation[x.long()], dims=[-1])
+
 def align_to_alphabet(x, in_order=['A','C','G','T'], out_order=constants.STANDARD_NT):
     """
     Reorder the channel dimension of a tensor (e.g. of shape [..., C, L])
@@ -535,12 +720,17 @@ def model_fn(model_dir):
         model_dir (str): Path to the model directory.
 
     Returns:
-        torch.nn.Module: Loaded model in evaluation mode.
+        torch.nn.Module: Loaded model in evaluation mode. Quantized artifacts load as a 
+        QuantizedModel for CPU inference.
     """
     checkpoint = torch.load(os.path.join(model_dir,'torch_checkpoint.pt'))
     model_module = getattr(_model, checkpoint['model_module'])
     model        = model_module(**vars(checkpoint['model_hparams']))
-    model.load_state_dict(checkpoint['model_state_dict'])
+    if 'quantization' in checkpoint:
+        model = _model.restore_quantized(model, checkpoint['quantization'], checkpoint['model_state_dict'])
+        print(f'Loaded int8 model quantized for {model.engine}', file=sys.stderr)
+    else:
+        model.load_state_dict(checkpoint['model_state_dict'])
     print(f'Loaded model from {checkpoint["timestamp"]} in eval mode')
     model.eval()
     return model
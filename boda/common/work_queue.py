@@ -0,0 +1,379 @@
+import os
+import gzip
+import json
+import time
+import shutil
+import socket
+import sqlite3
+from collections import namedtuple
+
+WorkChunk = namedtuple('WorkChunk', ['chunk_id', 'start', 'stop'])
+
+def chunk_output_path(output, chunk_id):
+    """
+    Get the output path of a work queue chunk.
+
+    Args:
+        output (str): Final output path.
+        chunk_id (int): Chunk index.
+
+    Returns:
+        str: Path for the chunk's output.
+    """
+    return f'{output}.chunk{chunk_id:06d}'
+
+class WorkQueue:
+    """
+    A work queue of index ranges shared by workers through an SQLite file.
+
+    The first worker splits [0, n_items) into chunks. Workers on any number of processes
+    or nodes then claim chunks one at a time, so faster workers take more chunks. Claims
+    and completions are recorded, so an interrupted run picks up the remaining chunks.
+    The SQLite file must be on a filesystem with working file locks.
+
+    Args:
+        db_path (str): Path to the SQLite file. Created if missing.
+        stale_after (float, optional): Seconds after which a claimed but unfinished chunk
+            can be claimed again, e.g. after a worker was preempted. Default is None (never).
+        timeout (float, optional): Seconds to wait for a lock held by another worker. Default is 600.
+
+    Methods:
+        initialize(n_items, chunk_size): Create the chunks, or check they match an existing queue.
+        claim(worker): Claim the next chunk.
+        complete(chunk_id, output): Mark a chunk as done.
+        release(chunk_id): Return a claimed chunk to the queue.
+        claims(worker): Iterate over claimed chunks until the queue is empty.
+        progress(): Count chunks by status.
+        outputs(): Outputs of all chunks in order.
+    """
+
+    def __init__(self, db_path, stale_after=None, timeout=600.):
+        self.db_path = db_path
+        self.stale_after = stale_after
+        self.timeout = timeout
+        self._connection = None
+        self._completed = set()
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS chunks (chunk_id INTEGER PRIMARY KEY, start INTEGER, stop INTEGER, ' + \
+                                     'status TEXT, worker TEXT, claimed_at REAL, finished_at REAL, output TEXT)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        return self._connection
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    def transaction(self, statements):
+        """
+        Run a function inside an immediate (write-locked) transaction.
+
+        Args:
+            statements (callable): Called with the connection.
+
+        Returns:
+            object: The return value of statements.
+        """
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = statements(connection)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return result
+
+    def initialize(self, n_items, chunk_size):
+        """
+        Split [0, n_items) into chunks of chunk_size items, unless the queue already exists.
+
+        Args:
+            n_items (int): Number of work items.
+            chunk_size (int): Number of items per chunk.
+
+        Raises:
+            ValueError: If an existing queue was made for a different number of items or chunk size.
+        """
+        layout = json.dumps({'n_items': int(n_items), 'chunk_size': int(chunk_size)})
+        def statements(connection):
+            row = connection.execute("SELECT value FROM meta WHERE key = 'layout'").fetchone()
+            if row is not None:
+                if row[0] != layout:
+                    raise ValueError(f"Work queue {self.db_path} was made for {row[0]}, not {layout}.")
+                return
+            connection.execute("INSERT INTO meta (key, value) VALUES ('layout', ?)", (layout,))
+            connection.executemany(
+                "INSERT INTO chunks (chunk_id, start, stop, status) VALUES (?, ?, ?, 'pending')",
+                [ (i, start, min(start + chunk_size, n_items)) for i, start in enumerate(range(0, n_items, chunk_size)) ]
+            )
+        self.transaction(statements)
+
+    def claim(self, worker=None):
+        """
+        Claim the next pending chunk.
+
+        Args:
+            worker (str, optional): Worker name to record. Defaults to host:pid.
+
+        Returns:
+            WorkChunk: The claimed chunk, or None if no chunk is left.
+        """
+        worker = f'{socket.gethostname()}:{os.getpid()}' if worker is None else worker
+        def statements(connection):
+            now = time.time()
+            stale = -1. if self.stale_after is None else now - self.stale_after
+            row = connection.execute(
+                "SELECT chunk_id, start, stop FROM chunks WHERE status = 'pending' " + \
+                "OR (status = 'claimed' AND claimed_at < ?) ORDER BY chunk_id LIMIT 1", (stale,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE chunks SET status = 'claimed', worker = ?, claimed_at = ? WHERE chunk_id = ?",
+                               (worker, now, row[0]))
+            return WorkChunk(*row)
+        return self.transaction(statements)
+
+    def complete(self, chunk_id, output=None):
+        """
+        Mark a chunk as done.
+
+        Args:
+            chunk_id (int): Chunk index.
+            output (str, optional): Path of the chunk's output.
+        """
+        self.transaction(lambda connection: connection.execute(
+            "UPDATE chunks SET status = 'done', finished_at = ?, output = ? WHERE chunk_id = ?",
+            (time.time(), output, chunk_id)
+        ))
+        self._completed.add(chunk_id)
+
+    def release(self, chunk_id):
+        """
+        Return a claimed chunk to the queue.
+
+        Args:
+            chunk_id (int): Chunk index.
+        """
+        self.transaction(lambda connection: connection.execute(
+            "UPDATE chunks SET status = 'pending', worker = NULL, claimed_at = NULL WHERE chunk_id = ? AND status = 'claimed'",
+            (chunk_id,)
+        ))
+
+    def claims(self, worker=None):
+        """
+        Claim chunks until the queue is empty. A chunk that is not completed before the
+        loop moves on (e.g. because processing raised) is released.
+
+        Args:
+            worker (str, optional): Worker name to record. Defaults to host:pid.
+
+        Yields:
+            WorkChunk: Claimed chunks.
+        """
+        while True:
+            chunk = self.claim(worker)
+            if chunk is None:
+                return
+            try:
+                yield chunk
+            finally:
+                if chunk.chunk_id not in self._completed:
+                    self.release(chunk.chunk_id)
+
+    def progress(self):
+        """
+        Count chunks by status.
+
+        Returns:
+            dict: Number of 'pending', 'claimed', and 'done' chunks.
+        """
+        counts = dict(self.connection.execute("SELECT status, COUNT(*) FROM chunks GROUP BY status").fetchall())
+        return { status: counts.get(status, 0) for status in ['pending', 'claimed', 'done'] }
+
+    def outputs(self):
+        """
+        Get the outputs of all chunks in order.
+
+        Returns:
+            list: Output paths.
+
+        Raises:
+            RuntimeError: If some chunks are not done.
+        """
+        rows = self.connection.execute("SELECT chunk_id, status, output FROM chunks ORDER BY chunk_id").fetchall()
+        unfinished = [ chunk_id for chunk_id, status, _ in rows if status != 'done' ]
+        if len(unfinished) > 0:
+            raise RuntimeError(f"{len(unfinished)} of {len(rows)} chunks are not done, e.g. chunk {unfinished[0]}.")
+        return [ output for _, _, output in rows ]
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+#####################
+# Merging of chunks #
+#####################
+
+def merge_hdf5(paths, output, block_size=2**16):
+    """
+    Merge per-chunk HDF5 outputs into one file.
+
+    Datasets with a 'written_rows' attribute of (start, stop) hold full size arrays
+    with only those rows written by the chunk. Those rows are copied into place, and the
+    datasets keep their chunking and compression. All other datasets are concatenated
+    along the first axis, in the order of paths. Datasets may be nested in groups, and
+    file and group attributes are taken from the first chunk.
+
+    Args:
+        paths (list): Chunk outputs in order.
+        output (str): Merged output path.
+        block_size (int, optional): Number of rows copied at a time. Default is 2**16.
+    """
+    import h5py
+
+    def datasets(f):
+        found = []
+        f.visititems(lambda name, item: found.append(name) if isinstance(item, h5py.Dataset) else None)
+        return found
+
+    with h5py.File(paths[0], 'r') as first, h5py.File(output, 'w') as merged:
+        merged.attrs.update(first.attrs)
+        for name in datasets(first):
+            dset = first[name]
+            kwargs = {}
+            if 'written_rows' in dset.attrs:
+                shape = dset.shape
+                if dset.chunks is not None:
+                    kwargs = {'chunks': dset.chunks, 'compression': dset.compression, 
+                              'compression_opts': dset.compression_opts, 'shuffle': dset.shuffle}
+            else:
+                n_rows = 0
+                for path in paths:
+                    with h5py.File(path, 'r') as f:
+                        n_rows += f[name].shape[0]
+                shape = (n_rows, *dset.shape[1:])
+            merged.create_dataset(name, shape, dtype=dset.dtype, fillvalue=dset.fillvalue, **kwargs)
+            merged[name].parent.attrs.update(dset.parent.attrs)
+            for key, value in dset.attrs.items():
+                if key != 'written_rows':
+                    merged[name].attrs[key] = value
+
+        offsets = { name: 0 for name in datasets(merged) }
+        for path in paths:
+            with h5py.File(path, 'r') as f:
+                for name in datasets(f):
+                    dset = f[name]
+                    if 'written_rows' in dset.attrs:
+                        start, stop = [ int(x) for x in dset.attrs['written_rows'] ]
+                    else:
+                        start, stop = offsets[name], offsets[name] + dset.shape[0]
+                        offsets[name] = stop
+                    src_start = start if 'written_rows' in dset.attrs else 0
+                    for i in range(0, stop - start, block_size):
+                        n = min(block_size, stop - start - i)
+                        merged[name][start+i:start+i+n] = dset[src_start+i:src_start+i+n]
+
+def merge_tables(paths, output):
+    """
+    Merge per-chunk tab-separated outputs with a header line, keeping the first header.
+    Plain, gzip, and bgzip inputs are supported, and the output uses the compression of the first input.
+
+    Args:
+        paths (list): Chunk outputs in order.
+        output (str): Merged output path.
+    """
+    from .bgzf import is_bgzf
+
+    def is_gzip(path):
+        with open(path, 'rb') as f:
+            return f.read(2) == b'\x1f\x8b'
+
+    def open_text(path):
+        return gzip.open(path, 'rt') if is_gzip(path) else open(path, 'r')
+
+    if is_bgzf(paths[0]):
+        from Bio import bgzf
+        out_handle = bgzf.BgzfWriter(output, 'wb')
+    elif is_gzip(paths[0]):
+        out_handle = gzip.open(output, 'wt')
+    else:
+        out_handle = open(output, 'w')
+
+    with out_handle:
+        for i, path in enumerate(paths):
+            with open_text(path) as f:
+                header = f.readline()
+                if i == 0:
+                    out_handle.write(header)
+                for block in iter(lambda: f.read(2**24), ''):
+                    out_handle.write(block)
+
+def merge_columnar(paths, output):
+    """
+    Merge per-chunk outputs of ColumnarResultWriter.
+
+    Args:
+        paths (list): Chunk output directories in order.
+        output (str): Merged output directory.
+    """
+    os.makedirs(output, exist_ok=True)
+    shutil.copy(os.path.join(paths[0], 'columns.json'), os.path.join(output, 'columns.json'))
+    with open(os.path.join(paths[0], 'columns.json'), 'r') as f:
+        keys = list(json.load(f).keys())
+    for key in keys:
+        with open(os.path.join(output, f'{key}.bin'), 'wb') as out_handle:
+            for path in paths:
+                with open(os.path.join(path, f'{key}.bin'), 'rb') as f:
+                    shutil.copyfileobj(f, out_handle)
+    merge_tables([ os.path.join(path, 'records.tsv') for path in paths ], os.path.join(output, 'records.tsv'))
+
+def merge_torch(paths, output):
+    """
+    Merge per-chunk PT pickles of tensors and DataFrames by concatenation.
+
+    Args:
+        paths (list): Chunk outputs in order.
+        output (str): Merged output path.
+    """
+    import torch
+    import pandas as pd
+
+    parts = [ torch.load(path) for path in paths ]
+    merged = {}
+    for key, value in parts[0].items():
+        values = [ part[key] for part in parts ]
+        if torch.is_tensor(value):
+            merged[key] = torch.cat(values, dim=0)
+        elif isinstance(value, pd.DataFrame):
+            merged[key] = pd.concat(values)
+        else:
+            merged[key] = values
+    torch.save(merged, output)
+
+def merge_outputs(paths, output):
+    """
+    Merge per-chunk outputs of sat_mut.py, contrib_score.py, genome_tracks.py, or vcf_predict.py, detecting the format from the first chunk.
+
+    Args:
+        paths (list): Chunk outputs in order.
+        output (str): Merged output path.
+    """
+    assert len(paths) > 0, "Nothing to merge."
+    first = paths[0]
+    if os.path.isdir(first):
+        merge_columnar(paths, output)
+        return
+    with open(first, 'rb') as f:
+        magic = f.read(8)
+    if magic == b'\x89HDF\r\n\x1a\n':
+        merge_hdf5(paths, output)
+    elif magic[:2] == b'PK':
+        merge_torch(paths, output)
+    else:
+        merge_tables(paths, output)
@@ -1,9 +1,13 @@
 from .mpra_datamodule import MPRA_DataModule
-from .fasta_datamodule import FastaDataset, Fasta, VcfDataset, VCF
+from .fasta_datamodule import FastaDataset, Fasta, VcfDataset, StreamingVcfDataset, VCF, WindowExpander, load_fasta, collate_streaming_vcf
+from .genome_store import PackedFasta, IndexedFasta, compile_fasta
 from .table_datamodule import SeqDataModule
+from .shard_datamodule import ShardedMPRA_DataModule, ShardedMPRADataset, write_mpra_shards
 
 __all__ = [
     'MPRA_DataModule',
-    'Fasta', 'FastaDataset', 'VcfDataset', 'VCF', 
-    'SeqDataModule'
+    'Fasta', 'FastaDataset', 'VcfDataset', 'StreamingVcfDataset', 'VCF', 'WindowExpander', 'collate_streaming_vcf', 
+    'PackedFasta', 'IndexedFasta', 'compile_fasta', 'load_fasta',
+    'SeqDataModule',
+    'ShardedMPRA_DataModule', 'ShardedMPRADataset', 'write_mpra_shards'
 ]
\ No newline at end of file
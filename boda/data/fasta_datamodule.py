@@ -1,5 +1,8 @@
+import io
+import os
 import sys
 import argparse
+import itertools
 import tempfile
 import time
 import gzip
@@ -15,9 +18,10 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import lightning.pytorch as pl
-from torch.utils.data import random_split, DataLoader, TensorDataset, ConcatDataset, Dataset
+from torch.utils.data import random_split, DataLoader, TensorDataset, ConcatDataset, Dataset, IterableDataset
 
 from ..common import constants, utils
+from .genome_store import PackedFasta, IndexedFasta, is_packed_genome, is_indexed_fasta, _code_table, _mask_runs
 
 def alphabet_onehotizer(seq, alphabet):
     """
@@ -37,6 +41,61 @@ def alphabet_onehotizer(seq, alphabet):
     
     return char_array == alph_array
 
+def contig_codes(contig, start, end, n_tokens):
+    """
+    Get uint8 tokens for a region of a contig.
+
+    Args:
+        contig: A contig from a FASTA object. Either a one-hot array or an object with a `codes` method.
+        start (int): Start of the region, 0-based inclusive.
+        end (int): End of the region, 0-based exclusive.
+        n_tokens (int): Size of the alphabet.
+
+    Returns:
+        np.ndarray: A uint8 array of tokens, n_tokens where no token is set.
+    """
+    if hasattr(contig, 'codes'):
+        return contig.codes(start, end)
+    onehot = contig[:, start:end]
+    return np.where(onehot.any(axis=0), onehot.argmax(axis=0), n_tokens).astype(np.uint8)
+
+def contig_n_runs(contig):
+    """
+    Get the intervals of a contig that fall outside of the alphabet (e.g. N).
+
+    Args:
+        contig: A contig from a FASTA object. Either a one-hot array or an object with an `n_runs` attribute.
+
+    Returns:
+        np.ndarray: An (n_runs, 2) array of half-open [start, end) intervals.
+    """
+    if hasattr(contig, 'n_runs'):
+        return contig.n_runs
+    return _mask_runs( ~np.asarray(contig).any(axis=0) )
+
+def count_in_runs(runs, starts, ends):
+    """
+    Count the positions of each interval that fall within a set of runs.
+
+    Args:
+        runs (np.ndarray): Sorted, non-overlapping (n_runs, 2) half-open intervals.
+        starts (np.ndarray): Interval starts, 0-based inclusive.
+        ends (np.ndarray): Interval ends, 0-based exclusive.
+
+    Returns:
+        np.ndarray: Number of positions of each interval covered by runs.
+    """
+    run_lens = runs[:,1] - runs[:,0]
+    past_len = np.concatenate([[0], np.cumsum(run_lens)])
+    
+    def covered_before(x):
+        run_idx = np.searchsorted(runs[:,0], x, side='right') - 1
+        clipped = np.maximum(run_idx, 0)
+        partial = np.minimum(x - runs[clipped,0], run_lens[clipped]) if runs.shape[0] > 0 else 0
+        return np.where(run_idx >= 0, past_len[clipped] + partial, 0)
+    
+    return covered_before(ends) - covered_before(starts)
+
 class OneHotSlicer(nn.Module):
     """
     A PyTorch module that slices the one-hot encoded input along specified dimensions.
@@ -103,6 +162,59 @@ class OneHotSlicer(nn.Module):
                  .unflatten(1,(self.in_channels, self.kernel_size))
         return hook
 
+class WindowExpander(nn.Module):
+    """
+    A PyTorch module that expands batches of token-coded spans into one-hot windows on
+    the device that holds the batch.
+
+    Windows are taken as strided views of the one-hot span, so only the compact uint8
+    spans need to be sent from the host. Reverse complements are computed by indexing
+    the complement channel order and flipping, rather than by matrix multiplication.
+
+    Args:
+        alphabet (list[str]): Alphabet used to code the spans. Tokens equal to len(alphabet)
+            expand to all-zero columns.
+        window_size (int): Size of the windows.
+        step_size (int, optional): Step size between windows. Default is 1.
+        reverse_complements (bool, optional): Whether to append the reverse complement of every
+            window. Default is True.
+        complement_dict (dict[str, str], optional): Dictionary of nucleotide complements. Default is constants.DNA_COMPLEMENTS.
+
+    Returns:
+        torch.Tensor: Windows of shape (batch_size, n_windows, len(alphabet), window_size). With
+                      reverse_complements, the reverse strand windows follow the forward windows.
+    """
+    
+    def __init__(self, alphabet, window_size, step_size=1, 
+                 reverse_complements=True, complement_dict=constants.DNA_COMPLEMENTS):
+        """
+        Initializes the WindowExpander module.
+        """
+        super().__init__()
+        self.n_tokens    = len(alphabet)
+        self.window_size = window_size
+        self.step_size   = step_size
+        self.reverse_complements = reverse_complements
+        complement_index = [ alphabet.index(complement_dict[nt]) for nt in alphabet ]
+        self.register_buffer('complement_index', torch.tensor(complement_index, dtype=torch.long))
+        
+    def forward(self, codes):
+        """
+        Expands token-coded spans into one-hot windows.
+
+        Args:
+            codes (torch.Tensor): Integer tensor of shape (batch_size, span_length).
+
+        Returns:
+            torch.Tensor: Float tensor of shape (batch_size, n_windows, n_tokens, window_size).
+        """
+        onehot = F.one_hot(codes.long(), self.n_tokens+1)[..., :self.n_tokens]
+        windows = onehot.unfold(1, self.window_size, self.step_size)
+        if self.reverse_complements:
+            rc = torch.flip(windows[:, :, self.complement_index], dims=[-1])
+            windows = torch.cat([windows, rc], dim=1)
+        return windows.float()
+
 class Fasta:
     """
     A class for reading and processing sequences from a FASTA file.
@@ -147,7 +259,8 @@ class Fasta:
         self.contig_descriptions = {}
         
         print('pre-reading fasta into memory', file=sys.stderr)
-        with open(self.fasta_path, 'r') as f:
+        opener = gzip.open if self.fasta_path.endswith('gz') else open
+        with opener(self.fasta_path, 'rt') as f:
             fa = np.array(
                 [ x.rstrip() for x in tqdm.tqdm(f.readlines()) ]
             )
@@ -181,6 +294,27 @@ class Fasta:
                     
         print('done',file=sys.stderr)
 
+def load_fasta(fasta_path, **kwargs):
+    """
+    Open a reference genome with the fastest available reader.
+
+    Packed genomes written by compile_fasta are memory-mapped with PackedFasta,
+    FASTA files with a .fai index (plain or bgzip-compressed) are read on demand
+    with IndexedFasta, and anything else, including plain gzip files even if a .fai
+    sits next to them, is read into memory with Fasta.
+
+    Args:
+        fasta_path (str): Path to a FASTA file or packed genome.
+        **kwargs: Additional arguments passed to the reader.
+
+    Returns:
+        Fasta, PackedFasta, or IndexedFasta: A reader exposing a `fasta` mapping of contig keys to (n_tokens, length) arrays.
+    """
+    if is_packed_genome(fasta_path):
+        return PackedFasta(fasta_path, **kwargs)
+    if is_indexed_fasta(fasta_path):
+        return IndexedFasta(fasta_path, **kwargs)
+    return Fasta(fasta_path, **kwargs)
 
 class FastaDataset(Dataset):
     """
@@ -194,6 +328,9 @@ class FastaDataset(Dataset):
         alphabet (str, optional): The alphabet of characters used for encoding sequences. Default is constants.STANDARD_NT.
         complement_dict (dict, optional): A dictionary mapping characters to their complements. Default is constants.DNA_COMPLEMENTS.
         pad_final (bool, optional): Whether to pad the final window if it doesn't fit perfectly within the sequence. Default is False.
+        max_n_fraction (float, optional): If provided, leave out windows where more than this fraction of
+            positions fall outside of the alphabet (e.g. N). Default is None.
+        as_codes (bool, optional): Whether indexing returns uint8 tokens instead of one-hot encodings. Default is False.
 
     Attributes:
         fasta (Fasta): An instance of the Fasta class containing sequence data.
@@ -204,18 +341,33 @@ class FastaDataset(Dataset):
         complement_dict (dict): A dictionary mapping characters to their complements.
         complement_matrix (numpy.ndarray): A matrix representing character complement relationships.
         pad_final (bool): Whether the final window is padded.
+        max_n_fraction (float or None): Maximum fraction of out-of-alphabet positions in a window.
+        as_codes (bool): Whether indexing returns uint8 tokens.
         n_keys (int): Number of keys (contigs) in the Fasta object.
         key_lens (dict): Dictionary mapping contig keys to their respective sequence lengths.
-        key_n_windows (dict): Dictionary mapping contig keys to the number of windows.
+        raw_n_windows (dict): Dictionary mapping contig keys to the number of windows before N filtering.
+        key_n_windows (dict): Dictionary mapping contig keys to the number of kept windows.
         key_rolling_n (numpy.ndarray): Array of cumulative sums of windows for each key.
+        segment_keys (numpy.ndarray): Contig index of each run of consecutive kept windows.
+        segment_first (numpy.ndarray): Contig window index where each run of kept windows starts.
+        segment_rolling_n (numpy.ndarray): Array of cumulative sums of windows for each run.
         key2idx (dict): Dictionary mapping contig keys to their indices.
         idx2key (list): List of contig keys corresponding to indices.
         n_unstranded_windows (int): Total number of unstranded windows.
+        complement_codes (numpy.ndarray): Token-to-complement-token lookup table.
+        onehot_table (numpy.ndarray): Token-to-onehot lookup table.
 
     Methods:
         count_windows(): Count the number of windows for each contig.
+        keep_windows(key): Find the runs of windows in a contig that pass the N filter.
         get_fasta_coords(idx): Get the start and end coordinates of a window for a given index.
+        get_fasta_coords_batch(idxs): Get the contig indices, start, and end coordinates of many windows.
+        get_batch(idxs, as_codes=False): Get the data for many windows in a single allocation.
         parse_complements(): Parse the complement matrix based on the provided alphabet and complement dictionary.
+
+    Note:
+        Indexing with a list or array of indices returns a whole batch. Pass a BatchSampler as the
+        DataLoader's sampler with batch_size=None to fetch whole batches per worker call.
     """
     
     def __init__(self, 
@@ -223,7 +375,9 @@ class FastaDataset(Dataset):
                  reverse_complements=True,
                  alphabet=constants.STANDARD_NT,
                  complement_dict=constants.DNA_COMPLEMENTS,
-                 pad_final=False):
+                 pad_final=False,
+                 max_n_fraction=None,
+                 as_codes=False):
         """
         Initializes the FastaDataset object with the specified parameters and precomputes necessary attributes.
         """
@@ -242,16 +396,38 @@ class FastaDataset(Dataset):
         self.complement_matrix = self.parse_complements()
         
         self.pad_final  = pad_final
+        self.max_n_fraction = max_n_fraction
+        self.as_codes = as_codes
         
         self.n_keys = len(self.fasta.keys())
         self.key_lens =  { k: self.fasta[k].shape[-1] for k in self.fasta.keys() }
-        self.key_n_windows = self.count_windows()
-        self.key_rolling_n = np.cumsum([ self.key_n_windows[k] for k in self.fasta.keys() ])
         
         self.key2idx  = { k:i for i,k in enumerate(self.fasta.keys()) }
         self.idx2key  = list(self.fasta.keys())
+        self.key_len_array = np.array([ self.key_lens[k] for k in self.idx2key ], dtype=np.int64)
+        
+        self.raw_n_windows = self.count_windows()
+        segments = [ (k_id, first, n) for k_id, k in enumerate(self.idx2key) 
+                                       for first, n in self.keep_windows(k) ]
+        segments = np.array(segments, dtype=np.int64).reshape(-1,3)
+        self.segment_keys  = segments[:,0]
+        self.segment_first = segments[:,1]
+        self.segment_rolling_n = np.cumsum(segments[:,2])
+        self.segment_past_n    = np.concatenate([[0], self.segment_rolling_n]).astype(np.int64)
+        
+        self.key_n_windows = { k: int(segments[self.segment_keys == k_id, 2].sum()) 
+                               for k_id, k in enumerate(self.idx2key) }
+        self.key_rolling_n = np.cumsum([ self.key_n_windows[k] for k in self.fasta.keys() ])
         
         self.n_unstranded_windows = sum( self.key_n_windows.values() )
+        
+        self.complement_codes = np.array(
+            [ self.alphabet.index(self.complement_dict[nt]) for nt in self.alphabet ] + [len(self.alphabet)], 
+            dtype=np.uint8
+        )
+        self.onehot_table = np.concatenate(
+            [np.eye(len(self.alphabet)), np.zeros((1, len(self.alphabet)))], axis=0
+        ).astype(np.float32)
                     
     def count_windows(self):
         """
@@ -273,6 +449,61 @@ class FastaDataset(Dataset):
             key_n_windows[k] = n
         
         return key_n_windows
+    
+    def keep_windows(self, key, chunk_size=2**20):
+        """
+        Find the runs of windows in a contig that pass the N filter.
+
+        Only windows that overlap an N run are checked, using the contig's N intervals.
+
+        Args:
+            key (str): Contig key.
+            chunk_size (int, optional): Number of windows checked at a time. Default is 2**20.
+
+        Returns:
+            list: (first window index, number of windows) tuples for each non-empty run of kept windows.
+        """
+        n_windows = self.raw_n_windows[key]
+        if n_windows == 0:
+            return []
+        if self.max_n_fraction is None:
+            return [(0, n_windows)]
+        
+        length = self.key_lens[key]
+        runs   = contig_n_runs(self.fasta[key])
+        if runs.shape[0] == 0:
+            return [(0, n_windows)]
+        max_n  = int(np.floor(self.max_n_fraction * self.window_size))
+        
+        # Windows starting in (run_start - window_size, run_end) overlap a run
+        lo = np.maximum(0, -((self.window_size - 1 - runs[:,0]) // self.step_size))
+        hi = np.minimum(n_windows, (runs[:,1] - 1) // self.step_size + 1)
+        if self.pad_final:
+            lo = np.append(lo, n_windows-1)
+            hi = np.append(hi, n_windows)
+        
+        # Runs past the last window leave nothing to check
+        dropped = [np.zeros((0,2), dtype=np.int64)]
+        check_lo, check_hi = None, None
+        for a, b in sorted(zip(lo.tolist(), hi.tolist())) + [(n_windows+1, n_windows+1)]:
+            if check_hi is not None and a <= check_hi:
+                check_hi = max(check_hi, b)
+                continue
+            if check_hi is not None:
+                for c_lo in range(check_lo, check_hi, chunk_size):
+                    window_idx = np.arange(c_lo, min(check_hi, c_lo+chunk_size))
+                    ends   = np.minimum(window_idx * self.step_size + self.window_size, length)
+                    n_in_runs = count_in_runs(runs, ends - self.window_size, ends)
+                    dropped.append( _mask_runs(n_in_runs > max_n, offset=c_lo) )
+            check_lo, check_hi = a, b
+        
+        kept  = []
+        first = 0
+        for d_start, d_end in np.concatenate(dropped, axis=0).tolist() + [(n_windows, n_windows)]:
+            if d_start > first:
+                kept.append((first, d_start - first))
+            first = d_end
+        return kept
         
     def get_fasta_coords(self, idx):
         """
@@ -284,16 +515,29 @@ class FastaDataset(Dataset):
         Returns:
             dict: A dictionary containing the contig key, start, and end coordinates of the window.
         """
-        k_id = self.n_keys - sum(self.key_rolling_n > idx)
-        n_past = 0 if k_id == 0 else self.key_rolling_n[k_id-1]
-        window_idx = idx - n_past
+        k_ids, starts, ends = self.get_fasta_coords_batch([idx])
+        
+        return {'key': self.idx2key[k_ids[0]], 'start': int(starts[0]), 'end': int(ends[0])}
+    
+    def get_fasta_coords_batch(self, idxs):
+        """
+        Get the contig indices, start, and end coordinates of many windows.
+
+        Args:
+            idxs (array-like): Unstranded indices of the desired windows.
+
+        Returns:
+            tuple: Arrays of contig indices, start coordinates, and end coordinates.
+        """
+        idxs  = np.asarray(idxs, dtype=np.int64)
+        seg_ids = np.searchsorted(self.segment_rolling_n, idxs, side='right')
+        k_ids   = self.segment_keys[seg_ids]
         
-        k = self.idx2key[k_id]
-        start = window_idx * self.step_size
-        end   = min(start + self.window_size, self.key_lens[k])
-        start = end - self.window_size
+        starts = (self.segment_first[seg_ids] + idxs - self.segment_past_n[seg_ids]) * self.step_size
+        ends   = np.minimum(starts + self.window_size, self.key_len_array[k_ids])
+        starts = ends - self.window_size
         
-        return {'key': k, 'start': start, 'end': end}
+        return k_ids, starts, ends
 
     def parse_complements(self):
         """
@@ -320,34 +564,78 @@ class FastaDataset(Dataset):
         
         return self.n_unstranded_windows * strands
     
-    def __getitem__(self, idx):
+    def get_batch(self, idxs, as_codes=False):
         """
-        Get the data for a specific window at the given index.
+        Get the data for many windows at once.
+
+        Windows are gathered from one read of each contig region touched by the batch,
+        and reverse strands are taken by complementing and flipping tokens.
 
         Args:
-            idx (int): Index of the desired window.
+            idxs (array-like): Indices of the desired windows.
+            as_codes (bool, optional): Whether to return uint8 tokens instead of one-hot encodings. Default is False.
 
         Returns:
-            tuple: A tuple containing the location tensor and the one-hot encoded sequence tensor.
+            tuple: A tuple containing the location tensor of shape (batch_size, 4) and the sequence
+                   tensor of shape (batch_size, len(alphabet), window_size), or (batch_size, window_size) if as_codes.
         """
-
+        idxs = np.asarray(idxs, dtype=np.int64)
+        
         if self.reverse_complements:
-            strand = 1 if idx % 2 == 0 else -1
-            u_idx = idx // 2
+            strands = np.where(idxs % 2 == 0, 1, -1)
+            u_idxs  = idxs // 2
         else:
-            u_idx = idx
-            strand = 1
+            strands = np.ones_like(idxs)
+            u_idxs  = idxs
         
-        fasta_loc = self.get_fasta_coords(u_idx)
-        k, start, end = [fasta_loc[x] for x in ['key', 'start', 'end']]
+        k_ids, starts, ends = self.get_fasta_coords_batch(u_idxs)
+        
+        codes  = np.empty((idxs.shape[0], self.window_size), dtype=np.uint8)
+        offset = np.arange(self.window_size)
+        for k_id in np.unique(k_ids):
+            members = np.nonzero(k_ids == k_id)[0]
+            contig  = self.fasta[ self.idx2key[k_id] ]
+            lo, hi  = starts[members].min(), ends[members].max()
+            if hi - lo <= members.shape[0] * self.window_size:
+                region = contig_codes(contig, lo, hi, len(self.alphabet))
+                codes[members] = region[ (starts[members] - lo)[:, None] + offset ]
+            else:
+                for i in members:
+                    codes[i] = contig_codes(contig, starts[i], ends[i], len(self.alphabet))
         
-        fasta_seq = self.fasta[k][:,start:end].astype(np.float32)
-        fasta_seq = fasta_seq if strand == 1 else np.flip( self.complement_matrix @ fasta_seq, axis=-1)
-        fasta_seq = torch.tensor(fasta_seq.copy())
+        reverse = strands == -1
+        codes[reverse] = self.complement_codes[ codes[reverse, ::-1] ]
         
-        loc_tensor= torch.tensor([self.key2idx[k], start, end, strand])
+        loc_tensor = torch.from_numpy( np.stack([k_ids, starts, ends, strands], axis=1) )
         
-        return loc_tensor, fasta_seq
+        if as_codes:
+            return loc_tensor, torch.from_numpy(codes)
+        
+        fasta_seq = self.onehot_table[codes].transpose(0, 2, 1)
+        return loc_tensor, torch.from_numpy( np.ascontiguousarray(fasta_seq) )
+    
+    def __getitem__(self, idx):
+        """
+        Get the data for a specific window at the given index.
+
+        Args:
+            idx (int, list, numpy.ndarray, or slice): Index of the desired window. Lists, arrays, and
+                slices return a batch from get_batch.
+
+        Returns:
+            tuple: A tuple containing the location tensor and the one-hot encoded (or token, with as_codes) sequence tensor.
+        """
+        if isinstance(idx, slice):
+            return self.get_batch( np.arange(*idx.indices(len(self))), as_codes=self.as_codes )
+        elif not np.isscalar(idx) and not (torch.is_tensor(idx) and idx.ndim == 0):
+            return self.get_batch(idx, as_codes=self.as_codes)
+        
+        idx = int(idx)
+        if idx < 0:
+            idx += len(self)
+        loc_tensor, fasta_seq = self.get_batch([idx], as_codes=self.as_codes)
+        
+        return loc_tensor[0], fasta_seq[0]
 
 class VCF:
     """
@@ -362,6 +650,8 @@ class VCF:
         all_upper (bool, optional): Whether to convert alleles to uppercase. Default is True.
         chr_prefix (str, optional): Prefix to add to chromosome names. Default is an empty string.
         verbose (bool, optional): Whether to print verbose messages during processing. Default is False.
+        chunk_size (int, optional): If provided, the VCF is not loaded at construction. Records are instead
+            streamed in chunks of this many lines by iter_chunks(). Default is None.
 
     Attributes:
         vcf_path (str): Path to the VCF file.
@@ -372,10 +662,14 @@ class VCF:
         all_upper (bool): Whether alleles are converted to uppercase.
         chr_prefix (str): Prefix to add to chromosome names.
         verbose (bool): Whether verbose messages are printed.
-        vcf (pd.DataFrame): DataFrame containing the VCF data.
+        chunk_size (int or None): Number of lines per chunk in streaming mode.
+        vcf (pd.DataFrame): DataFrame containing the VCF data. None in streaming mode.
 
     Methods:
         _open_vcf(): Open and preprocess the VCF file, returning a DataFrame.
+        _read_vcf(**kwargs): Read the VCF file with pandas.
+        _filter_records(data, verbose=True): Apply the token and length filters to a DataFrame of records.
+        iter_chunks(shard_id=0, n_shards=1): Stream filtered chunks of the VCF file, or of one shard of it.
         __call__(loc_idx=None, iloc_idx=None): Get a VCF record by location or index.
 
     """
@@ -387,7 +681,8 @@ class VCF:
                  alphabet=constants.STANDARD_NT, 
                  strict=False, 
                  all_upper=True, chr_prefix='', 
-                 verbose=False
+                 verbose=False,
+                 chunk_size=None
                 ):
         """
         Initialize the VCF object and read the VCF file.
@@ -401,6 +696,7 @@ class VCF:
             all_upper (bool, optional): Whether to convert alleles to uppercase. Default is True.
             chr_prefix (str, optional): Prefix to add to chromosome names. Default is an empty string.
             verbose (bool, optional): Whether to print verbose messages during processing. Default is False.
+            chunk_size (int, optional): If provided, stream records in chunks of this many lines instead of loading the file. Default is None.
         """
         self.vcf_path = vcf_path
         self.max_allele_size = max_allele_size
@@ -410,8 +706,9 @@ class VCF:
         self.all_upper= all_upper
         self.chr_prefix = chr_prefix
         self.verbose = verbose
+        self.chunk_size = chunk_size
         
-        self.vcf = self._open_vcf()
+        self.vcf = self._open_vcf() if chunk_size is None else None
         #self.read_vcf()
         
     def _open_vcf(self):
@@ -421,22 +718,50 @@ class VCF:
         Returns:
             pd.DataFrame: DataFrame containing the VCF data.
         """
-        vcf_colnames = ['chrom','pos','id','ref','alt','qual','filter','info']
-        re_pat = matcher = f'[^{"".join(self.alphabet)}]'
-        
         # Loading to DataFrame
         print('loading DataFrame', file=sys.stderr)
+        data = self._read_vcf()
+        
+        print(f'loaded shape: {data.shape}', file=sys.stderr)
+        data = self._filter_records(data)
+        print('Done', file=sys.stderr)
+        return data.reset_index(drop=True)
+    
+    def _read_vcf(self, **kwargs):
+        """
+        Read the VCF file with pandas.
+
+        Args:
+            **kwargs: Additional arguments passed to pd.read_csv (e.g. chunksize).
+
+        Returns:
+            pd.DataFrame or pd.io.parsers.TextFileReader: The VCF records, or an iterator over chunks.
+        """
         if self.vcf_path.endswith('gz'):
-            data = pd.read_csv(self.vcf_path, sep='\t', comment='#', header=None, compression='gzip', usecols=[0,1,2,3,4])
+            return pd.read_csv(self.vcf_path, sep='\t', comment='#', header=None, compression='gzip', usecols=[0,1,2,3,4], **kwargs)
         else:
-            data = pd.read_csv(self.vcf_path, sep='\t', comment='#', header=None, usecols=[0,1,2,3,4])
+            return pd.read_csv(self.vcf_path, sep='\t', comment='#', header=None, usecols=[0,1,2,3,4], **kwargs)
+    
+    def _filter_records(self, data, verbose=True):
+        """
+        Apply the contig prefix, token filters, and allele length filters to VCF records.
+
+        Args:
+            data (pd.DataFrame): Raw VCF records.
+            verbose (bool, optional): Whether to print progress messages. Default is True.
+
+        Returns:
+            pd.DataFrame: Filtered VCF records. The index is preserved.
+        """
+        vcf_colnames = ['chrom','pos','id','ref','alt','qual','filter','info']
+        re_pat = matcher = f'[^{"".join(self.alphabet)}]'
+        log = sys.stderr if verbose else None
         
-        print(f'loaded shape: {data.shape}', file=sys.stderr)
         data.columns = vcf_colnames[:data.shape[1]]
         data['chrom']= self.chr_prefix + data['chrom'].astype(str)
         
         # Checking and filtering tokens
-        print('Checking and filtering tokens', file=sys.stderr)
+        if verbose: print('Checking and filtering tokens', file=log)
         if self.all_upper:
             data['ref'] = data['ref'].str.upper()
             data['alt'] = data['alt'].str.upper()
@@ -451,9 +776,9 @@ class VCF:
             total_filter = ~(ref_filter | alt_filter)
             data = data.loc[ total_filter ]
         
-        print(f'passed shape: {data.shape}', file=sys.stderr)
+        if verbose: print(f'passed shape: {data.shape}', file=log)
         # Length checks
-        print('Allele length checks', file=sys.stderr)
+        if verbose: print('Allele length checks', file=log)
         ref_lens = data['ref'].str.len()
         alt_lens = data['alt'].str.len()
         
@@ -463,9 +788,52 @@ class VCF:
         size_filter = (max_sizes < self.max_allele_size) & (indel_sizes < self.max_indel_size)
         data = data.loc[size_filter]
         
-        print(f'final shape: {data.shape}', file=sys.stderr)
-        print('Done', file=sys.stderr)
-        return data.reset_index(drop=True)
+        if verbose: print(f'final shape: {data.shape}', file=log)
+        return data
+    
+    def _iter_lines(self):
+        """
+        Stream the raw record lines of the VCF file, skipping header and blank lines.
+
+        Yields:
+            bytes: One record line.
+        """
+        opener = gzip.open if self.vcf_path.endswith('gz') else open
+        with opener(self.vcf_path, 'rb') as f:
+            for line in f:
+                if line[:1] != b'#' and line.strip():
+                    yield line
+    
+    def iter_chunks(self, shard_id=0, n_shards=1):
+        """
+        Stream the VCF file in chunks of `chunk_size` lines, applying filters to each chunk.
+
+        Chunk c belongs to shard c % n_shards. Lines of other shards' chunks are skipped
+        without being parsed or filtered, so the parsing cost is split across shards.
+
+        Args:
+            shard_id (int, optional): Shard to read chunks for. Default is 0.
+            n_shards (int, optional): Total number of shards. Default is 1.
+
+        Yields:
+            pd.DataFrame: Filtered VCF records of chunks shard_id, shard_id + n_shards, ...
+            Chunks can be empty after filtering. The index holds each record's position in the file.
+        """
+        assert self.chunk_size is not None, "Streaming requires a chunk_size."
+        lines = self._iter_lines()
+        for chunk_idx in itertools.count():
+            if chunk_idx % n_shards != shard_id:
+                if sum(1 for _ in itertools.islice(lines, self.chunk_size)) < self.chunk_size:
+                    return
+                continue
+            raw = list(itertools.islice(lines, self.chunk_size))
+            if len(raw) == 0:
+                return
+            chunk = pd.read_csv(io.BytesIO(b''.join(raw)), sep='\t', comment='#', header=None, usecols=[0,1,2,3,4])
+            chunk.index = pd.RangeIndex(chunk_idx * self.chunk_size, chunk_idx * self.chunk_size + len(chunk))
+            yield self._filter_records(chunk, verbose=self.verbose)
+            if len(raw) < self.chunk_size:
+                return
         
     def __call__(self, loc_idx=None, iloc_idx=None):
         """
@@ -506,6 +874,8 @@ class VcfDataset(Dataset):
         use_contigs (list[str], optional): List of contig names to include. Default is an empty list.
         alphabet (list[str], optional): List of allowed characters for sequences. Default is constants.STANDARD_NT.
         complement_dict (dict[str, str], optional): Dictionary of nucleotide complements. Default is constants.DNA_COMPLEMENTS.
+        compact (bool, optional): Whether to return uint8 token-coded spans instead of one-hot windows.
+            Expand them on the device with the WindowExpander from get_window_expander(). Default is False.
 
     Attributes:
         vcf (VCF): VCF object containing variant call data.
@@ -524,10 +894,12 @@ class VcfDataset(Dataset):
         complement_dict (dict[str, str]): Dictionary of nucleotide complements.
         complement_matrix (torch.Tensor): Matrix for nucleotide complement transformation.
         window_slicer (OneHotSlicer): Slicer for encoding sequences.
+        compact (bool): Whether samples are returned as token-coded spans.
 
     Methods:
         parse_complements(): Parse the complement matrix for nucleotide transformation.
         encode(allele): Encode an allele sequence.
+        get_window_expander(): Get a WindowExpander matching the dataset's windowing.
         filter_vcf(): Filter VCF records based on contigs and other criteria.
         __len__(): Get the number of samples in the dataset.
         __getitem__(idx): Get a sample from the dataset.
@@ -541,7 +913,8 @@ class VcfDataset(Dataset):
                  left_flank='', right_flank='', 
                  all_upper=True, use_contigs=[],
                  alphabet=constants.STANDARD_NT,
-                 complement_dict=constants.DNA_COMPLEMENTS):
+                 complement_dict=constants.DNA_COMPLEMENTS,
+                 compact=False):
         """
         Initialize the VcfDataset object and preprocess the data.
 
@@ -559,6 +932,7 @@ class VcfDataset(Dataset):
             use_contigs (list[str], optional): List of contig names to include. Default is an empty list.
             alphabet (list[str], optional): List of allowed characters for sequences. Default is constants.STANDARD_NT.
             complement_dict (dict[str, str], optional): Dictionary of nucleotide complements. Default is constants.DNA_COMPLEMENTS.
+            compact (bool, optional): Whether to return uint8 token-coded spans instead of one-hot windows. Default is False.
         """
         super().__init__()
         
@@ -582,6 +956,9 @@ class VcfDataset(Dataset):
         
         self.window_slicer = OneHotSlicer(len(alphabet), window_size)
         
+        self.compact = compact
+        self.code_table = _code_table(alphabet, all_upper)
+        
         self.filter_vcf()
 
     def parse_complements(self):
@@ -610,7 +987,17 @@ class VcfDataset(Dataset):
         """
         my_allele = allele.upper() if self.all_upper else allele
         return alphabet_onehotizer(my_allele, self.alphabet)
-        
+    
+    def get_window_expander(self):
+        """
+        Get a WindowExpander that turns compact samples into the windows returned when compact=False.
+
+        Returns:
+            WindowExpander: Module matching the dataset's window size, step size, and strand settings.
+        """
+        return WindowExpander(self.alphabet, self.window_size, self.step_size, 
+                              self.reverse_complements, self.complement_dict)
+    
     def filter_vcf(self):
         """
         Filter VCF records based on contigs and other criteria.
@@ -651,6 +1038,21 @@ class VcfDataset(Dataset):
         """
         record = self.vcf.iloc[idx]
         
+        return self.process_record(record)
+    
+    def process_record(self, record):
+        """
+        Extract reference and alternate windows around a variant.
+
+        Args:
+            record (pd.Series or dict): A VCF record with 'chrom', 'pos', 'ref', and 'alt' fields.
+
+        Returns:
+            dict: Dictionary containing 'ref' and 'alt' sequences.
+        """
+        if self.compact:
+            return self.process_record_compact(record)
+        
         ref = self.encode(record['ref'])
         alt = self.encode(record['alt'])
         
@@ -709,4 +1111,152 @@ class VcfDataset(Dataset):
 
         except KeyError:
             print(f"No contig: {record['chrom']} in FASTA, skipping", file=sys.stderr)
-            return {'ref': None, 'alt': None}
\ No newline at end of file
+            return {'ref': None, 'alt': None}
+    
+    def process_record_compact(self, record):
+        """
+        Extract reference and alternate spans around a variant as uint8 tokens.
+
+        Both spans are grab_size long. Expanding them with get_window_expander() gives
+        the same windows as process_record with compact=False.
+
+        Args:
+            record (pd.Series or dict): A VCF record with 'chrom', 'pos', 'ref', and 'alt' fields.
+
+        Returns:
+            dict: Dictionary containing 'ref' and 'alt' token spans.
+        """
+        ref = self.code_table[ np.frombuffer(record['ref'].encode(), dtype=np.uint8) ]
+        alt = self.code_table[ np.frombuffer(record['alt'].encode(), dtype=np.uint8) ]
+        
+        var_loc = record['pos'] - 1
+        start   = var_loc - self.relative_end + 1
+
+        trail_start = var_loc + ref.shape[0]
+        trail_end   = start + self.grab_size
+
+        len_dif = alt.shape[0] - ref.shape[0]
+        start_adjust = len_dif // 2
+        end_adjust   = len_dif - start_adjust
+
+        try:
+            contig = self.fasta[ record['chrom'] ]
+            assert var_loc < contig.shape[1], "Variant position outside of chromosome bounds. Check VCF/FASTA build version."
+            ref = np.concatenate([
+                contig_codes(contig, start, var_loc, len(self.alphabet)), ref, 
+                contig_codes(contig, trail_start, trail_end, len(self.alphabet))
+            ])
+            alt = np.concatenate([
+                contig_codes(contig, start+start_adjust, var_loc, len(self.alphabet)), alt, 
+                contig_codes(contig, trail_start, trail_end-end_adjust, len(self.alphabet))
+            ])
+            return {'ref': torch.from_numpy(ref), 'alt': torch.from_numpy(alt)}
+
+        except KeyError:
+            print(f"No contig: {record['chrom']} in FASTA, skipping", file=sys.stderr)
+            return {'ref': None, 'alt': None}
+
+class StreamingVcfDataset(VcfDataset, IterableDataset):
+    """
+    An IterableDataset that streams variants from a VCF in bounded chunks and yields
+    the same reference and alternate windows as VcfDataset.
+
+    Chunks are distributed round-robin across job partitions and DataLoader workers,
+    so peak memory is bounded by the chunk size rather than the VCF size. Each item
+    also carries the record's position in the VCF file and its fields, since items
+    from different workers can arrive out of order.
+
+    Args:
+        vcf_obj (VCF): VCF object constructed with a chunk_size.
+        fasta_obj (Fasta): Fasta object containing genomic sequences.
+        window_size (int): Size of the data windows.
+        relative_start (int): Relative start position within the window.
+        relative_end (int): Relative end position within the window.
+        job_id (int, optional): Job partition index. Default is 0.
+        n_jobs (int, optional): Total number of job partitions. Default is 1.
+        **kwargs: Additional arguments passed to VcfDataset.
+
+    Methods:
+        filter_chunk(chunk): Filter VCF records based on contigs.
+        __iter__(): Stream samples from the VCF file.
+    """
+    
+    def __init__(self, 
+                 vcf_obj, fasta_obj, window_size, 
+                 relative_start, relative_end, 
+                 job_id=0, n_jobs=1, **kwargs):
+        """
+        Initialize the StreamingVcfDataset object.
+        """
+        self.job_id = job_id
+        self.n_jobs = n_jobs
+        super().__init__(vcf_obj, fasta_obj, window_size, 
+                         relative_start, relative_end, **kwargs)
+    
+    def filter_vcf(self):
+        """
+        Filtering is applied to each chunk as it is streamed.
+        """
+        return None
+    
+    def filter_chunk(self, chunk):
+        """
+        Filter VCF records based on contigs.
+
+        Args:
+            chunk (pd.DataFrame): Filtered VCF records from VCF.iter_chunks.
+
+        Returns:
+            pd.DataFrame: Records with a matching contig in the FASTA (and in use_contigs, if provided).
+        """
+        contig_filter = chunk['chrom'].isin(self.fasta.keys())
+        if len(self.use_contigs) > 0:
+            contig_filter = contig_filter & chunk['chrom'].isin(self.use_contigs)
+        return chunk.loc[ contig_filter ]
+    
+    def __len__(self):
+        raise TypeError("StreamingVcfDataset has no length.")
+    
+    def __iter__(self):
+        """
+        Stream samples from the VCF file.
+
+        Yields:
+            dict: Dictionary containing 'ref' and 'alt' sequences, the record 'index' in the VCF
+                  file, the 'chunk' it was read in, and the 'record' fields (chrom, pos, id, ref, alt).
+                  After the records of each chunk, including chunks left empty by the filters, a
+                  {'chunk_complete': chunk} marker. Batch with collate_streaming_vcf.
+        """
+        worker_info = torch.utils.data.get_worker_info()
+        n_workers = 1 if worker_info is None else worker_info.num_workers
+        worker_id = 0 if worker_info is None else worker_info.id
+        
+        n_shards = self.n_jobs * n_workers
+        shard_id = self.job_id * n_workers + worker_id
+        
+        chunks = self.vcf.iter_chunks(shard_id=shard_id, n_shards=n_shards)
+        for chunk_idx, chunk in zip(itertools.count(shard_id, n_shards), chunks):
+            chunk = self.filter_chunk(chunk)
+            for idx, record in zip(chunk.index, chunk.to_dict('records')):
+                sample = self.process_record(record)
+                sample['index']  = idx
+                sample['chunk']  = chunk_idx
+                sample['record'] = record
+                yield sample
+            yield {'chunk_complete': chunk_idx}
+
+def collate_streaming_vcf(samples):
+    """
+    Collate StreamingVcfDataset samples, separating chunk completion markers from records.
+
+    Args:
+        samples (list): Samples and markers yielded by StreamingVcfDataset.
+
+    Returns:
+        dict: Collated records, without 'ref' and 'alt' if the batch holds only markers, and
+        'chunk_complete', a list of the chunks completed by the end of the batch.
+    """
+    records = [ sample for sample in samples if 'chunk_complete' not in sample ]
+    batch = torch.utils.data.default_collate(records) if len(records) > 0 else {}
+    batch['chunk_complete'] = [ sample['chunk_complete'] for sample in samples if 'chunk_complete' in sample ]
+    return batch
@@ -0,0 +1,547 @@
+import os
+import sys
+import json
+import struct
+import gzip
+from abc import ABC, abstractmethod
+from collections.abc import Mapping
+
+import numpy as np
+
+import tqdm
+
+from ..common import constants
+from ..common.bgzf import BgzfReader, is_bgzf
+
+GENOME_MAGIC = b'BODAGNM1'
+GZIP_MAGIC   = b'\x1f\x8b'
+DATA_OFFSET  = 64
+
+def _code_table(alphabet, all_upper=True):
+    """
+    Build a byte-to-token lookup table for an alphabet.
+
+    Args:
+        alphabet (list): The alphabet of characters used for encoding.
+        all_upper (bool, optional): Whether lowercase characters map to the same codes as uppercase. Default is True.
+
+    Returns:
+        np.ndarray: A uint8 array of length 256. Characters outside of the alphabet
+                    map to the sentinel code len(alphabet).
+    """
+    table = np.full(256, len(alphabet), dtype=np.uint8)
+    for i, nt in enumerate(alphabet):
+        table[ord(nt)] = i
+        if all_upper:
+            table[ord(nt.lower())] = i
+            table[ord(nt.upper())] = i
+    return table
+
+def _onehot_table(n_tokens):
+    """
+    Build a token-to-onehot lookup table. The sentinel code maps to an all-False column.
+
+    Args:
+        n_tokens (int): Size of the alphabet.
+
+    Returns:
+        np.ndarray: A boolean array of shape (n_tokens+1, n_tokens).
+    """
+    return np.concatenate([np.eye(n_tokens, dtype=bool), np.zeros((1,n_tokens), dtype=bool)], axis=0)
+
+def _mask_runs(mask, offset=0):
+    """
+    Find runs of True values in a boolean mask.
+
+    Args:
+        mask (np.ndarray): A 1D boolean array.
+        offset (int, optional): Value added to returned coordinates. Default is 0.
+
+    Returns:
+        np.ndarray: An (n_runs, 2) array of half-open [start, end) intervals.
+    """
+    if mask.size == 0:
+        return np.zeros((0,2), dtype=np.int64)
+    edges = np.diff( np.concatenate([[0], mask.astype(np.int8), [0]]) )
+    starts= np.where(edges == 1)[0]
+    ends  = np.where(edges == -1)[0]
+    return np.stack([starts, ends], axis=1).astype(np.int64) + offset
+
+def is_packed_genome(file_path):
+    """
+    Check whether a file is a packed genome written by compile_fasta.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        bool: True if the file starts with the packed genome magic bytes.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(len(GENOME_MAGIC)) == GENOME_MAGIC
+    except (IsADirectoryError, FileNotFoundError):
+        return False
+
+def is_indexed_fasta(file_path):
+    """
+    Check whether a FASTA file can be read on demand through its .fai index.
+
+    Plain text and BGZF files can be seeked into. A .fai next to a plain gzip file
+    (stale, or made for the uncompressed file) is ignored, since the offsets it
+    holds can't be used on the compressed bytes.
+
+    Args:
+        file_path (str): Path to the FASTA file.
+
+    Returns:
+        bool: True if a .fai index exists and the file is plain text or BGZF compressed.
+    """
+    if not os.path.isfile(file_path + '.fai'):
+        return False
+    with open(file_path, 'rb') as f:
+        is_gzip = f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    return not is_gzip or is_bgzf(file_path)
+
+def compile_fasta(fasta_path, output_path, all_upper=True,
+                  alphabet=constants.STANDARD_NT, buffer_size=2**24):
+    """
+    Compile a FASTA file into a packed genome that can be memory-mapped by PackedFasta.
+
+    The packed genome is a single file holding one uint8 token per base (characters
+    outside of the alphabet are stored as the sentinel code len(alphabet)), followed
+    by a JSON header with the contig table and the runs of sentinel (e.g. N) positions
+    in each contig.
+
+    Args:
+        fasta_path (str): Path to the FASTA file. Gzipped files are read sequentially.
+        output_path (str): Path of the packed genome to write.
+        all_upper (bool, optional): Whether to treat lowercase (soft-masked) bases as uppercase. Default is True.
+        alphabet (list, optional): The alphabet of characters used for encoding sequences. Default is constants.STANDARD_NT.
+        buffer_size (int, optional): Number of bases encoded per write. Default is 2**24.
+
+    Returns:
+        dict: The header written to the packed genome.
+    """
+    table   = _code_table(alphabet, all_upper)
+    sentinel= len(alphabet)
+
+    contigs = []
+    opener  = gzip.open if fasta_path.endswith('gz') else open
+
+    with opener(fasta_path, 'rb') as in_f, open(output_path, 'wb') as out_f:
+        out_f.write(b'\x00' * DATA_OFFSET)
+
+        position = 0
+        current  = None
+        buffer   = []
+        buf_len  = 0
+
+        def flush():
+            nonlocal buffer, buf_len, position
+            if buf_len == 0:
+                return
+            codes = table[ np.frombuffer(b''.join(buffer), dtype=np.uint8) ]
+            out_f.write(codes.tobytes())
+            runs = _mask_runs(codes == sentinel, offset=current['length'])
+            if runs.shape[0] > 0:
+                if len(current['n_runs']) > 0 and current['n_runs'][-1][1] == runs[0,0]:
+                    current['n_runs'][-1][1] = int(runs[0,1])
+                    runs = runs[1:]
+                current['n_runs'].extend( runs.tolist() )
+            current['length'] += buf_len
+            position += buf_len
+            buffer, buf_len = [], 0
+
+        print('compiling fasta', file=sys.stderr)
+        for line in tqdm.tqdm(in_f):
+            if line.startswith(b'>'):
+                if current is not None:
+                    flush()
+                contig_key, *contig_des = line[1:].decode().split()
+                current = {'key': contig_key, 'description': contig_des,
+                           'offset': position, 'length': 0, 'n_runs': []}
+                contigs.append(current)
+            else:
+                line = line.rstrip()
+                buffer.append(line)
+                buf_len += len(line)
+                if buf_len >= buffer_size:
+                    flush()
+        if current is not None:
+            flush()
+
+        header = {
+            'version': 1,
+            'alphabet': list(alphabet),
+            'all_upper': all_upper,
+            'contigs': contigs,
+        }
+        header_bytes = json.dumps(header).encode()
+        header_offset= out_f.tell()
+        out_f.write(header_bytes)
+        out_f.seek(0)
+        out_f.write(GENOME_MAGIC + struct.pack('<QQ', header_offset, len(header_bytes)))
+
+    print('done', file=sys.stderr)
+    return header
+
+class LazyContig(ABC):
+    """
+    A lazy (n_tokens, length) one-hot view of a contig.
+
+    Slicing a LazyContig (e.g. contig[:, start:end]) one-hot encodes only the
+    requested positions, so it can be used anywhere a Fasta contig array is indexed.
+    Subclasses implement `codes`.
+
+    Args:
+        genome (Mapping): The genome holding the contig. Must provide `n_tokens` and `onehot_table`.
+        length (int): Length of the contig.
+
+    Attributes:
+        shape (tuple): The shape of the equivalent one-hot array.
+
+    Methods:
+        codes(start, end): Get the uint8 tokens of a region.
+    """
+
+    def __init__(self, genome, length):
+        self.genome = genome
+        self.length = length
+
+    @property
+    def shape(self):
+        return (self.genome.n_tokens, self.length)
+
+    @property
+    def ndim(self):
+        return 2
+
+    def __len__(self):
+        return self.genome.n_tokens
+
+    @abstractmethod
+    def codes(self, start=None, end=None):
+        """
+        Get the uint8 tokens of a region. Tokens index into the alphabet and
+        len(alphabet) marks positions outside of it.
+
+        Args:
+            start (int, optional): Start of the region, 0-based inclusive.
+            end (int, optional): End of the region, 0-based exclusive.
+
+        Returns:
+            np.ndarray: A uint8 array of tokens.
+        """
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        channel_key, position_key = key
+
+        if isinstance(position_key, slice):
+            start, end, step = position_key.indices(self.length)
+            if step != 1:
+                raise IndexError(f"{type(self).__name__} only supports contiguous slices.")
+            onehot = self.genome.onehot_table[ self.codes(start, end) ].T
+        else:
+            position = int(position_key)
+            position = position + self.length if position < 0 else position
+            if not 0 <= position < self.length:
+                raise IndexError(f"index {position_key} is out of bounds for contig with size {self.length}")
+            onehot = self.genome.onehot_table[ self.codes(position, position+1) ][0]
+
+        return onehot[channel_key]
+
+    def __array__(self, dtype=None):
+        onehot = self[:, :]
+        return onehot if dtype is None else onehot.astype(dtype)
+
+class PackedContig(LazyContig):
+    """
+    A contig in a packed genome.
+
+    Args:
+        genome (PackedGenome): The packed genome holding the token memory-map.
+        offset (int): Offset of the contig within the token block.
+        length (int): Length of the contig.
+        n_runs (list): Half-open intervals of sentinel (e.g. N) positions.
+
+    Attributes:
+        n_runs (np.ndarray): An (n_runs, 2) array of sentinel (e.g. N) intervals.
+    """
+
+    def __init__(self, genome, offset, length, n_runs):
+        super().__init__(genome, length)
+        self.offset = offset
+        self.n_runs = np.array(n_runs, dtype=np.int64).reshape(-1,2)
+
+    def codes(self, start=None, end=None):
+        start, end, _ = slice(start, end).indices(self.length)
+        end = max(start, end)
+        return np.array( self.genome.tokens[self.offset+start:self.offset+end] )
+
+class PackedGenome(Mapping):
+    """
+    A read-only mapping of contig keys to PackedContig objects backed by a memory-map.
+
+    The memory-map is opened lazily in each process, so PackedGenome objects can be
+    sent to DataLoader workers and share the same page cache.
+
+    Args:
+        file_path (str): Path to a packed genome written by compile_fasta.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+        with open(self.file_path, 'rb') as f:
+            preamble = f.read(len(GENOME_MAGIC) + 16)
+            assert preamble[:len(GENOME_MAGIC)] == GENOME_MAGIC, f"{file_path} is not a packed genome."
+            header_offset, header_len = struct.unpack('<QQ', preamble[len(GENOME_MAGIC):])
+            f.seek(header_offset)
+            self.header = json.loads( f.read(header_len) )
+
+        self.alphabet = self.header['alphabet']
+        self.n_tokens = len(self.alphabet)
+        self.n_bases  = header_offset - DATA_OFFSET
+        self.onehot_table = _onehot_table(self.n_tokens)
+        self._tokens = None
+
+        self.contigs = {
+            c['key']: PackedContig(self, c['offset'], c['length'], c['n_runs'])
+            for c in self.header['contigs']
+        }
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = np.memmap(self.file_path, dtype=np.uint8, mode='r',
+                                     offset=DATA_OFFSET, shape=(self.n_bases,))
+        return self._tokens
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_tokens'] = None
+        return state
+
+    def __getitem__(self, key):
+        return self.contigs[key]
+
+    def __iter__(self):
+        return iter(self.contigs)
+
+    def __len__(self):
+        return len(self.contigs)
+
+class PackedFasta:
+    """
+    A Fasta-compatible reader for packed genomes written by compile_fasta.
+
+    Args:
+        fasta_path (str): Path to the packed genome.
+        all_upper (bool, optional): Unused, case handling is fixed when the genome is compiled. Default is True.
+        alphabet (list, optional): Expected alphabet. Must match the compiled alphabet. Default is constants.STANDARD_NT.
+
+    Attributes:
+        fasta_path (str): Path to the packed genome.
+        all_upper (bool): Whether lowercase bases were treated as uppercase during compilation.
+        alphabet (list): The alphabet of characters used for encoding sequences.
+        fasta (PackedGenome): Mapping of contig keys to lazily one-hot encoded contigs.
+        contig_lengths (dict): Dictionary mapping contig keys to their respective sequence lengths.
+        contig_index2key (dict): Dictionary mapping contig indices to contig keys.
+        contig_key2index (dict): Dictionary mapping contig keys to their respective indices.
+        contig_descriptions (dict): Dictionary mapping contig keys to descriptions parsed from the FASTA file.
+    """
+
+    def __init__(self, fasta_path, all_upper=True,
+                 alphabet=constants.STANDARD_NT):
+        self.fasta_path = fasta_path
+        self.read_fasta()
+
+        assert list(alphabet) == self.alphabet, \
+            f"Packed genome alphabet {self.alphabet} does not match requested alphabet {list(alphabet)}"
+
+    def read_fasta(self):
+        """
+        Opens the packed genome and populates contig attributes.
+        """
+        self.fasta = PackedGenome(self.fasta_path)
+        self.alphabet = self.fasta.alphabet
+        self.all_upper= self.fasta.header['all_upper']
+
+        self.contig_lengths   = {}
+        self.contig_index2key = {}
+        self.contig_key2index = {}
+        self.contig_descriptions = {}
+
+        for idx, contig_info in enumerate(self.fasta.header['contigs']):
+            contig_key = contig_info['key']
+            self.contig_lengths[contig_key] = contig_info['length']
+            self.contig_index2key[idx] = contig_key
+            self.contig_key2index[contig_key] = idx
+            self.contig_descriptions[contig_key] = contig_info['description']
+
+class UncompressedReader:
+    """
+    Random-access reader for uncompressed files with the same interface as BgzfReader.
+
+    Args:
+        file_path (str): Path to the file.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._handle = None
+
+    @property
+    def handle(self):
+        if self._handle is None:
+            self._handle = open(self.file_path, 'rb')
+        return self._handle
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_handle'] = None
+        return state
+
+    def read(self, offset, length):
+        self.handle.seek(offset)
+        return self.handle.read(length)
+
+class IndexedContig(LazyContig):
+    """
+    A contig in a FASTA file with a .fai index, read on demand.
+
+    Args:
+        genome (IndexedGenome): The genome holding the file reader.
+        length (int): Length of the contig.
+        offset (int): Uncompressed byte offset of the first base.
+        line_bases (int): Number of bases on each line.
+        line_width (int): Number of bytes on each line, including the line terminator.
+    """
+
+    def __init__(self, genome, length, offset, line_bases, line_width):
+        super().__init__(genome, length)
+        self.offset = offset
+        self.line_bases = line_bases
+        self.line_width = line_width
+        self._n_runs = None
+
+    def byte_offset(self, position):
+        return self.offset + (position // self.line_bases) * self.line_width + position % self.line_bases
+
+    def codes(self, start=None, end=None):
+        start, end, _ = slice(start, end).indices(self.length)
+        if end <= start:
+            return np.zeros(0, dtype=np.uint8)
+        byte_start = self.byte_offset(start)
+        byte_end   = self.byte_offset(end-1) + 1
+        raw = self.genome.reader.read(byte_start, byte_end - byte_start)
+        raw = np.frombuffer(raw, dtype=np.uint8)
+        if self.line_width > self.line_bases:
+            raw = raw[ (raw != 10) & (raw != 13) ]
+        return self.genome.code_table[raw]
+
+    @property
+    def n_runs(self):
+        """
+        Half-open intervals of sentinel (e.g. N) positions, found by scanning the contig once.
+        """
+        if self._n_runs is None:
+            step = 2**24
+            runs = []
+            for i in range(0, self.length, step):
+                chunk_runs = _mask_runs(self.codes(i, i+step) == self.genome.n_tokens, offset=i).tolist()
+                if len(runs) > 0 and len(chunk_runs) > 0 and runs[-1][1] == chunk_runs[0][0]:
+                    runs[-1][1] = chunk_runs.pop(0)[1]
+                runs.extend(chunk_runs)
+            self._n_runs = np.array(runs, dtype=np.int64).reshape(-1,2)
+        return self._n_runs
+
+class IndexedGenome(Mapping):
+    """
+    A read-only mapping of contig keys to IndexedContig objects for a FASTA file with
+    a .fai index. Plain text and BGZF (with optional .gzi index) files are supported.
+
+    Args:
+        file_path (str): Path to the FASTA file.
+        fai_path (str, optional): Path to the .fai index. Defaults to file_path + '.fai'.
+        all_upper (bool, optional): Whether to treat lowercase bases as uppercase. Default is True.
+        alphabet (list, optional): The alphabet of characters used for encoding sequences. Default is constants.STANDARD_NT.
+        cache_blocks (int, optional): Number of decompressed BGZF blocks to cache. Default is 256.
+    """
+
+    def __init__(self, file_path, fai_path=None, all_upper=True,
+                 alphabet=constants.STANDARD_NT, cache_blocks=256):
+        self.file_path = file_path
+        self.fai_path  = file_path + '.fai' if fai_path is None else fai_path
+        self.alphabet  = list(alphabet)
+        self.n_tokens  = len(self.alphabet)
+        self.code_table   = _code_table(self.alphabet, all_upper)
+        self.onehot_table = _onehot_table(self.n_tokens)
+
+        if is_bgzf(file_path):
+            self.reader = BgzfReader(file_path, cache_blocks=cache_blocks)
+        else:
+            self.reader = UncompressedReader(file_path)
+
+        self.contigs = {}
+        with open(self.fai_path, 'r') as f:
+            for line in f:
+                key, length, offset, line_bases, line_width, *_ = line.rstrip().split('\t')
+                self.contigs[key] = IndexedContig(self, int(length), int(offset),
+                                                  int(line_bases), int(line_width))
+
+    def __getitem__(self, key):
+        return self.contigs[key]
+
+    def __iter__(self):
+        return iter(self.contigs)
+
+    def __len__(self):
+        return len(self.contigs)
+
+class IndexedFasta:
+    """
+    A Fasta-compatible reader that seeks into an indexed (optionally bgzip-compressed) FASTA file.
+
+    Args:
+        fasta_path (str): Path to the FASTA file. Requires a .fai index, and uses a .gzi index if present.
+        all_upper (bool, optional): Whether to convert sequences to uppercase. Default is True.
+        alphabet (list, optional): The alphabet of characters used for encoding sequences. Default is constants.STANDARD_NT.
+        cache_blocks (int, optional): Number of decompressed BGZF blocks to cache. Default is 256.
+
+    Attributes:
+        fasta_path (str): Path to the FASTA file.
+        all_upper (bool): Whether sequences are converted to uppercase.
+        alphabet (list): The alphabet of characters used for encoding sequences.
+        fasta (IndexedGenome): Mapping of contig keys to lazily read and one-hot encoded contigs.
+        contig_lengths (dict): Dictionary mapping contig keys to their respective sequence lengths.
+        contig_index2key (dict): Dictionary mapping contig indices to contig keys.
+        contig_key2index (dict): Dictionary mapping contig keys to their respective indices.
+    """
+
+    def __init__(self, fasta_path, all_upper=True,
+                 alphabet=constants.STANDARD_NT, cache_blocks=256):
+        self.fasta_path = fasta_path
+        self.all_upper = all_upper
+        self.alphabet = alphabet
+        self.cache_blocks = cache_blocks
+        self.read_fasta()
+
+    def read_fasta(self):
+        """
+        Reads the .fai index and populates contig attributes.
+        """
+        self.fasta = IndexedGenome(self.fasta_path, all_upper=self.all_upper,
+                                   alphabet=self.alphabet, cache_blocks=self.cache_blocks)
+
+        self.contig_lengths   = {}
+        self.contig_index2key = {}
+        self.contig_key2index = {}
+
+        for idx, (contig_key, contig) in enumerate(self.fasta.items()):
+            self.contig_lengths[contig_key] = contig.length
+            self.contig_index2key[idx] = contig_key
+            self.contig_key2index[contig_key] = idx
@@ -1,4 +1,8 @@
+import os
 import sys
+import json
+import shutil
+import hashlib
 import argparse
 import tempfile
 from functools import partial
@@ -8,7 +12,7 @@ import pandas as pd
 
 import torch
 import lightning.pytorch as pl
-from torch.utils.data import random_split, DataLoader, TensorDataset, ConcatDataset, Dataset
+from torch.utils.data import random_split, DataLoader, TensorDataset, ConcatDataset, Dataset, Subset
 
 from ..common import constants, utils
 
@@ -17,7 +21,8 @@ class DNAActivityDataset(Dataset):
     A PyTorch Dataset representing a collection of DNA sequences along with associated activity values.
     
     Args:
-        dna_tensor (torch.Tensor): A tensor containing DNA sequences represented in one-hot encoding.
+        dna_tensor (torch.Tensor): A tensor containing DNA sequences represented in one-hot encoding, or
+            a uint8 tensor of token indices with shape (n_examples, length).
         activity_tensor (torch.Tensor): A tensor containing activity values associated with DNA sequences.
         sort_tensor (torch.Tensor, optional): A tensor used for sorting the dataset based on activity values.
         duplication_cutoff (float, optional): If provided, sequences with activity values greater than or equal
@@ -32,11 +37,14 @@ class DNAActivityDataset(Dataset):
         use_reverse_complements (bool): Whether reverse complements are used.
         n_examples (int): The total number of examples in the dataset.
         n_duplicated (int): The number of duplicated examples due to class balancing.
+        is_tokenized (bool): Whether sequences are stored as token indices.
 
     Methods:
         __len__(): Returns the effective length of the dataset, accounting for duplication and reverse complements.
-        __getitem__(idx): Retrieves the DNA sequence and activity value at the specified index,
-            considering reverse complements and duplicated sequences if applicable.
+        __getitem__(idx): Retrieves the DNA sequence and activity value at the specified index (or list of indices),
+            considering reverse complements and duplicated sequences if applicable. For token storage, the
+            sequence is returned as stored along with a flag marking reverse complements, which are taken
+            after transfer to the device by expand_token_batch.
     """
     
     def __init__(self, dna_tensor, activity_tensor, sort_tensor=None, 
@@ -45,6 +53,7 @@ class DNAActivityDataset(Dataset):
         self.activity_tensor = activity_tensor
         self.duplication_cutoff = duplication_cutoff
         self.use_reverse_complements = use_reverse_complements
+        self.is_tokenized = dna_tensor.dtype == torch.uint8
         
         self.n_examples   = self.dna_tensor.shape[0]
         self.n_duplicated = 0
@@ -63,6 +72,8 @@ class DNAActivityDataset(Dataset):
         return dataset_len
     
     def __getitem__(self, idx):
+        if not isinstance(idx, (int, np.integer)) and not (torch.is_tensor(idx) and idx.ndim == 0):
+            return self.get_batch(idx)
         if idx >= len(self):
             raise IndexError(f"index {idx} is out of bounds for dataset with size {len(self)}")
         if idx < 0:
@@ -78,11 +89,131 @@ class DNAActivityDataset(Dataset):
             
         dna      = self.dna_tensor[item_idx]
         activity = self.activity_tensor[item_idx]
+        
+        if self.is_tokenized:
+            return dna, activity, torch.tensor(take_rc)
 
         if take_rc:
             dna = utils.reverse_complement_onehot(dna)
         
         return dna, activity
+    
+    def get_batch(self, idxs):
+        """
+        Retrieves a batch of DNA sequences and activity values with one gather per tensor.
+
+        Args:
+            idxs (list, numpy.ndarray, or torch.Tensor): Indices of the examples.
+
+        Returns:
+            tuple: Batched sequences and activities, plus reverse complement flags for token storage.
+        """
+        idxs = torch.as_tensor(np.asarray(idxs), dtype=torch.long)
+        if ((idxs >= len(self)) | (idxs < -len(self))).any():
+            raise IndexError(f"indices out of bounds for dataset with size {len(self)}")
+        idxs = idxs % len(self)
+        
+        if self.use_reverse_complements:
+            take_rc = idxs % 2 == 1
+            item_idx= (idxs // 2) % self.n_examples
+        else:
+            take_rc = torch.zeros_like(idxs, dtype=torch.bool)
+            item_idx= idxs % self.n_examples
+        
+        dna      = self.dna_tensor[item_idx]
+        activity = self.activity_tensor[item_idx]
+        
+        if self.is_tokenized:
+            return dna, activity, take_rc
+        
+        if take_rc.any():
+            dna[take_rc] = utils.reverse_complement_onehot(dna[take_rc])
+        
+        return dna, activity
+
+def gather_batch(dataset, idxs):
+    """
+    Gathers a batch from a dataset with one indexing call per underlying tensor. Handles
+    Subset and ConcatDataset wrappers around datasets that accept lists of indices.
+
+    Args:
+        dataset (Dataset): A DNAActivityDataset, TensorDataset, or a Subset/ConcatDataset of them.
+        idxs (list): Indices of the examples.
+
+    Returns:
+        tuple: The batched fields of the dataset.
+    """
+    if isinstance(dataset, Subset):
+        return gather_batch(dataset.dataset, [ dataset.indices[i] for i in idxs ])
+    
+    if isinstance(dataset, ConcatDataset):
+        idxs = np.asarray(idxs)
+        ds_ids = np.searchsorted(dataset.cumulative_sizes, idxs, side='right')
+        order, parts = [], []
+        for ds_id in np.unique(ds_ids):
+            members = np.nonzero(ds_ids == ds_id)[0]
+            offset  = 0 if ds_id == 0 else dataset.cumulative_sizes[ds_id-1]
+            parts.append( gather_batch(dataset.datasets[ds_id], (idxs[members] - offset).tolist()) )
+            order.append(members)
+        inverse = torch.as_tensor(np.argsort(np.concatenate(order), kind='stable'))
+        return tuple( torch.cat(field, dim=0)[inverse] for field in zip(*parts) )
+    
+    return tuple(dataset[list(idxs)])
+
+class BatchGather:
+    """
+    A DataLoader collate function that gathers whole batches from a dataset by index.
+
+    Use it with an IndexDataset so the DataLoader only samples indices, e.g.
+    DataLoader(IndexDataset(len(dataset)), collate_fn=BatchGather(dataset), ...).
+    This keeps Lightning's distributed sampler injection working.
+
+    Args:
+        dataset (Dataset): Dataset to gather from. See gather_batch.
+    """
+    
+    def __init__(self, dataset):
+        self.dataset = dataset
+        
+    def __call__(self, idxs):
+        return gather_batch(self.dataset, list(idxs))
+
+class IndexDataset(Dataset):
+    """
+    A Dataset that returns its indices. Used with BatchGather.
+
+    Args:
+        length (int): Number of indices.
+    """
+    
+    def __init__(self, length):
+        self.length = length
+        
+    def __len__(self):
+        return self.length
+    
+    def __getitem__(self, idx):
+        return idx
+
+def expand_token_batch(batch, num_classes=4, allow_unknown=False):
+    """
+    Expands a batch of token indices into one-hot sequences on the batch's device, taking
+    reverse complements where flagged. Batches of one-hot sequences are returned as is.
+
+    Args:
+        batch (tuple): Sequences, activities, and optionally reverse complement flags.
+        num_classes (int, optional): Size of the vocabulary. Default is 4.
+        allow_unknown (bool, optional): Whether tokens equal to num_classes become all-zero columns. Default is False.
+
+    Returns:
+        tuple: One-hot sequences and activities.
+    """
+    dna, activity, *take_rc = batch
+    if dna.dtype != torch.uint8:
+        return batch
+    if len(take_rc) > 0 and take_rc[0].any():
+        dna = torch.where(take_rc[0][:, None], utils.reverse_complement_tokens(dna), dna)
+    return utils.tokens2tensor(dna, num_classes=num_classes, allow_unknown=allow_unknown), activity
 
 class MPRA_DataModule(pl.LightningDataModule):
     """
@@ -113,9 +244,20 @@ class MPRA_DataModule(pl.LightningDataModule):
         normalize (bool, optional): Apply standard score normalization. Default is False.
         duplication_cutoff (float, optional): Cutoff value for duplicating sequences during training. Default is None.
         use_reverse_complements (bool, optional): Whether to use reverse complements for data augmentation. Default is False.
+        cache_dir (str, optional): Directory for caching preprocessed tensors, keyed by a hash of the data file
+            contents and preprocessing arguments. Default is None (no caching).
+        store_tokens (bool, optional): Store sequences as uint8 token indices. Batches are gathered from the
+            token store by the DataLoader's collate function on the host, and yield (tokens, activities,
+            take_rc) instead of one-hot sequences. The one-hot expansion, with reverse complements, runs in
+            on_after_batch_transfer, so only after Lightning moves the batch to the device. Other consumers
+            of the dataloaders must call expand_token_batch themselves. Default is False.
 
     Methods:
         setup(stage='train'): Preprocesses and tokenizes the dataset based on provided parameters.
+        preprocess(): Filters, pads, and tokenizes the data file.
+        cache_key(): Hash of the data file contents and preprocessing arguments.
+        load_or_preprocess(): Loads preprocessed data from the cache, building it if needed.
+        on_after_batch_transfer(batch, dataloader_idx): Expands token batches on the device.
         train_dataloader(): Returns a DataLoader for the training dataset.
         val_dataloader(): Returns a DataLoader for the validation dataset.
         test_dataloader(): Returns a DataLoader for the test dataset.
@@ -164,6 +306,10 @@ class MPRA_DataModule(pl.LightningDataModule):
                            help='sequences with max activities higher then this are duplicated in training')
         group.add_argument('--use_reverse_complements', type=utils.str2bool, default=False,
                            help='Reverse complement to augment/duplicate training examples')
+        group.add_argument('--cache_dir', type=str, 
+                           help='Directory to cache preprocessed tensors for reuse across runs and ranks')
+        group.add_argument('--store_tokens', type=utils.str2bool, default=False,
+                           help='Store sequences as uint8 tokens and one-hot encode batches after transfer to the device')
         return parser
     
     @staticmethod
@@ -203,6 +349,8 @@ class MPRA_DataModule(pl.LightningDataModule):
                  normalize=False,
                  duplication_cutoff=None,
                  use_reverse_complements=False,
+                 cache_dir=None,
+                 store_tokens=False,
                  **kwargs):
         """
         Initializes the MPRA_DataModule with provided parameters.
@@ -234,6 +382,8 @@ class MPRA_DataModule(pl.LightningDataModule):
         self.normalize = normalize
         self.duplication_cutoff = duplication_cutoff
         self.use_reverse_complements = use_reverse_complements
+        self.cache_dir = cache_dir
+        self.store_tokens = store_tokens
         
         self.pad_column_name = 'padded_seq'
         self.activity_means = None
@@ -253,9 +403,13 @@ class MPRA_DataModule(pl.LightningDataModule):
         self.synth_dataset_val = None
         self.synth_dataset_test = None
 
-    def setup(self, stage = 'train'):
+    def preprocess(self):
         """
-        Preprocesses and tokenizes the dataset based on provided parameters.
+        Filters the data file by project, stderr, and extreme values, then pads and tokenizes sequences.
+
+        Returns:
+            tuple: The filtered DataFrame, a uint8 token array of shape
+                   (n_examples, padded_seq_len), and a dict of filter statistics.
         """
         columns = [self.sequence_column, *self.activity_columns, self.chr_column, self.project_column, *self.stderr_columns]
         temp_df = utils.parse_file(file_path=self.datafile_path, columns=columns, sep=self.sep)
@@ -277,6 +431,95 @@ class MPRA_DataModule(pl.LightningDataModule):
         non_extremes_filter_down = (temp_df[self.activity_columns] > down_cut).to_numpy().all(axis=1)
         temp_df = temp_df.loc[non_extremes_filter_down]
         
+        print('Padding and tokenizing sequences... \n')
+        tokens = utils.pad_dna2tokens(temp_df[self.sequence_column].tolist(),
+                                      padded_seq_len=self.padded_seq_len,
+                                      upStreamSeq=self.left_flank,
+                                      downStreamSeq=self.right_flank)
+        
+        stats = {
+            'means': means, 'stds': stds, 'up_cut': up_cut, 'down_cut': down_cut,
+            'num_up_cuts': np.sum(~non_extremes_filter_up), 
+            'num_down_cuts': np.sum(~non_extremes_filter_down),
+        }
+        return temp_df, tokens, stats
+    
+    def cache_key(self):
+        """
+        Hash of the data file contents and preprocessing arguments.
+
+        Returns:
+            str: Hex digest identifying the preprocessed data.
+        """
+        hasher = hashlib.sha256()
+        with open(self.datafile_path, 'rb') as f:
+            for block in iter(partial(f.read, 2**24), b''):
+                hasher.update(block)
+        settings = [self.sep, sorted(self.data_project), self.project_column, self.sequence_column,
+                    self.activity_columns, self.stderr_columns, self.chr_column, self.stderr_threshold,
+                    self.std_multiple_cut, self.up_cutoff_move, self.padded_seq_len, 
+                    self.left_flank, self.right_flank]
+        hasher.update(json.dumps(settings).encode())
+        return hasher.hexdigest()
+    
+    def load_or_preprocess(self):
+        """
+        Loads preprocessed data from cache_dir, building it if needed. A file lock makes
+        concurrent ranks wait for one build instead of repeating it. Cached tokens are
+        memory-mapped.
+
+        Returns:
+            tuple: The filtered DataFrame, a uint8 token array, and a dict of filter statistics.
+        """
+        if self.cache_dir is None or not os.path.isfile(self.datafile_path):
+            return self.preprocess()
+        
+        import fcntl
+        
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_path = os.path.join(self.cache_dir, self.cache_key())
+        with open(cache_path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.isdir(cache_path):
+                temp_df, tokens, stats = self.preprocess()
+                build_path = tempfile.mkdtemp(dir=self.cache_dir)
+                np.save(os.path.join(build_path, 'tokens.npy'), tokens)
+                np.savez(os.path.join(build_path, 'stats.npz'), **stats)
+                temp_df.to_pickle(os.path.join(build_path, 'table.pkl'))
+                os.replace(build_path, cache_path)
+                print(f'Cached preprocessed data to {cache_path}')
+            else:
+                print(f'Loading preprocessed data from {cache_path}')
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        
+        tokens  = np.load(os.path.join(cache_path, 'tokens.npy'), mmap_mode='r')
+        temp_df = pd.read_pickle(os.path.join(cache_path, 'table.pkl'))
+        with np.load(os.path.join(cache_path, 'stats.npz')) as stats:
+            stats = { k: stats[k] for k in stats.files }
+        return temp_df, tokens, stats
+
+    def encode_tokens(self, tokens):
+        """
+        Converts a token array into the stored sequence representation.
+
+        Args:
+            tokens (numpy.ndarray): A uint8 token array of shape (n_examples, padded_seq_len).
+
+        Returns:
+            torch.Tensor: The uint8 tokens if store_tokens, else one-hot encoded sequences.
+        """
+        if self.store_tokens:
+            return torch.from_numpy(np.array(tokens, dtype=np.uint8))
+        return utils.tokens2tensor(tokens)
+
+    def setup(self, stage = 'train'):
+        """
+        Preprocesses and tokenizes the dataset based on provided parameters.
+        """
+        temp_df, tokens, stats = self.load_or_preprocess()
+        means, stds = stats['means'], stats['stds']
+        up_cut, down_cut = stats['up_cut'], stats['down_cut']
+        
         self.num_examples = len(temp_df)
         if self.normalize:   
             temp_df[self.activity_columns] = (temp_df[self.activity_columns] - means) / stds
@@ -291,8 +534,8 @@ class MPRA_DataModule(pl.LightningDataModule):
             bottom_cut_value = round(down_cut[idx], 2)
             print(f'{cell_name} | top cut value: {top_cut_value}, bottom cut value: {bottom_cut_value}')
         print('')    
-        num_up_cuts   = np.sum(~non_extremes_filter_up)
-        num_down_cuts = np.sum(~non_extremes_filter_down)
+        num_up_cuts   = stats['num_up_cuts']
+        num_down_cuts = stats['num_down_cuts']
         print(f'Number of examples discarded from top: {num_up_cuts}')
         print(f'Number of examples discarded from bottom: {num_down_cuts}')
         print('')
@@ -301,55 +544,39 @@ class MPRA_DataModule(pl.LightningDataModule):
         print('-'*50)
         print('')
 
-        print('Padding sequences... \n')
-        temp_df[self.pad_column_name] = temp_df.apply(self.padding_fn, axis=1)
-
         print('Creating train/val/test datasets with tokenized sequences... \n')
         all_chrs = set(temp_df[self.chr_column])
         self.train_chrs = all_chrs - self.val_chrs - self.test_chrs - self.synth_chr_as_set - self.exclude_chr_train
 
         if len(self.train_chrs) > 0:
-            split_temp_df = temp_df.loc[temp_df[self.chr_column].isin(self.train_chrs)]
-            list_tensor_seq = []
-            for index, row in split_temp_df.iterrows():
-                list_tensor_seq.append(utils.row_dna2tensor(row, in_column_name=self.pad_column_name))
-            activities_train = temp_df[temp_df[self.chr_column].isin(self.train_chrs)][self.activity_columns].to_numpy()
-            sequences_train  = torch.stack(list_tensor_seq)
+            split_filter = temp_df[self.chr_column].isin(self.train_chrs).to_numpy()
+            activities_train = temp_df.loc[split_filter, self.activity_columns].to_numpy()
+            sequences_train  = self.encode_tokens(tokens[split_filter])
             activities_train = torch.Tensor(activities_train)    
-            self.chr_dataset_train = TensorDataset(sequences_train, activities_train)
             self.chr_dataset_train = DNAActivityDataset(sequences_train, activities_train, 
                                                         sort_tensor=torch.max(activities_train, dim=-1).values, 
                                                         duplication_cutoff=self.duplication_cutoff, 
                                                         use_reverse_complements=self.use_reverse_complements)
 
         if len(self.val_chrs) > 0:
-            split_temp_df = temp_df.loc[temp_df[self.chr_column].isin(self.val_chrs)]
-            list_tensor_seq = []
-            for index, row in split_temp_df.iterrows():
-                list_tensor_seq.append(utils.row_dna2tensor(row, in_column_name=self.pad_column_name))
-            activities_val = temp_df[temp_df[self.chr_column].isin(self.val_chrs)][self.activity_columns].to_numpy()
-            sequences_val  = torch.stack(list_tensor_seq)
+            split_filter = temp_df[self.chr_column].isin(self.val_chrs).to_numpy()
+            activities_val = temp_df.loc[split_filter, self.activity_columns].to_numpy()
+            sequences_val  = self.encode_tokens(tokens[split_filter])
             activities_val = torch.Tensor(activities_val)  
             self.chr_dataset_val = TensorDataset(sequences_val, activities_val)
         
         if len(self.test_chrs) > 0:
-            split_temp_df = temp_df.loc[temp_df[self.chr_column].isin(self.test_chrs)]
-            list_tensor_seq = []
-            for index, row in split_temp_df.iterrows():
-                list_tensor_seq.append(utils.row_dna2tensor(row, in_column_name=self.pad_column_name))
-            self.chr_df_test  = temp_df[temp_df[self.chr_column].isin(self.test_chrs)]
-            activities_test   = temp_df[temp_df[self.chr_column].isin(self.test_chrs)][self.activity_columns].to_numpy()    
-            sequences_test    = torch.stack(list_tensor_seq)        
+            split_filter = temp_df[self.chr_column].isin(self.test_chrs).to_numpy()
+            self.chr_df_test  = temp_df.loc[split_filter]
+            activities_test   = temp_df.loc[split_filter, self.activity_columns].to_numpy()    
+            sequences_test    = self.encode_tokens(tokens[split_filter])        
             activities_test   = torch.Tensor(activities_test)
             self.chr_dataset_test = TensorDataset(sequences_test, activities_test)
              
         if self.synth_chr in all_chrs:
-            split_temp_df = temp_df.loc[temp_df[self.chr_column].isin(self.synth_chr_as_set)]
-            list_tensor_seq = []
-            for index, row in split_temp_df.iterrows():
-                list_tensor_seq.append(utils.row_dna2tensor(row, in_column_name=self.pad_column_name))
-            synth_activities = temp_df[temp_df[self.chr_column].isin(self.synth_chr_as_set)][self.activity_columns].to_numpy()
-            synth_sequences  = torch.stack(list_tensor_seq)
+            split_filter = temp_df[self.chr_column].isin(self.synth_chr_as_set).to_numpy()
+            synth_activities = temp_df.loc[split_filter, self.activity_columns].to_numpy()
+            synth_sequences  = self.encode_tokens(tokens[split_filter])
             synth_activities = torch.Tensor(synth_activities)
             synth_dataset = TensorDataset(synth_sequences, synth_activities)
         
@@ -364,9 +591,7 @@ class MPRA_DataModule(pl.LightningDataModule):
             self.synth_dataset_train, self.synth_dataset_val, self.synth_dataset_test = synth_dataset_split
             
             # Repackage training synth
-            dna, activities = list(zip(*list(self.synth_dataset_train)))
-            dna = torch.stack(dna, dim=0)
-            activities = torch.stack(activities, dim=0)
+            dna, activities = gather_batch(self.synth_dataset_train, list(range(len(self.synth_dataset_train))))
             self.synth_dataset_train = DNAActivityDataset(dna, activities, 
                                                           sort_tensor=torch.max(activities, dim=-1).values, 
                                                           duplication_cutoff=self.duplication_cutoff, 
@@ -415,65 +640,70 @@ class MPRA_DataModule(pl.LightningDataModule):
         print(f'Excluded from train: {excluded_size} ({excluded_pct})%')
         print('-'*50)    
                 
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        """
+        Expands token batches into one-hot sequences after they reach the device.
+        """
+        return expand_token_batch(batch)
+    
+    def make_dataloader(self, dataset, shuffle=False):
+        """
+        Returns a DataLoader that gathers whole batches from the dataset by index.
+        """
+        return DataLoader(IndexDataset(len(dataset)), batch_size=self.batch_size,
+                          shuffle=shuffle, num_workers=self.num_workers, 
+                          collate_fn=BatchGather(dataset))
+                
     def train_dataloader(self):
         """
         Returns a DataLoader for the training dataset.
         """
-        return DataLoader(self.dataset_train, batch_size=self.batch_size,
-                          shuffle=True, num_workers=self.num_workers)
+        return self.make_dataloader(self.dataset_train, shuffle=True)
     
     def val_dataloader(self):
         """
         Returns a DataLoader for the validation dataset.
         """
-        return DataLoader(self.dataset_val, batch_size=self.batch_size,
-                          shuffle=False, num_workers=self.num_workers)
+        return self.make_dataloader(self.dataset_val, shuffle=False)
 
     def test_dataloader(self):
         """
         Returns a DataLoader for the test dataset.
         """
-        return DataLoader(self.dataset_test, batch_size=self.batch_size,
-                          shuffle=False, num_workers=self.num_workers)
+        return self.make_dataloader(self.dataset_test, shuffle=False)
     
     def synth_train_dataloader(self):
         """
         Returns a DataLoader for the synthetic training dataset.
         """
-        return DataLoader(self.synth_dataset_train, batch_size=self.batch_size,
-                          shuffle=True, num_workers=self.num_workers)
+        return self.make_dataloader(self.synth_dataset_train, shuffle=True)
     
     def synth_val_dataloader(self):
         """
         Returns a DataLoader for the synthetic validation dataset.
         """
-        return DataLoader(self.synth_dataset_val, batch_size=self.batch_size,
-                          shuffle=False, num_workers=self.num_workers)
+        return self.make_dataloader(self.synth_dataset_val, shuffle=False)
 
     def synth_test_dataloader(self):
         """
         Returns a DataLoader for the synthetic test dataset.
         """
-        return DataLoader(self.synth_dataset_test, batch_size=self.batch_size,
-                          shuffle=False, num_workers=self.num_workers)
+        return self.make_dataloader(self.synth_dataset_test, shuffle=False)
     
     def chr_train_dataloader(self):
         """
         Returns a DataLoader for the chromosome-based training dataset.
         """
-        return DataLoader(self.chr_dataset_train, batch_size=self.batch_size,
-                          shuffle=True, num_workers=self.num_workers)
+        return self.make_dataloader(self.chr_dataset_train, shuffle=True)
     
     def chr_val_dataloader(self):
         """
         Returns a DataLoader for the chromosome-based validation dataset.
         """
-        return DataLoader(self.chr_dataset_val, batch_size=self.batch_size,
-                          shuffle=False, num_workers=self.num_workers)
+        return self.make_dataloader(self.chr_dataset_val, shuffle=False)
 
     def chr_test_dataloader(self):
         """
         Returns a DataLoader for the chromosome-based test dataset.
         """
-        return DataLoader(self.chr_dataset_test, batch_size=self.batch_size,
-                          shuffle=False, num_workers=self.num_workers)
\ No newline at end of file
+        return self.make_dataloader(self.chr_dataset_test, shuffle=False)
@@ -0,0 +1,689 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import torch
+import lightning.pytorch as pl
+from torch.utils.data import DataLoader, IterableDataset
+
+from ..common import constants, utils
+from .mpra_datamodule import expand_token_batch
+
+SHARD_MANIFEST = 'manifest.json'
+
+def write_mpra_shards(datafile_path, output_dir,
+                      sep='\t',
+                      sequence_column='sequence',
+                      activity_columns=['K562_log2FC', 'HepG2_log2FC', 'SKNSH_log2FC'],
+                      stderr_columns=['K562_lfcSE', 'HepG2_lfcSE', 'SKNSH_lfcSE'],
+                      chr_column='chr',
+                      project_column='data_project',
+                      padded_seq_len=600,
+                      left_flank=constants.MPRA_UPSTREAM,
+                      right_flank=constants.MPRA_DOWNSTREAM,
+                      shard_size=2**16,
+                      chunksize=2**18):
+    """
+    Convert an MPRA table into fixed-size binary shards without loading the whole table.
+
+    Rows are grouped by chromosome and data project, so each shard holds a single
+    group. Sequences are padded, tokenized, and packed four bases to a byte. Each
+    shard is written as .npy files that can be memory-mapped, and a JSON manifest
+    lists the shards with their group and size.
+
+    Args:
+        datafile_path (str): Path to the MPRA table.
+        output_dir (str): Directory for the shards and manifest.
+        sep (str, optional): Delimiter for data file. Default is tab.
+        sequence_column (str, optional): Name of the column containing DNA sequences. Default is 'sequence'.
+        activity_columns (list, optional): Names of the columns containing activity values.
+        stderr_columns (list, optional): Names of the columns containing stderr of activity values.
+        chr_column (str, optional): Name of the column containing chromosome info. Default is 'chr'.
+        project_column (str, optional): Name of the column containing data project info. Default is 'data_project'.
+        padded_seq_len (int, optional): Desired total sequence length after padding. Default is 600.
+        left_flank (str, optional): Upstream padding sequence. Default is constants.MPRA_UPSTREAM.
+        right_flank (str, optional): Downstream padding sequence. Default is constants.MPRA_DOWNSTREAM.
+        shard_size (int, optional): Number of rows per shard. The last shard of each group may be smaller. Default is 2**16.
+        chunksize (int, optional): Number of table rows parsed at a time. Default is 2**18.
+
+    Returns:
+        dict: The manifest.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    columns = [sequence_column, *activity_columns, chr_column, project_column, *stderr_columns]
+
+    buffers = {}
+    shards  = []
+    n_rows, n_skipped = 0, 0
+
+    def write_shard(group, fields):
+        name = f'shard_{len(shards):06d}'
+        for field, values in fields.items():
+            np.save(os.path.join(output_dir, f'{name}.{field}.npy'), values)
+        shards.append({'name': name, 'chr': group[0], 'project': group[1], 'n': int(fields['row_ids'].shape[0])})
+
+    def flush(group, final=False):
+        fields = { k: np.concatenate(v, axis=0) for k, v in buffers.pop(group).items() }
+        n_full = fields['row_ids'].shape[0] // shard_size
+        for i in range(n_full):
+            write_shard(group, { k: v[i*shard_size:(i+1)*shard_size] for k, v in fields.items() })
+        remainder = { k: v[n_full*shard_size:] for k, v in fields.items() }
+        if remainder['row_ids'].shape[0] > 0:
+            if final:
+                write_shard(group, remainder)
+            else:
+                buffers[group] = { k: [v] for k, v in remainder.items() }
+
+    reader = pd.read_csv(datafile_path, sep=sep, usecols=columns, chunksize=chunksize,
+                         dtype={chr_column: str, project_column: str})
+    for chunk in reader:
+        chunk = chunk.dropna()
+        tokens = utils.pad_dna2tokens(chunk[sequence_column].tolist(),
+                                      padded_seq_len=padded_seq_len,
+                                      upStreamSeq=left_flank,
+                                      downStreamSeq=right_flank)
+        in_vocab = (tokens < len(constants.STANDARD_NT)).all(axis=1)
+        n_skipped += int((~in_vocab).sum())
+        n_rows    += int(in_vocab.sum())
+        chunk, tokens = chunk.loc[in_vocab], tokens[in_vocab]
+
+        groups = chunk.groupby([chr_column, project_column], sort=False).indices
+        for group, members in groups.items():
+            fields = {
+                'row_ids':    chunk.index.to_numpy()[members].astype(np.int64),
+                'tokens':     utils.pack_tokens(tokens[members]),
+                'activities': chunk[activity_columns].to_numpy(dtype=np.float32)[members],
+                'stderr':     chunk[stderr_columns].to_numpy(dtype=np.float32)[members],
+            }
+            buffer = buffers.setdefault(group, { k: [] for k in fields })
+            for k, v in fields.items():
+                buffer[k].append(v)
+            if sum( v.shape[0] for v in buffer['row_ids'] ) >= shard_size:
+                flush(group)
+
+    for group in list(buffers.keys()):
+        flush(group, final=True)
+
+    manifest = {
+        'version': 1,
+        'source': os.path.basename(datafile_path),
+        'padded_seq_len': padded_seq_len,
+        'activity_columns': activity_columns,
+        'stderr_columns': stderr_columns,
+        'n_rows': n_rows,
+        'n_skipped': n_skipped,
+        'shards': shards,
+    }
+    with tempfile.NamedTemporaryFile('w', dir=output_dir, delete=False) as f:
+        json.dump(manifest, f)
+    os.replace(f.name, os.path.join(output_dir, SHARD_MANIFEST))
+
+    print(f'wrote {n_rows} rows in {len(shards)} shards, skipped {n_skipped} rows with unknown bases', file=sys.stderr)
+    return manifest
+
+def read_manifest(shard_dir):
+    """
+    Read the manifest of a shard directory written by write_mpra_shards.
+
+    Args:
+        shard_dir (str): Directory containing the shards.
+
+    Returns:
+        dict: The manifest.
+    """
+    with open(os.path.join(shard_dir, SHARD_MANIFEST), 'r') as f:
+        return json.load(f)
+
+def load_shard(shard_dir, shard, fields=('row_ids', 'tokens', 'activities', 'stderr')):
+    """
+    Memory-map the fields of a shard.
+
+    Args:
+        shard_dir (str): Directory containing the shards.
+        shard (dict): Manifest entry of the shard.
+        fields (tuple, optional): Fields to load.
+
+    Returns:
+        dict: Memory-mapped arrays for each field.
+    """
+    return { field: np.load(os.path.join(shard_dir, f"{shard['name']}.{field}.npy"), mmap_mode='r')
+             for field in fields }
+
+def row_uniform(row_ids, seed=0):
+    """
+    Hash row ids to reproducible uniform values in [0, 1) with splitmix64.
+
+    Args:
+        row_ids (numpy.ndarray): Integer row ids.
+        seed (int, optional): Seed mixed into the hash. Default is 0.
+
+    Returns:
+        numpy.ndarray: Uniform values for each row.
+    """
+    with np.errstate(over='ignore'):
+        z = row_ids.astype(np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / float(2**53)
+
+class ShardedMPRADataset(IterableDataset):
+    """
+    A streaming dataset over MPRA shards written by write_mpra_shards.
+
+    Shards are split across distributed ranks and DataLoader workers. Each worker
+    reads its shards one at a time and shuffles rows in a bounded buffer, so memory
+    per worker does not depend on dataset size. Batches hold uint8 tokens,
+    activities, and reverse complement flags, to be expanded with expand_token_batch.
+
+    Shards differ in size, so ranks would read different numbers of batches and DDP
+    collectives would hang at the end of an epoch. Once count_rows has been called,
+    every rank is capped to the smallest number of batches of any rank, and the rows
+    past the cap are left out for the epoch. Under DDP, drop_last must be True so
+    all batches have the same size.
+
+    Args:
+        shard_dir (str): Directory containing the shards.
+        shards (list): Manifest entries of the shards to stream.
+        padded_seq_len (int): Length of the stored sequences.
+        batch_size (int, optional): Number of examples per batch. Default is 32.
+        stderr_threshold (float, optional): Keep rows where the maximum stderr is below this value. Default is None.
+        up_cut (numpy.ndarray, optional): Keep rows where all activities are below these values. Default is None.
+        down_cut (numpy.ndarray, optional): Keep rows where all activities are above these values. Default is None.
+        means (numpy.ndarray, optional): If provided with stds, activities are standard score normalized. Default is None.
+        stds (numpy.ndarray, optional): Standard deviations for normalization. Default is None.
+        synth_chr (str, optional): Chromosome identifier of non-mapped rows that are split by row. Default is None.
+        synth_range (tuple, optional): Keep synth_chr rows whose hashed uniform value falls in [low, high). Default is (0., 1.).
+        synth_seed (int, optional): Seed for hashing synth_chr rows. Default is 0.
+        duplication_cutoff (float, optional): Rows with a max (normalized) activity at or above this value are yielded twice. Default is None.
+        use_reverse_complements (bool, optional): Yield each row on both strands. Default is False.
+        shuffle (bool, optional): Shuffle shard order and rows within the buffer. Default is False.
+        buffer_size (int, optional): Number of rows held for shuffling. Default is 2**16.
+        drop_last (bool, optional): Drop the last incomplete batch of each worker. Required under DDP. Default is False.
+
+    Attributes:
+        shard_rows (dict): Number of rows each shard yields per epoch, set by count_rows. None until then.
+    """
+
+    def __init__(self, shard_dir, shards, padded_seq_len, batch_size=32,
+                 stderr_threshold=None, up_cut=None, down_cut=None,
+                 means=None, stds=None,
+                 synth_chr=None, synth_range=(0., 1.), synth_seed=0,
+                 duplication_cutoff=None, use_reverse_complements=False,
+                 shuffle=False, buffer_size=2**16, drop_last=False):
+        super().__init__()
+        self.shard_dir = shard_dir
+        self.shards = sorted(shards, key=lambda x: x['name'])
+        self.padded_seq_len = padded_seq_len
+        self.batch_size = batch_size
+        self.stderr_threshold = stderr_threshold
+        self.up_cut = up_cut
+        self.down_cut = down_cut
+        self.means = means
+        self.stds = stds
+        self.synth_chr = synth_chr
+        self.synth_range = synth_range
+        self.synth_seed = synth_seed
+        self.duplication_cutoff = duplication_cutoff
+        self.use_reverse_complements = use_reverse_complements
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.drop_last = drop_last
+        self.shard_rows = None
+
+    def row_filter(self, shard, fields):
+        """
+        Get the rows of a shard that pass the quality, extreme value, and synth split filters.
+
+        Args:
+            shard (dict): Manifest entry of the shard.
+            fields (dict): Arrays of the shard. Needs 'row_ids', 'activities' and 'stderr'.
+
+        Returns:
+            numpy.ndarray: Boolean mask of kept rows.
+        """
+        activities = np.asarray(fields['activities'])
+        keep = np.ones(activities.shape[0], dtype=bool)
+        if self.stderr_threshold is not None:
+            keep &= np.asarray(fields['stderr']).max(axis=1) < self.stderr_threshold
+        if self.up_cut is not None:
+            keep &= (activities < self.up_cut).all(axis=1)
+        if self.down_cut is not None:
+            keep &= (activities > self.down_cut).all(axis=1)
+        if self.synth_chr is not None and shard['chr'] == self.synth_chr:
+            u = row_uniform(np.asarray(fields['row_ids']), self.synth_seed)
+            keep &= (u >= self.synth_range[0]) & (u < self.synth_range[1])
+        return keep
+
+    def normalize(self, activities):
+        """
+        Standard score normalize activities, if means and stds were given.
+
+        Normalization comes before the duplication cutoff, as in MPRA_DataModule.setup.
+
+        Args:
+            activities (numpy.ndarray): Raw activities of shape (n_rows, n_outputs).
+
+        Returns:
+            numpy.ndarray: float32 activities.
+        """
+        if self.means is not None and self.stds is not None:
+            return ((np.asarray(activities, dtype=np.float64) - self.means) / self.stds).astype(np.float32)
+        return np.array(activities, dtype=np.float32)
+
+    def read_shard(self, shard):
+        """
+        Read the kept rows of a shard, applying normalization, duplication and strand expansion.
+
+        Args:
+            shard (dict): Manifest entry of the shard.
+
+        Returns:
+            tuple: Token, activity, and reverse complement flag arrays.
+        """
+        fields = load_shard(self.shard_dir, shard)
+        keep   = self.row_filter(shard, fields)
+        tokens = utils.unpack_tokens(fields['tokens'][keep], self.padded_seq_len)
+        activities = self.normalize(fields['activities'][keep])
+
+        if self.duplication_cutoff is not None:
+            duplicated = activities.max(axis=1, initial=-np.inf) >= self.duplication_cutoff
+            tokens     = np.concatenate([tokens, tokens[duplicated]], axis=0)
+            activities = np.concatenate([activities, activities[duplicated]], axis=0)
+
+        take_rc = np.zeros(tokens.shape[0], dtype=bool)
+        if self.use_reverse_complements:
+            tokens     = np.concatenate([tokens, tokens], axis=0)
+            activities = np.concatenate([activities, activities], axis=0)
+            take_rc    = np.concatenate([take_rc, ~take_rc], axis=0)
+
+        return tokens, activities, take_rc
+
+    def count_rows(self):
+        """
+        Count the rows each shard yields per epoch and store them in shard_rows.
+
+        Returns:
+            int: Number of rows passing the filters, before duplication and reverse complements.
+        """
+        self.shard_rows, n_kept = {}, 0
+        for shard in self.shards:
+            fields = load_shard(self.shard_dir, shard, fields=('row_ids', 'activities', 'stderr'))
+            keep   = self.row_filter(shard, fields)
+            n_rows = int(keep.sum())
+            n_kept += n_rows
+            if self.duplication_cutoff is not None:
+                activities = self.normalize(np.asarray(fields['activities'])[keep])
+                n_rows += int((activities.max(axis=1, initial=-np.inf) >= self.duplication_cutoff).sum())
+            self.shard_rows[shard['name']] = n_rows * (2 if self.use_reverse_complements else 1)
+        return n_kept
+
+    def worker_info(self):
+        """
+        Get the position of the current process among ranks and DataLoader workers.
+
+        Returns:
+            tuple: Rank, world size, worker id, and number of workers.
+        """
+        rank, world_size = 0, 1
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id   = 0 if worker_info is None else worker_info.id
+        n_workers   = 1 if worker_info is None else worker_info.num_workers
+        return rank, world_size, worker_id, n_workers
+
+    def worker_shards(self, rank=None, worker_id=None):
+        """
+        Get the shards read by a rank and DataLoader worker.
+
+        Args:
+            rank (int, optional): Distributed rank. Defaults to the current one.
+            worker_id (int, optional): DataLoader worker. Defaults to the current one.
+
+        Returns:
+            list: Manifest entries of the shards.
+        """
+        current_rank, world_size, current_worker, n_workers = self.worker_info()
+        rank      = current_rank if rank is None else rank
+        worker_id = current_worker if worker_id is None else worker_id
+        return self.shards[rank*n_workers + worker_id::world_size*n_workers]
+
+    def worker_batches(self, rank, worker_id):
+        """
+        Count the batches a rank and DataLoader worker yield per epoch, before capping.
+
+        Args:
+            rank (int): Distributed rank.
+            worker_id (int): DataLoader worker.
+
+        Returns:
+            int: Number of batches.
+        """
+        n_rows = sum( self.shard_rows[shard['name']] for shard in self.worker_shards(rank, worker_id) )
+        n_full, partial = divmod(n_rows, self.batch_size)
+        return n_full + (1 if partial > 0 and not self.drop_last else 0)
+
+    def batch_quota(self):
+        """
+        Get the number of batches the current worker may yield so every rank yields the same number.
+
+        The smallest per-rank total is split across the workers of each rank in proportion
+        to their share of the rank's batches.
+
+        Returns:
+            int: Batch quota of the current worker, or None if ranks aren't capped.
+        """
+        rank, world_size, worker_id, n_workers = self.worker_info()
+        if world_size == 1 or self.shard_rows is None:
+            return None
+        assert self.drop_last, "Set drop_last=True for distributed training."
+        batches = np.array([ [ self.worker_batches(r, w) for w in range(n_workers) ] for r in range(world_size) ])
+        target  = batches.sum(axis=1).min()
+        own     = batches[rank]
+        if own.sum() == target:
+            return int(own[worker_id])
+        quota = own * target // own.sum()
+        for w in range(n_workers):
+            if quota.sum() < target and quota[w] < own[w]:
+                quota[w] += 1
+        return int(quota[worker_id])
+
+    def __iter__(self):
+        quota = self.batch_quota()
+        batches = self.stream()
+        return batches if quota is None else itertools.islice(batches, quota)
+
+    def stream(self):
+        """
+        Stream the batches of the current worker's shards.
+
+        Yields:
+            tuple: Batched uint8 tokens, float32 activities, and bool reverse complement flags.
+        """
+        # Drawn from torch's generator so runs are reproducible under seed_everything.
+        # DataLoader reseeds torch in each worker at every epoch.
+        rng = np.random.default_rng( torch.randint(2**62, (1,)).item() )
+
+        shards = self.worker_shards()
+        if self.shuffle:
+            shards = [ shards[i] for i in rng.permutation(len(shards)) ]
+
+        pool = None
+        for shard in shards:
+            chunk = self.read_shard(shard)
+            pool  = chunk if pool is None else tuple( np.concatenate([p, c], axis=0) for p, c in zip(pool, chunk) )
+            if pool[0].shape[0] >= self.buffer_size + self.batch_size:
+                n_out = (pool[0].shape[0] - self.buffer_size // 2) // self.batch_size * self.batch_size
+                if self.shuffle:
+                    order = rng.permutation(pool[0].shape[0])
+                    pool  = tuple( p[order] for p in pool )
+                yield from self.batches( tuple( p[:n_out] for p in pool ) )
+                pool = tuple( p[n_out:] for p in pool )
+
+        if pool is not None:
+            if self.shuffle:
+                order = rng.permutation(pool[0].shape[0])
+                pool  = tuple( p[order] for p in pool )
+            yield from self.batches(pool, final=True)
+
+    def batches(self, arrays, final=False):
+        """
+        Split arrays into batches of tensors.
+
+        Args:
+            arrays (tuple): Token, activity, and reverse complement flag arrays.
+            final (bool, optional): Whether an incomplete last batch may be yielded. Default is False.
+
+        Yields:
+            tuple: Batched uint8 tokens, float32 activities, and bool reverse complement flags.
+        """
+        n_rows = arrays[0].shape[0]
+        for start in range(0, n_rows, self.batch_size):
+            if start + self.batch_size > n_rows and (self.drop_last or not final):
+                break
+            yield tuple( torch.from_numpy(np.ascontiguousarray(a[start:start+self.batch_size])) for a in arrays )
+
+class ShardedMPRA_DataModule(pl.LightningDataModule):
+    """
+    PyTorch Lightning DataModule that streams MPRA data from shards written by write_mpra_shards
+    (see src/shard_mpra.py). Splitting, filtering, and normalization follow MPRA_DataModule, but
+    no more than a shuffle buffer of rows is held in memory per worker.
+
+    Filter statistics are computed from the activity and stderr arrays only, one shard at a time.
+    Non-mapped (synth_chr) rows are split into train/val/test by a hash of their row number
+    rather than by random_split.
+
+    Under DDP (set up before setup() is called), the last incomplete batch of each worker is
+    dropped and every rank is capped to the same number of batches, see ShardedMPRADataset.
+
+    Args:
+        shard_dir (str): Directory containing the shards and manifest.
+        data_project (list, optional): Data projects to keep. Default is ['UKBB', 'GTEX', 'CRE'].
+        exclude_chr_train (list, optional): Chromosomes to be excluded from training. Default is [''].
+        val_chrs (list, optional): Chromosomes for validation. Default is ['19', '21', 'X'].
+        test_chrs (list, optional): Chromosomes for testing. Default is ['7', '13'].
+        stderr_threshold (float, optional): Threshold for feature stderr of examples. Default is 1.0.
+        std_multiple_cut (float, optional): Cut-off for extreme value filtering. Default is 6.0.
+        up_cutoff_move (float, optional): Cut-off shift for extreme value filtering. Default is 4.0.
+        synth_chr (str, optional): Synthetic chromosome identifier. Default is 'synth'.
+        synth_val_pct (float, optional): Percentage of synthetic data for validation. Default is 10.0.
+        synth_test_pct (float, optional): Percentage of synthetic data for testing. Default is 10.0.
+        synth_seed (int, optional): Seed for synthetic data selection. Default is 0.
+        batch_size (int, optional): Number of examples in each mini batch. Default is 32.
+        num_workers (int, optional): Number of workers for data loading. Default is 8.
+        normalize (bool, optional): Apply standard score normalization. Default is False.
+        duplication_cutoff (float, optional): Cutoff value for duplicating sequences during training. Default is None.
+        use_reverse_complements (bool, optional): Whether to use reverse complements for data augmentation. Default is False.
+        shuffle_buffer (int, optional): Number of rows each worker holds for shuffling. Default is 2**16.
+
+    Methods:
+        setup(stage='train'): Computes filter statistics and builds the streaming datasets.
+        train_dataloader(): Returns a DataLoader for the training dataset.
+        val_dataloader(): Returns a DataLoader for the validation dataset.
+        test_dataloader(): Returns a DataLoader for the test dataset.
+    """
+
+    @staticmethod
+    def add_data_specific_args(parent_parser):
+        parser = argparse.ArgumentParser(parents=[parent_parser], add_help=False)
+        group  = parser.add_argument_group('Data Module args')
+
+        group.add_argument('--shard_dir', type=str, required=True, help="Directory of MPRA shards written by src/shard_mpra.py.")
+        group.add_argument('--data_project', nargs='+', action=utils.ExtendAction, default=['UKBB','GTEX','CRE'], help="Values which indicate examples to keep from data file.")
+        group.add_argument('--stderr_threshold', type=float, default=1.0, help="Threshold for feature stderr of examples to be used for train/val/test.")
+        group.add_argument('--exclude_chr_train', type=str, nargs='+', default=[''], help="Chromosomes to exclude from the data set.")
+        group.add_argument('--val_chrs', type=str, nargs='+', default=['19','21','X'], help="Chromosomes to reserve for model validation during fitting/HPO")
+        group.add_argument('--test_chrs', type=str, nargs='+', default=['7','13'], help="Chromosomes to reserve for final generalizability testing")
+        group.add_argument('--std_multiple_cut', type=float, default=6.0, help="Factor to multipy by standard deviation to define bounds for trusted measurements. Removes extreme outliers.")
+        group.add_argument('--up_cutoff_move', type=float, default=3.0, help="Shift factor for upper bound of outlier filter.")
+        group.add_argument('--synth_chr', type=str, default='synth', help="Value to identify non-mapped elements with no assigned chomosome.")
+        group.add_argument('--synth_val_pct', type=float, default=10.0, help="Percentage of non-mapped elements to reserve in validation set.")
+        group.add_argument('--synth_test_pct', type=float, default=10.0, help="Percentage of non-mapped elements to reserve in test set.")
+        group.add_argument('--synth_seed', type=int, default=0, help="Random seed to control splitting of non-mapped elements.")
+        group.add_argument('--batch_size', type=int, default=32,
+                           help='Number of examples in each mini batch')
+        group.add_argument('--num_workers', type=int, default=8,
+                           help='number of gpus or cpu cores to be used')
+        group.add_argument('--normalize', type=utils.str2bool, default=False,
+                           help='apply standard score normalization')
+        group.add_argument('--duplication_cutoff', type=float,
+                           help='sequences with max activities higher then this are duplicated in training')
+        group.add_argument('--use_reverse_complements', type=utils.str2bool, default=False,
+                           help='Reverse complement to augment/duplicate training examples')
+        group.add_argument('--shuffle_buffer', type=int, default=2**16,
+                           help='Number of examples each data loading worker holds for shuffling')
+        return parser
+
+    @staticmethod
+    def add_conditional_args(parser, known_args):
+        return parser
+
+    @staticmethod
+    def process_args(grouped_args):
+        data_args    = grouped_args['Data Module args']
+        return data_args
+
+    def __init__(self,
+                 shard_dir,
+                 data_project=['UKBB', 'GTEX', 'CRE'],
+                 exclude_chr_train=[''],
+                 val_chrs=['19','21','X'],
+                 test_chrs=['7','13'],
+                 stderr_threshold=1.0,
+                 std_multiple_cut=6.0,
+                 up_cutoff_move=4.0,
+                 synth_chr='synth',
+                 synth_val_pct=10.0,
+                 synth_test_pct=10.0,
+                 synth_seed=0,
+                 batch_size=32,
+                 num_workers=8,
+                 normalize=False,
+                 duplication_cutoff=None,
+                 use_reverse_complements=False,
+                 shuffle_buffer=2**16,
+                 **kwargs):
+        """
+        Initializes the ShardedMPRA_DataModule with provided parameters.
+        """
+        super().__init__()
+        self.shard_dir = shard_dir
+        self.data_project = data_project
+        self.exclude_chr_train = set(exclude_chr_train) - {''}
+        self.val_chrs = set(val_chrs) - {''}
+        self.test_chrs = set(test_chrs) - {''}
+        self.stderr_threshold = stderr_threshold
+        self.std_multiple_cut = std_multiple_cut
+        self.up_cutoff_move = up_cutoff_move
+        self.synth_chr = synth_chr
+        self.synth_val_pct = synth_val_pct
+        self.synth_test_pct = synth_test_pct
+        self.synth_seed = synth_seed
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.normalize = normalize
+        self.duplication_cutoff = duplication_cutoff
+        self.use_reverse_complements = use_reverse_complements
+        self.shuffle_buffer = shuffle_buffer
+
+        self.activity_means = None
+        self.activity_stds = None
+        self.dataset_train = None
+        self.dataset_val = None
+        self.dataset_test = None
+
+    def activity_stats(self, shards):
+        """
+        Compute means and standard deviations of activities passing the stderr filter, one shard at a time.
+
+        Args:
+            shards (list): Manifest entries of the shards.
+
+        Returns:
+            tuple: Arrays of means and standard deviations (ddof=1).
+        """
+        n, total, total_sq = 0, 0., 0.
+        for shard in shards:
+            fields = load_shard(self.shard_dir, shard, fields=('activities', 'stderr'))
+            keep   = np.asarray(fields['stderr']).max(axis=1) < self.stderr_threshold
+            values = np.asarray(fields['activities'], dtype=np.float64)[keep]
+            n += values.shape[0]
+            total    = total + values.sum(axis=0)
+            total_sq = total_sq + (values ** 2).sum(axis=0)
+        means = total / n
+        stds  = np.sqrt( np.maximum(total_sq - n * means ** 2, 0.) / (n - 1) )
+        return means, stds
+
+    def setup(self, stage = 'train'):
+        """
+        Computes filter statistics and builds the streaming train/val/test datasets.
+        """
+        self.manifest = read_manifest(self.shard_dir)
+        shards = [ shard for shard in self.manifest['shards'] if shard['project'] in self.data_project ]
+
+        means, stds = self.activity_stats(shards)
+        up_cut   = means + stds * self.std_multiple_cut + self.up_cutoff_move
+        down_cut = means - stds * self.std_multiple_cut
+
+        if self.normalize:
+            self.activity_means = torch.Tensor(means)
+            self.activity_stds = torch.Tensor(stds)
+
+        all_chrs = set( shard['chr'] for shard in shards )
+        self.train_chrs = all_chrs - self.val_chrs - self.test_chrs - {self.synth_chr} - self.exclude_chr_train
+
+        val_cut  = self.synth_val_pct / 100
+        test_cut = (self.synth_val_pct + self.synth_test_pct) / 100
+
+        train_chrs = set(self.train_chrs)
+        if self.synth_chr not in self.exclude_chr_train:
+            train_chrs.add(self.synth_chr)
+
+        common = {
+            'shard_dir': self.shard_dir, 'padded_seq_len': self.manifest['padded_seq_len'],
+            'batch_size': self.batch_size, 'stderr_threshold': self.stderr_threshold,
+            'up_cut': up_cut, 'down_cut': down_cut,
+            'means': means if self.normalize else None, 'stds': stds if self.normalize else None,
+            'synth_chr': self.synth_chr, 'synth_seed': self.synth_seed,
+            'drop_last': torch.distributed.is_available() and torch.distributed.is_initialized(),
+        }
+        self.dataset_train = ShardedMPRADataset(
+            shards=[ shard for shard in shards if shard['chr'] in train_chrs ],
+            synth_range=(test_cut, 1.),
+            duplication_cutoff=self.duplication_cutoff,
+            use_reverse_complements=self.use_reverse_complements,
+            shuffle=True, buffer_size=self.shuffle_buffer, **common
+        )
+        self.dataset_val = ShardedMPRADataset(
+            shards=[ shard for shard in shards if shard['chr'] in self.val_chrs | {self.synth_chr} ],
+            synth_range=(0., val_cut), **common
+        )
+        self.dataset_test = ShardedMPRADataset(
+            shards=[ shard for shard in shards if shard['chr'] in self.test_chrs | {self.synth_chr} ],
+            synth_range=(val_cut, test_cut), **common
+        )
+
+        # Also sizes the shards, so ranks can be capped to the same number of batches
+        self.train_size = self.dataset_train.count_rows()
+        self.val_size   = self.dataset_val.count_rows()
+        self.test_size  = self.dataset_test.count_rows()
+
+        print('-'*50)
+        print('')
+        print(f'Number of shards available: {len(shards)}')
+        print(f'Number of examples in train: {self.train_size}')
+        print(f'Number of examples in val:   {self.val_size}')
+        print(f'Number of examples in test:  {self.test_size}')
+        print('')
+        print('-'*50)
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        """
+        Expands token batches into one-hot sequences after they reach the device.
+        """
+        return expand_token_batch(batch)
+
+    def train_dataloader(self):
+        """
+        Returns a DataLoader for the training dataset.
+        """
+        return DataLoader(self.dataset_train, batch_size=None, num_workers=self.num_workers)
+
+    def val_dataloader(self):
+        """
+        Returns a DataLoader for the validation dataset.
+        """
+        return DataLoader(self.dataset_val, batch_size=None, num_workers=self.num_workers)
+
+    def test_dataloader(self):
+        """
+        Returns a DataLoader for the test dataset.
+        """
+        return DataLoader(self.dataset_test, batch_size=None, num_workers=self.num_workers)
@@ -1,18 +1,134 @@
+import io
+import os
+import sys
+import json
+import hashlib
+import tempfile
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
 import torch
 import numpy as np
+import pandas as pd
 from torch.utils.data import Dataset
 
 from ..common import constants, utils
+from .mpra_datamodule import IndexDataset, BatchGather, expand_token_batch
+
+def encode_table_chunk(text, left_flank, right_flank, seq_len):
+    """
+    Parse tab-separated lines of a sequence and its scores, and encode them as arrays.
+
+    Args:
+        text (bytes): Complete lines of the table.
+        left_flank (str): Upstream padding sequence.
+        right_flank (str): Downstream padding sequence.
+        seq_len (int): Padded sequence length.
+
+    Returns:
+        tuple: A uint8 token array of shape (n, seq_len) and a float32 score array of shape (n, n_scores).
+    """
+    table  = pd.read_csv(io.BytesIO(text), sep='\t', header=None, dtype={0: str}, na_filter=False)
+    tokens = utils.pad_dna2tokens(table[0].tolist(), padded_seq_len=seq_len,
+                                  upStreamSeq=left_flank, downStreamSeq=right_flank)
+    scores = table.iloc[:, 1:].to_numpy(dtype=np.float32)
+    return tokens, scores
+
+def split_lines(file_path, n_chunks, skip_header=False):
+    """
+    Read a text file in roughly equal chunks of complete lines.
+
+    Args:
+        file_path (str): Path to the file.
+        n_chunks (int): Number of chunks.
+        skip_header (bool, optional): Whether to drop the first line. Default is False.
+
+    Yields:
+        bytes: Complete lines of the file.
+    """
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        if skip_header:
+            f.readline()
+        start = f.tell()
+        for i in range(1, n_chunks + 1):
+            f.seek(max(start, file_size * i // n_chunks))
+            if 0 < f.tell() < file_size:
+                f.readline()
+            end = f.tell()
+            if end > start:
+                f.seek(start)
+                yield f.read(end - start)
+            start = end
 
+def encode_table(file_path, left_flank, right_flank, seq_len=600, skip_header=False, num_workers=1):
+    """
+    Encode a tab-separated table of sequences and scores into contiguous arrays.
+
+    The file is split into chunks of complete lines, which are parsed in bulk, in parallel
+    processes if num_workers > 1.
+
+    Args:
+        file_path (str): Path to the table.
+        left_flank (str): Upstream padding sequence.
+        right_flank (str): Downstream padding sequence.
+        seq_len (int, optional): Padded sequence length. Default is 600.
+        skip_header (bool, optional): Whether to skip the first line. Default is False.
+        num_workers (int, optional): Number of parsing processes. Default is 1.
+
+    Returns:
+        tuple: A uint8 token array of shape (n, seq_len) and a float32 score array of shape (n, n_scores).
+    """
+    encode = partial(encode_table_chunk, left_flank=left_flank, right_flank=right_flank, seq_len=seq_len)
+    chunks = split_lines(file_path, max(num_workers, 1) * 4, skip_header=skip_header)
+    if num_workers > 1:
+        with ProcessPoolExecutor(num_workers) as executor:
+            parts = list(executor.map(encode, chunks))
+    else:
+        parts = [ encode(chunk) for chunk in chunks ]
+    if len(parts) == 0:
+        return np.zeros((0, seq_len), dtype=np.uint8), np.zeros((0, 0), dtype=np.float32)
+    tokens, scores = zip(*parts)
+    return np.concatenate(tokens, axis=0), np.concatenate(scores, axis=0)
 
 class InputSequences(Dataset):
-    def __init__(self, file_path, left_flank, right_flank, seq_len=600, use_revcomp=False, skip_header=False):
+    """
+    Dataset of flanked sequences and scores read from a tab-separated file, with the
+    sequence in the first column and scores in the rest.
+
+    By default lines are kept as strings and encoded on access. With cache_tokens=True the
+    file is encoded once into uint8 tokens and float32 scores, saved in cache_dir or next to
+    the source file (keyed by its contents and the flanking settings), and memory-mapped on
+    later runs. Lists of indices then return whole batches of tokens, scores, and reverse
+    complement flags for expand_token_batch.
+
+    Args:
+        file_path (str): Path to the table.
+        left_flank (str): Upstream padding sequence.
+        right_flank (str): Downstream padding sequence.
+        seq_len (int, optional): Padded sequence length. Default is 600.
+        use_revcomp (bool, optional): Add the reverse complement of each sequence. Default is False.
+        skip_header (bool, optional): Whether to skip the first line. Default is False.
+        cache_tokens (bool, optional): Encode and cache the file as arrays. Default is False.
+        num_workers (int, optional): Number of processes used to encode the file. Default is 1.
+        cache_dir (str, optional): Directory for the cached arrays. Default is None (next to the source file).
+    """
+    def __init__(self, file_path, left_flank, right_flank, seq_len=600, use_revcomp=False, skip_header=False,
+                 cache_tokens=False, num_workers=1, cache_dir=None):
         self.data = []
+        self.file_path = file_path
         self.left_flank = left_flank
         self.right_flank = right_flank
         self.seq_len = seq_len
         self.use_revcomp = use_revcomp
         self.skip_header = skip_header
+        self.cache_tokens = cache_tokens
+        self.num_workers = num_workers
+        self.cache_dir = cache_dir
+        
+        if self.cache_tokens:
+            self.tokens, self.scores = self.load_or_encode()
+            return
         
         with open(file_path, 'r') as file:
             if self.skip_header:
@@ -26,13 +142,78 @@ class InputSequences(Dataset):
         # Define a mapping for nucleotides to indices
         self.nucleotide_to_index = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
 
+    def cache_path(self):
+        """
+        Path prefix of the cached arrays, keyed by the file contents and flanking settings.
+        """
+        hasher = hashlib.sha256()
+        with open(self.file_path, 'rb') as f:
+            for block in iter(partial(f.read, 2**24), b''):
+                hasher.update(block)
+        settings = [self.left_flank, self.right_flank, self.seq_len, self.skip_header]
+        hasher.update(json.dumps(settings).encode())
+        cache_dir = os.path.dirname(os.path.abspath(self.file_path)) if self.cache_dir is None else self.cache_dir
+        return os.path.join(cache_dir, f'{os.path.basename(self.file_path)}.{hasher.hexdigest()[:16]}')
+
+    def load_or_encode(self):
+        """
+        Loads the cached arrays of the file, encoding and caching them if needed.
+
+        Returns:
+            tuple: Memory-mapped uint8 tokens and float32 scores.
+        """
+        prefix = self.cache_path()
+        if not os.path.isfile(prefix + '.scores.npy'):
+            tokens, scores = encode_table(self.file_path, self.left_flank, self.right_flank, self.seq_len,
+                                          self.skip_header, self.num_workers)
+            try:
+                os.makedirs(os.path.dirname(prefix), exist_ok=True)
+                for suffix, values in [('.tokens.npy', tokens), ('.scores.npy', scores)]:
+                    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(prefix)), delete=False) as f:
+                        np.save(f, values)
+                    os.replace(f.name, prefix + suffix)
+            except OSError as e:
+                print(f'Could not cache encoded sequences of {self.file_path} in {os.path.dirname(prefix)}: {e}', file=sys.stderr)
+                return tokens, scores
+        return np.load(prefix + '.tokens.npy', mmap_mode='r'), np.load(prefix + '.scores.npy', mmap_mode='r')
+
+    @property
+    def n_examples(self):
+        return self.tokens.shape[0] if self.cache_tokens else len(self.data)
+
     def __len__(self):
         if self.use_revcomp:
-            return 2*len(self.data)
+            return 2*self.n_examples
+        else:
+            return self.n_examples
+
+    def get_batch(self, idxs):
+        """
+        Retrieves a batch of token sequences and scores by array indexing.
+
+        Args:
+            idxs (list or numpy.ndarray): Indices of the examples.
+
+        Returns:
+            tuple: uint8 tokens, float32 scores, and reverse complement flags.
+        """
+        idxs = np.asarray(idxs, dtype=np.int64)
+        if ((idxs >= len(self)) | (idxs < -len(self))).any():
+            raise IndexError(f"indices out of bounds for dataset with size {len(self)}")
+        idxs = idxs % len(self)
+        if self.use_revcomp:
+            take_rc, idxs = idxs % 2 == 1, idxs // 2
         else:
-            return len(self.data)
+            take_rc = np.zeros_like(idxs, dtype=bool)
+        return torch.from_numpy(self.tokens[idxs]), torch.from_numpy(self.scores[idxs]), torch.from_numpy(take_rc)
 
     def __getitem__(self, index):
+        if self.cache_tokens:
+            if not isinstance(index, (int, np.integer)):
+                return self.get_batch(index)
+            sequence_tensor, score_tensor = expand_token_batch(self.get_batch([index]), allow_unknown=True)
+            return sequence_tensor[0], score_tensor[0]
+        
         if self.use_revcomp:
             use_index = index // 2
         else:
@@ -56,20 +237,10 @@ class InputSequences(Dataset):
         return sequence_tensor, score_tensor
 
     def encode_sequence(self, sequence):
-        # Initialize an array of zeros with shape (4, sequence_length),
-        # where sequence_length is the length of the DNA sequence (in this case, len(sequence))
-        one_hot = np.zeros((4, len(sequence)))
-
-        # Convert each nucleotide in the sequence to its one-hot representation
-        for i, nucleotide in enumerate(sequence):
-            if nucleotide in self.nucleotide_to_index:
-                index = self.nucleotide_to_index[nucleotide]
-                one_hot[index, i] = 1
-
-        # Convert the numpy array to a torch tensor
-        sequence_tensor = torch.tensor(one_hot, dtype=torch.float32)
-
-        return sequence_tensor
+        # One-hot encode with the shared lookup table; characters other than A, C, G, T
+        # become all-zero columns
+        tokens = utils.dna2tokens([sequence], constants.STANDARD_NT)
+        return utils.tokens2tensor(tokens, num_classes=4, allow_unknown=True)[0]
 
 ### DATAMODULE
 import argparse
@@ -93,6 +264,14 @@ class SeqDataModule(LightningDataModule):
         group.add_argument('--seq_len', type=int, default=600)
         group.add_argument('--use_revcomp', type=utils.str2bool, default=False)
         group.add_argument('--skip_header', type=utils.str2bool, default=False)
+        group.add_argument('--cache_tokens', type=utils.str2bool, default=False,
+                           help='Encode each file once into token and score arrays cached in --cache_dir (or next to the file), and gather batches by array indexing.')
+        group.add_argument('--cache_dir', type=str,
+                           help='Directory for the arrays cached with --cache_tokens, e.g. when the data mount is read-only.')
+        group.add_argument('--parse_workers', type=int, default=1,
+                           help='Number of processes used to encode files with --cache_tokens.')
+        group.add_argument('--num_workers', type=int, default=0,
+                           help='Number of DataLoader workers.')
         return parser
     
     @staticmethod
@@ -104,7 +283,8 @@ class SeqDataModule(LightningDataModule):
         data_args    = grouped_args['Data Module args']
         return data_args
 
-    def __init__(self, train_file, val_file, test_file, batch_size=10, left_flank='', right_flank='', seq_len=600, use_revcomp=False, skip_header=False):
+    def __init__(self, train_file, val_file, test_file, batch_size=10, left_flank='', right_flank='', seq_len=600, use_revcomp=False, skip_header=False,
+                 cache_tokens=False, parse_workers=1, cache_dir=None, num_workers=0):
         super().__init__()
         self.train_file = train_file
         self.val_file = val_file
@@ -115,18 +295,32 @@ class SeqDataModule(LightningDataModule):
         self.seq_len = seq_len
         self.use_revcomp = use_revcomp
         self.skip_header = skip_header
+        self.cache_tokens = cache_tokens
+        self.parse_workers = parse_workers
+        self.cache_dir = cache_dir
+        self.num_workers = num_workers
         
     def setup(self, stage=None):
         # Load the datasets from the files
-        self.train_dataset = InputSequences(self.train_file, self.left_flank, self.right_flank, self.seq_len, self.use_revcomp, self.skip_header)
-        self.val_dataset = InputSequences(self.val_file, self.left_flank, self.right_flank, self.seq_len, self.use_revcomp, self.skip_header)
-        self.test_dataset = InputSequences(self.test_file, self.left_flank, self.right_flank, self.seq_len, self.use_revcomp, self.skip_header)
+        self.train_dataset = InputSequences(self.train_file, self.left_flank, self.right_flank, self.seq_len, self.use_revcomp, self.skip_header, self.cache_tokens, self.parse_workers, self.cache_dir)
+        self.val_dataset = InputSequences(self.val_file, self.left_flank, self.right_flank, self.seq_len, self.use_revcomp, self.skip_header, self.cache_tokens, self.parse_workers, self.cache_dir)
+        self.test_dataset = InputSequences(self.test_file, self.left_flank, self.right_flank, self.seq_len, self.use_revcomp, self.skip_header, self.cache_tokens, self.parse_workers, self.cache_dir)
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        # Cached token batches are expanded to one-hot on the device
+        return expand_token_batch(batch, allow_unknown=True)
+
+    def make_dataloader(self, dataset, shuffle=False):
+        if self.cache_tokens:
+            return DataLoader(IndexDataset(len(dataset)), batch_size=self.batch_size, shuffle=shuffle,
+                              num_workers=self.num_workers, collate_fn=BatchGather(dataset))
+        return DataLoader(dataset, batch_size=self.batch_size, shuffle=shuffle, num_workers=self.num_workers)
 
     def train_dataloader(self):
-        return DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=True)
+        return self.make_dataloader(self.train_dataset, shuffle=True)
 
     def val_dataloader(self):
-        return DataLoader(self.val_dataset, batch_size=self.batch_size)
+        return self.make_dataloader(self.val_dataset)
 
     def test_dataloader(self):
-        return DataLoader(self.test_dataset, batch_size=self.batch_size)
+        return self.make_dataloader(self.test_dataset)
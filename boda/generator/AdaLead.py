@@ -80,7 +80,7 @@ class AdaLead(nn.Module):
         return -1 * self.energy_fn(input_tensor).detach().cpu().numpy()
 
     def string_list_to_tensor(self, sequence_list):
-        return torch.stack([utils.dna2tensor(sequence) for sequence in sequence_list]).to(self.dflt_device)
+        return utils.list2batch(sequence_list).to(self.dflt_device)
 
     def random_string_list(self):
         return [''.join(random.choices(self.vocab, k=self.seq_len)) for _ in range(self.batch_size)]
@@ -225,7 +225,7 @@ class AdaLead(nn.Module):
             attempts += n_top_seqs_per_batch
         print()
         
-        proposals = torch.stack([utils.dna2tensor(proposal) for proposal in proposals[:n_proposals]])
+        proposals = utils.list2batch(proposals[:n_proposals])
         energies = torch.Tensor(energies[:n_proposals])
         acceptance = np.mean(acceptance)
 
@@ -386,7 +386,7 @@ class deprecated_AdaLead(nn.Module):
         Returns:
             Tensor: Tensor containing the one-hot-encoded sequences.
         """
-        return torch.stack([utils.dna2tensor(sequence) for sequence in sequence_list])
+        return utils.list2batch(sequence_list)
              
     def pad(self, tensor):
         """
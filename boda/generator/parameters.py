@@ -170,9 +170,8 @@ class PassThroughParameters(ParamsBase):
                     params_args.init_seqs = os.path.join([tmpdirname, filename])
                     
                 with open(params_args.init_seqs, 'r') as f:
-                    params_args.data = torch.stack(
-                        [ utils.dna2tensor(line) for line in f.readlines() ], 
-                        dim=0
+                    params_args.data = utils.list2batch(
+                        [ line.strip() for line in f.readlines() if line.strip() ]
                     )
         
         else:
@@ -351,9 +350,8 @@ class BasicParameters(ParamsBase):
                     params_args.init_seqs = os.path.join([tmpdirname, filename])
                     
                 with open(params_args.init_seqs, 'r') as f:
-                    params_args.data = torch.stack(
-                        [ utils.dna2tensor(line) for line in f.readlines() ], 
-                        dim=0
+                    params_args.data = utils.list2batch(
+                        [ line.strip() for line in f.readlines() if line.strip() ]
                     )
         
         else:
@@ -545,9 +543,8 @@ class StraightThroughParameters(ParamsBase):
                     params_args.init_seqs = os.path.join([tmpdirname, filename])
                     
                 with open(params_args.init_seqs, 'r') as f:
-                    params_args.data = torch.stack(
-                        [ utils.dna2tensor(line) for line in f.readlines() ], 
-                        dim=0
+                    params_args.data = utils.list2batch(
+                        [ line.strip() for line in f.readlines() if line.strip() ]
                     )
         
         else:
@@ -814,9 +811,8 @@ class GumbelSoftmaxParameters(ParamsBase):
                     params_args.init_seqs = os.path.join([tmpdirname, filename])
                     
                 with open(params_args.init_seqs, 'r') as f:
-                    params_args.data = torch.stack(
-                        [ utils.dna2tensor(line) for line in f.readlines() ], 
-                        dim=0
+                    params_args.data = utils.list2batch(
+                        [ line.strip() for line in f.readlines() if line.strip() ]
                     )
         
         else:
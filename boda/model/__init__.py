@@ -1,5 +1,14 @@
 from .basset import Basset, BassetVL, BassetEntropyVL, BassetBranched
+from .mutation_engine import PointMutationEngine
+from .ensemble import FusedBassetEnsemble, fuse_ensemble
+from .inference import freeze_for_inference, try_freeze_for_inference
+from .quantize import QuantizedModel, quantize_model, quantized_checkpoint, restore_quantized, is_quantized
+from .dense import DenseBassetBranched, dense_scanner, dense_scan_error
 
 __all__ = [
     'Basset', 'BassetVL', 'BassetEntropyVL', 'BassetBranched',
+    'PointMutationEngine', 'FusedBassetEnsemble', 'fuse_ensemble',
+    'freeze_for_inference', 'try_freeze_for_inference',
+    'QuantizedModel', 'quantize_model', 'quantized_checkpoint', 'restore_quantized', 'is_quantized',
+    'DenseBassetBranched', 'dense_scanner', 'dense_scan_error',
 ]
@@ -9,7 +9,7 @@ import torch.nn as nn
 import lightning.pytorch as ptl
 
 from ..common import utils
-from .custom_layers import Conv1dNorm, LinearNorm, GroupedLinear, RepeatLayer, BranchedLinear
+from .custom_layers import Conv1dNorm, LinearNorm, GroupedLinear, RepeatLayer, BranchedLinear, input_conv1d
 from .loss_functions import add_criterion_specific_args
 
 from ..model import loss_functions
@@ -247,12 +247,12 @@ class Basset(ptl.LightningModule):
         Encode input through the Basset model's encoding layers.
 
         Args:
-            x (torch.Tensor): Input tensor.
+            x (torch.Tensor): One-hot input of shape (batch, 4, length), or integer tokens of shape (batch, length).
 
         Returns:
             torch.Tensor: Encoded tensor.
         """
-        hook = self.nonlin( self.conv1( self.pad1( x ) ) )
+        hook = self.nonlin( input_conv1d( self.pad1, self.conv1, x ) )
         hook = self.maxpool_3( hook )
         hook = self.nonlin( self.conv2( self.pad2( hook ) ) )
         hook = self.maxpool_4( hook )
@@ -540,12 +540,12 @@ class BassetVL(ptl.LightningModule):
         Encode input through the BassetVL model's encoding layers.
 
         Args:
-            x (torch.Tensor): Input tensor.
+            x (torch.Tensor): One-hot input of shape (batch, 4, length), or integer tokens of shape (batch, length).
 
         Returns:
             torch.Tensor: Encoded tensor.
         """
-        hook = self.nonlin( self.conv1( self.pad1( x ) ) )
+        hook = self.nonlin( input_conv1d( self.pad1, self.conv1, x ) )
         hook = self.maxpool_3( hook )
         hook = self.nonlin( self.conv2( self.pad2( hook ) ) )
         hook = self.maxpool_4( hook )
@@ -835,12 +835,12 @@ class BassetEntropyVL(ptl.LightningModule):
         Encode input data through the convolutional layers.
 
         Args:
-            x (Tensor): The input tensor.
+            x (Tensor): One-hot input of shape (batch, 4, length), or integer tokens of shape (batch, length).
 
         Returns:
             Tensor: Encoded tensor.
         """
-        hook = self.nonlin( self.conv1( self.pad1( x ) ) )
+        hook = self.nonlin( input_conv1d( self.pad1, self.conv1, x ) )
         hook = self.maxpool_3( hook )
         hook = self.nonlin( self.conv2( self.pad2( hook ) ) )
         hook = self.maxpool_4( hook )
@@ -1166,12 +1166,12 @@ class BassetBranched(ptl.LightningModule):
         Encode input data through the model's encoder layers.
 
         Args:
-            x (torch.Tensor): Input data tensor.
+            x (torch.Tensor): One-hot input of shape (batch, 4, length), or integer tokens of shape (batch, length).
 
         Returns:
             torch.Tensor: Encoded representation of the input data.
         """
-        hook = self.nonlin( self.conv1( self.pad1( x ) ) )
+        hook = self.nonlin( input_conv1d( self.pad1, self.conv1, x ) )
         hook = self.maxpool_3( hook )
         hook = self.nonlin( self.conv2( self.pad2( hook ) ) )
         hook = self.maxpool_4( hook )
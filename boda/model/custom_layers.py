@@ -4,6 +4,7 @@ from collections import OrderedDict
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 class Conv1dNorm(nn.Module):
     """
@@ -192,6 +193,107 @@ class GroupedLinear(nn.Module):
         
         return reorg
 
+def folded_parameters(layer):
+    """
+    Get the effective weight and bias of a Conv1dNorm or LinearNorm layer in eval mode,
+    with weight normalization and batch normalization folded in.
+
+    Args:
+        layer (Conv1dNorm or LinearNorm): The layer. Batch norm uses its running statistics.
+
+    Returns:
+        tuple: (weight, bias) tensors shaped like those of the wrapped nn.Conv1d or nn.Linear.
+    """
+    inner = layer.conv if hasattr(layer, 'conv') else layer.linear
+    if hasattr(inner, 'weight_g'):
+        weight = torch._weight_norm(inner.weight_v, inner.weight_g, 0)
+    else:
+        weight = inner.weight
+    bias = inner.bias if inner.bias is not None else torch.zeros(weight.shape[0], device=weight.device)
+    weight, bias = weight.detach(), bias.detach()
+    
+    bn = getattr(layer, 'bn_layer', None)
+    if bn is not None:
+        scale  = bn.weight.detach() / torch.sqrt(bn.running_var + bn.eps)
+        weight = weight * scale.view(-1, *[1]*(weight.dim()-1))
+        bias   = (bias - bn.running_mean) * scale + bn.bias.detach()
+    
+    return weight, bias
+
+def embedding_conv1d(tokens, weight, bias=None, padding=(0, 0)):
+    """
+    Convolve the one-hot encoding of token indices, as a gather-and-sum.
+
+    Convolving a one-hot sequence picks one kernel column per position, so each output
+    is the sum of the kernel columns selected by the tokens in its window
+    (F.embedding_bag over a table of kernel columns). This matches F.conv1d on the
+    one-hot sequence without building it.
+
+    Args:
+        tokens (torch.Tensor): Integer tensor of shape (batch, length). Tokens >= in_channels
+            (unknown bases such as N) contribute nothing, like all-zero one-hot columns.
+        weight (torch.Tensor): Kernel of shape (out_channels, in_channels, kernel_size).
+        bias (torch.Tensor, optional): Bias of shape (out_channels,). Default is None.
+        padding (tuple, optional): Zero padding on the left and right. Default is (0, 0).
+
+    Returns:
+        torch.Tensor: Output of shape (batch, out_channels, out_length).
+    """
+    out_channels, in_channels, kernel_size = weight.shape
+    # Row k * (in_channels + 1) + t holds kernel column k for token t; the last token is zero
+    table = F.pad(weight, (0, 0, 0, 1)).permute(2, 1, 0).reshape(-1, out_channels)
+    hook = F.pad(tokens.long().clamp(max=in_channels), tuple(padding), value=in_channels)
+    hook = hook.unfold(1, kernel_size, 1)
+    hook = hook + torch.arange(0, kernel_size * (in_channels + 1), in_channels + 1, device=hook.device)
+    batch_size, out_length = hook.shape[:2]
+    hook = F.embedding_bag(hook.reshape(-1, kernel_size), table, mode='sum')
+    if bias is not None:
+        hook = hook + bias
+    return hook.view(batch_size, out_length, out_channels).transpose(1, 2)
+
+def token_conv1d(conv, tokens, padding=(0, 0)):
+    """
+    Apply a Conv1dNorm or nn.Conv1d over one-hot channels to token indices with
+    embedding_conv1d.
+
+    Args:
+        conv (Conv1dNorm or nn.Conv1d): Convolution with one input channel per token, stride 1,
+            and no dilation or groups. Its own padding is added to padding.
+        tokens (torch.Tensor): Integer tensor of shape (batch, length).
+        padding (tuple, optional): Zero padding on the left and right. Default is (0, 0).
+
+    Returns:
+        torch.Tensor: Output of shape (batch, out_channels, out_length).
+    """
+    inner = conv.conv if isinstance(conv, Conv1dNorm) else conv
+    assert inner.stride == (1,) and inner.dilation == (1,) and inner.groups == 1, \
+           "token_conv1d supports plain convolutions only."
+    if hasattr(inner, 'weight_g'):
+        weight = torch._weight_norm(inner.weight_v, inner.weight_g, 0)
+    else:
+        weight = inner.weight
+    padding = (padding[0] + inner.padding[0], padding[1] + inner.padding[0])
+    hook = embedding_conv1d(tokens, weight, inner.bias, padding)
+    bn = getattr(conv, 'bn_layer', None)
+    return bn(hook) if bn is not None else hook
+
+def input_conv1d(pad, conv, x):
+    """
+    Apply a model's padding and first convolution to one-hot sequences or token indices.
+
+    Args:
+        pad (nn.ConstantPad1d or nn.Identity): Zero padding before the convolution.
+        conv (Conv1dNorm or nn.Conv1d): The first convolution.
+        x (torch.Tensor): One-hot sequences of shape (batch, 4, length), or integer token
+            indices of shape (batch, length) as made by utils.dna2tokens.
+
+    Returns:
+        torch.Tensor: Output of the convolution.
+    """
+    if x.is_floating_point():
+        return conv( pad( x ) )
+    return token_conv1d(conv, x, padding=getattr(pad, 'padding', (0, 0)))
+
 class RepeatLayer(nn.Module):
     """
     A custom module to repeat the input tensor along specified dimensions.
@@ -0,0 +1,340 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .basset import BassetBranched
+from .inference import freeze_for_inference
+from .custom_layers import input_conv1d
+from .mutation_engine import PointMutationEngine
+
+def phase_pool(pool, x):
+    """
+    Max pool a sequence at every offset of the pooling grid.
+
+    Args:
+        pool (nn.MaxPool1d): Pooling layer with stride equal to its kernel size.
+        x (torch.Tensor): Input of shape (batch, channels, length).
+
+    Returns:
+        torch.Tensor: Pooled outputs of shape (kernel_size * batch, channels, pooled_length).
+        Entry p * batch + b is sequence b pooled from offset p.
+    """
+    size = pool.kernel_size
+    length = (x.shape[-1] - (size - 1)) // size
+    return torch.cat([ pool(x[..., p:p+size*length]) for p in range(size) ], dim=0)
+
+class DenseBassetBranched(nn.Module):
+    """
+    Fully-convolutional version of a BassetBranched model that predicts every window
+    of a long sequence in one pass.
+
+    The convolutions run once over the whole sequence. Each pooling layer is applied at
+    every offset of its grid (3 * 4 * 4 = 48 phases in total), so each window start maps
+    to one phase and one position of the pooled feature map. The first linear layer, which
+    reads the flattened conv3 features of a window, becomes a convolution over the pooled
+    feature map, and the remaining layers run on the resulting per-window features.
+
+    Single window inputs are zero padded at their own edges, so the conv3 features nearest
+    a window's edges (2 of 13 pooled positions on each side for 600 bp windows) differ from
+    the shared dense features. With exact_edges, those features are recomputed for every
+    window from the few activations the padding reaches, and the first linear layer is
+    corrected by the difference, so predictions match the windowed model up to floating
+    point error. Without it, the shared features are used as is: faster, but predictions
+    are only close to those of the windowed model. Use dense_scan_error to measure the
+    difference for a model.
+
+    Args:
+        model (BassetBranched): The model, in eval mode.
+        exact_edges (bool, optional): Recompute the edge features of every window. Default is True.
+        edge_batch_size (int, optional): Number of windows whose edges are recomputed at a time. Default is 4096.
+
+    Attributes:
+        input_len (int): Window length.
+        window_stride (int): Number of window starts per phase period (48).
+        edge_sizes (tuple): Number of pooled conv3 positions recomputed at the left and right edge of each window.
+    """
+
+    def __init__(self, model, exact_edges=True, edge_batch_size=2**12):
+        super().__init__()
+        if not isinstance(model, BassetBranched):
+            raise TypeError(f"Dense scanning needs a BassetBranched model, got {type(model).__name__}.")
+        self.model = freeze_for_inference(model)
+        self.input_len = model.input_len
+        self.window_stride = self.model.maxpool_3.kernel_size * self.model.maxpool_4.kernel_size ** 2
+        self.exact_edges = exact_edges
+        self.edge_batch_size = edge_batch_size
+        self.is_frozen = True
+
+        linear = self.model.linear1
+        n_positions = self.model.get_flatten_factor(self.input_len)
+        self.linear1 = nn.Conv1d(self.model.conv3_channels, linear.out_features, n_positions)
+        self.linear1.weight.data = linear.weight.detach().view(linear.out_features, self.model.conv3_channels, n_positions).clone()
+        self.linear1.bias.data   = linear.bias.detach().clone()
+        self.linear1.requires_grad_(False).to(linear.weight.device)
+
+        # (kind, (left, right) padding, layer on padded input, kernel size) in the order of encode
+        self.stages = [
+            PointMutationEngine.conv_stage(self.model.pad1, self.model.conv1),
+            ('pool', (0, 0), self.model.maxpool_3, self.model.maxpool_3.kernel_size),
+            PointMutationEngine.conv_stage(self.model.pad2, self.model.conv2),
+            ('pool', (0, 0), self.model.maxpool_4, self.model.maxpool_4.kernel_size),
+            PointMutationEngine.conv_stage(self.model.pad3, self.model.conv3),
+            ('pad',  (1, 1), None, None),
+            ('pool', (0, 0), self.model.maxpool_4, self.model.maxpool_4.kernel_size),
+        ]
+        self.edge_sizes = self.count_edges()
+        assert not exact_edges or sum(self.edge_sizes) <= n_positions, \
+            f"Window edges overlap for input_len {self.input_len}, use exact_edges=False or the windowed model."
+
+    def count_edges(self):
+        """
+        Count the pooled conv3 positions of a window that its own zero padding reaches.
+
+        Returns:
+            tuple: Number of positions at the left and right edge.
+        """
+        left, right, length = 0, 0, self.input_len
+        for kind, (pad_left, pad_right), _, kernel_size in self.stages:
+            if kind == 'conv':
+                left, right = left + pad_left, right + pad_right
+            elif kind == 'pool':
+                n_out = length // kernel_size
+                left  = -(-left // kernel_size)
+                right = n_out - (length - right) // kernel_size
+                length = n_out
+            else:
+                left, right = left + pad_left, right + pad_right
+                length += pad_left + pad_right
+        return left, right
+
+    def encode(self, x, stage_inputs=None):
+        """
+        Run the convolutions over whole sequences at every pooling phase.
+
+        Args:
+            x (torch.Tensor): One-hot sequences of shape (batch, 4, length), or integer
+                tokens of shape (batch, length).
+            stage_inputs (list, optional): If given, the input of each of self.stages is
+                appended to it, for recomputing window edges.
+
+        Returns:
+            torch.Tensor: Pooled conv3 features of shape (48 * batch, conv3_channels, positions).
+            Entry r * batch + b holds the windows of sequence b starting at r, r + 48, ...
+        """
+        model = self.model
+        keep = stage_inputs.append if stage_inputs is not None else (lambda hook: None)
+        keep(x)
+        hook = model.nonlin( input_conv1d( model.pad1, model.conv1, x ) )
+        keep(hook)
+        hook = phase_pool( model.maxpool_3, hook )
+        keep(hook)
+        hook = model.nonlin( model.conv2( model.pad2( hook ) ) )
+        keep(hook)
+        hook = phase_pool( model.maxpool_4, hook )
+        keep(hook)
+        hook = model.nonlin( model.conv3( model.pad3( hook ) ) )
+        keep(hook)
+        hook = F.pad( hook, (1, 1) )
+        keep(hook)
+        hook = phase_pool( model.maxpool_4, hook )
+        return hook
+
+    def gather(self, dense, rows, starts, width):
+        """
+        Gather spans of a dense stage input at window local positions.
+
+        Args:
+            dense (torch.Tensor): Stage input of shape (rows, channels, length), or integer tokens of shape (rows, length).
+            rows (torch.Tensor): Row of each window.
+            starts (torch.Tensor): Start of each span in the row.
+            width (int): Span width.
+
+        Returns:
+            torch.Tensor: Spans of shape (n_windows, channels, width). Tokens are one-hot encoded.
+        """
+        if dense.dim() == 3:
+            return PointMutationEngine.gather_spans(dense, rows, starts, width)
+        n_tokens  = self.model.conv1.in_channels
+        positions = starts[:, None] + torch.arange(width, device=starts.device)
+        tokens = dense[rows[:, None], positions].long()
+        return F.one_hot(tokens, n_tokens + 1)[..., :n_tokens].transpose(1, 2).to(self.linear1.weight.dtype)
+
+    def window_edges(self, stage_inputs, rows, offsets):
+        """
+        Recompute the pooled conv3 features at the edges of windows as single window inputs see them.
+
+        At each stage, only the positions that a window's zero padding reaches are recomputed.
+        The rest of each receptive field is read from the dense stage inputs.
+
+        Args:
+            stage_inputs (list): Inputs of self.stages, from encode.
+            rows (torch.Tensor): Sequence of each window.
+            offsets (torch.Tensor): Start of each window in its sequence.
+
+        Returns:
+            tuple: Left and right edge features of shape (n_windows, conv3_channels, edge size).
+        """
+        n_windows, device = rows.shape[0], rows.device
+        dtype = self.linear1.weight.dtype
+        channels = self.model.conv1.in_channels
+        left  = torch.zeros(n_windows, channels, 0, device=device, dtype=dtype)
+        right = torch.zeros(n_windows, channels, 0, device=device, dtype=dtype)
+        length = self.input_len
+        for (kind, (pad_left, pad_right), layer, kernel_size), dense in zip(self.stages, stage_inputs):
+            n_left, n_right = left.shape[2], right.shape[2]
+            if kind == 'conv':
+                zeros = lambda size: torch.zeros(n_windows, left.shape[1], size, device=device, dtype=dtype)
+                out_left, out_right = n_left + pad_left, n_right + pad_right
+                left  = torch.cat([zeros(pad_left), left, 
+                                   self.gather(dense, rows, offsets + n_left, out_left + pad_right - n_left)], dim=2)
+                right = torch.cat([self.gather(dense, rows, offsets + length - out_right - pad_left, out_right + pad_left - n_right), 
+                                   right, zeros(pad_right)], dim=2)
+                left, right = self.model.nonlin( layer(left) ), self.model.nonlin( layer(right) )
+            elif kind == 'pool':
+                n_out = length // kernel_size
+                out_left  = -(-n_left // kernel_size)
+                first     = (length - n_right) // kernel_size
+                left  = torch.cat([left, self.gather(dense, rows, offsets + n_left, out_left * kernel_size - n_left)], dim=2)
+                right = torch.cat([self.gather(dense, rows, offsets + first * kernel_size, length - n_right - first * kernel_size), 
+                                   right], dim=2)[..., :(n_out - first) * kernel_size]
+                left, right = layer(left), layer(right)
+                rows    = (offsets % kernel_size) * dense.shape[0] + rows
+                offsets = offsets // kernel_size
+                length  = n_out
+            else:
+                left  = F.pad(left, (pad_left, 0))
+                right = F.pad(right, (0, pad_right))
+                length += pad_left + pad_right
+        return left, right
+
+    def edge_correction(self, encoded, stage_inputs, n_periods, batch_size):
+        """
+        Correct the first linear layer of every window for its recomputed edge features.
+
+        Args:
+            encoded (torch.Tensor): Output of encode.
+            stage_inputs (list): Inputs of self.stages, from encode.
+            n_periods (int): Number of windows used per phase.
+            batch_size (int): Number of sequences.
+
+        Returns:
+            torch.Tensor: Correction of shape (48 * batch, linear1 features, n_periods).
+        """
+        n_left, n_right = self.edge_sizes
+        n_positions = self.linear1.kernel_size[0]
+        weight = self.linear1.weight
+        device = encoded.device
+        phase_rows = torch.arange(encoded.shape[0], device=device).repeat_interleave(n_periods)
+        periods    = torch.arange(n_periods, device=device).repeat(encoded.shape[0])
+        correction = torch.empty(encoded.shape[0] * n_periods, weight.shape[0], device=device, dtype=weight.dtype)
+        for i in range(0, phase_rows.numel(), self.edge_batch_size):
+            rows, ks = phase_rows[i:i+self.edge_batch_size], periods[i:i+self.edge_batch_size]
+            starts = (rows // batch_size) + self.window_stride * ks
+            left, right = self.window_edges(stage_inputs, rows % batch_size, starts)
+            delta_left  = left  - PointMutationEngine.gather_spans(encoded, rows, ks, n_left)
+            delta_right = right - PointMutationEngine.gather_spans(encoded, rows, ks + n_positions - n_right, n_right)
+            correction[i:i+self.edge_batch_size] = \
+                torch.einsum('wcj,hcj->wh', delta_left, weight[..., :n_left]) + \
+                torch.einsum('wcj,hcj->wh', delta_right, weight[..., n_positions-n_right:])
+        return correction.view(encoded.shape[0], n_periods, -1).transpose(1, 2)
+
+    def decode(self, x, correction=None):
+        """
+        Apply the linear and branched layers to every window.
+
+        Args:
+            x (torch.Tensor): Output of encode.
+            correction (torch.Tensor, optional): Added to the first linear layer of the
+                first correction.shape[2] windows of each phase, see edge_correction.
+
+        Returns:
+            torch.Tensor: Branched features of shape (48 * batch, positions, features).
+        """
+        model = self.model
+        hook = self.linear1( x )
+        if correction is not None:
+            hook = hook[..., :correction.shape[2]] + correction
+        hook = model.nonlin( hook ).transpose(1, 2)
+        n_phases, n_positions = hook.shape[:2]
+        hook = hook.reshape(n_phases * n_positions, -1)
+        for i in range(1, model.n_linear_layers):
+            hook = model.nonlin( getattr(model, f'linear{i+1}')(hook) )
+        hook = model.branched(hook)
+        return hook.view(n_phases, n_positions, -1)
+
+    def forward(self, x):
+        """
+        Predict every window of a batch of sequences.
+
+        Args:
+            x (torch.Tensor): One-hot sequences of shape (batch, 4, length), or integer
+                tokens of shape (batch, length), with length >= input_len.
+
+        Returns:
+            torch.Tensor: Predictions of shape (batch, length - input_len + 1, n_outputs).
+            Entry [b, s] is the prediction for the window x[b, ..., s:s+input_len].
+        """
+        batch_size, length = x.shape[0], x.shape[-1]
+        assert length >= self.input_len, f"Sequences must be at least {self.input_len} long."
+        n_windows = length - self.input_len + 1
+        n_periods = -(-n_windows // self.window_stride)
+        # Extra sequence on the right so every phase has n_periods windows; dropped below
+        fill = 0. if x.is_floating_point() else self.model.conv1.in_channels
+        x = F.pad( x, (0, self.window_stride * (n_periods + 1) + self.input_len - length), value=fill )
+
+        if self.exact_edges:
+            stage_inputs = []
+            encoded = self.encode(x, stage_inputs)
+            correction = self.edge_correction(encoded, stage_inputs, n_periods, batch_size)
+            del stage_inputs
+            hook = self.decode(encoded, correction)
+        else:
+            hook = self.decode( self.encode(x) )
+        n_phases, n_positions, n_features = hook.shape
+        hook = self.model.classify( hook[:, :n_periods].reshape(n_phases * n_periods, n_features) )
+        hook = hook.view(self.window_stride, batch_size, n_periods, -1).permute(1, 2, 0, 3)
+        return hook.reshape(batch_size, n_periods * self.window_stride, -1)[:, :n_windows]
+
+def dense_scanner(model, exact_edges=True):
+    """
+    Convert a trained BassetBranched model for dense scanning of long sequences.
+
+    Args:
+        model (BassetBranched): The model. Batch norm uses its running statistics.
+        exact_edges (bool, optional): Match the windowed model exactly. False skips the edge
+            recomputation and trades accuracy for speed. Default is True.
+
+    Returns:
+        DenseBassetBranched: The dense model, in eval mode on the model's device.
+    """
+    was_training = model.training
+    dense = DenseBassetBranched(model.eval(), exact_edges=exact_edges).eval()
+    model.train(was_training)
+    return dense
+
+def dense_scan_error(model, dense, length=2400, n_samples=2, seed=0):
+    """
+    Compare dense scanning with window by window predictions on random sequences.
+
+    Args:
+        model (nn.Module): The windowed model.
+        dense (DenseBassetBranched): The dense model.
+        length (int, optional): Length of the random sequences. Default is 2400.
+        n_samples (int, optional): Number of sequences. Default is 2.
+        seed (int, optional): Random seed. Default is 0.
+
+    Returns:
+        dict: Maximum and mean absolute difference of the predictions, and the Pearson
+        correlation of the two sets of predictions.
+    """
+    device = next(dense.parameters()).device
+    generator = torch.Generator().manual_seed(seed)
+    tokens = torch.randint(0, 4, (n_samples, length), generator=generator)
+    x = F.one_hot(tokens, 4).transpose(1, 2).float().to(device)
+    with torch.no_grad():
+        observed = dense(x).flatten(0, 1)
+        windows  = x.unfold(2, dense.input_len, 1).permute(0, 2, 1, 3).flatten(0, 1)
+        expected = torch.cat([ model(batch) for batch in windows.split(256) ], dim=0)
+    diff = (observed - expected).abs()
+    pearson = torch.corrcoef( torch.stack([observed.flatten(), expected.flatten()]) )[0, 1]
+    return {'max_abs_diff': diff.max().item(), 'mean_abs_diff': diff.mean().item(), 'pearson': pearson.item()}
@@ -0,0 +1,181 @@
+import copy
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .custom_layers import folded_parameters, embedding_conv1d
+
+class FusedBassetEnsemble(nn.Module):
+    """
+    K same-architecture BassetBranched models fused into one network for inference.
+
+    The first convolution concatenates the members' kernels, because all members see the
+    same input. Later convolutions are grouped convolutions with groups=K. Linear and
+    branched layers become batched matmuls over K (or K * n_outputs for the branched
+    head). Weight norm and batch norm are folded into the weights, so the ensemble runs
+    with one kernel launch per layer on GPU. On CPU, where grouped convolutions are slow,
+    the grouped layers run member by member. Dropout is dropped, and the fused network is
+    for inference only.
+
+    Args:
+        models (list): BassetBranched models with identical hyperparameters. Batch norm uses
+            their running statistics.
+        reduction (str, optional): 'mean' to average members, or 'none' to return
+            per-member outputs of shape (K, batch, n_outputs). Default is 'mean'.
+
+    Methods:
+        encode(x): Convolutional features of shape (K, batch, features).
+        decode(x): Branched features of shape (K * n_outputs, batch, branched_channels).
+        classify(x): Outputs of shape (K, batch, n_outputs).
+        forward(x): Ensemble predictions.
+    """
+
+    def __init__(self, models, reduction='mean'):
+        super().__init__()
+        assert reduction in ('mean', 'none'), "reduction must be 'mean' or 'none'."
+        assert len(models) >= 1, "Need at least one model."
+        first = models[0]
+        for model in models[1:]:
+            assert type(model) == type(first), "Ensemble members must share an architecture."
+            assert all( a.shape == b.shape for a, b in zip(model.state_dict().values(), first.state_dict().values()) ), \
+                   "Ensemble members must share an architecture."
+
+        self.reduction = reduction
+        self.n_models  = len(models)
+        self.n_outputs = first.n_outputs
+        self.n_linear_layers   = first.n_linear_layers
+        self.n_branched_layers = first.branched.n_layers
+
+        self.pad1, self.pad2, self.pad3, self.pad4 = [ copy.deepcopy(getattr(first, f'pad{i}')) for i in range(1, 5) ]
+        self.maxpool_3 = copy.deepcopy(first.maxpool_3)
+        self.maxpool_4 = copy.deepcopy(first.maxpool_4)
+        self.nonlin    = copy.deepcopy(first.nonlin)
+        self.branched_nonlin = copy.deepcopy(first.branched.nonlin)
+
+        # Convolutions: stack members along output channels
+        for i in range(1, 4):
+            weights, biases = zip(*[ folded_parameters(getattr(model, f'conv{i}')) for model in models ])
+            self.register_buffer(f'conv{i}_weight', torch.cat(weights, dim=0).contiguous())
+            self.register_buffer(f'conv{i}_bias', torch.cat(biases, dim=0).contiguous())
+
+        # Linear layers: (K, in, out) for baddbmm
+        for i in range(1, self.n_linear_layers+1):
+            weights, biases = zip(*[ folded_parameters(getattr(model, f'linear{i}')) for model in models ])
+            self.register_buffer(f'linear{i}_weight', torch.stack(weights, dim=0).transpose(1, 2).contiguous())
+            self.register_buffer(f'linear{i}_bias', torch.stack(biases, dim=0).unsqueeze(1).contiguous())
+
+        # Branched head and output: one group per (member, branch)
+        for i in range(1, self.n_branched_layers+1):
+            layers = [ getattr(model.branched, f'branched_layer_{i}') for model in models ]
+            self.register_buffer(f'branched{i}_weight', torch.cat([ layer.weight.detach() for layer in layers ], dim=0).contiguous())
+            self.register_buffer(f'branched{i}_bias', torch.cat([ layer.bias.detach() for layer in layers ], dim=0).contiguous())
+        self.register_buffer('output_weight', torch.cat([ model.output.weight.detach() for model in models ], dim=0).contiguous())
+        self.register_buffer('output_bias', torch.cat([ model.output.bias.detach() for model in models ], dim=0).contiguous())
+
+    @property
+    def device(self):
+        return self.conv1_weight.device
+
+    def grouped_conv(self, x, weight, bias):
+        """
+        Apply one convolution per member to its slice of the channels.
+
+        Args:
+            x (torch.Tensor): Input of shape (batch, K * in_channels, length).
+            weight (torch.Tensor): Stacked kernels of shape (K * out_channels, in_channels, kernel_size).
+            bias (torch.Tensor): Stacked biases.
+
+        Returns:
+            torch.Tensor: Output of shape (batch, K * out_channels, length - kernel_size + 1).
+        """
+        if x.is_cuda:
+            return F.conv1d(x, weight, bias, groups=self.n_models)
+        # CPU grouped convolutions are slower than running the groups one by one
+        return torch.cat([ F.conv1d(x_k, w_k, b_k) for x_k, w_k, b_k in 
+                           zip(x.chunk(self.n_models, dim=1), weight.chunk(self.n_models, dim=0), bias.chunk(self.n_models, dim=0)) ], dim=1)
+
+    def encode(self, x):
+        """
+        Run the convolutional layers of every member.
+
+        Args:
+            x (torch.Tensor): One-hot input of shape (batch, 4, length), or integer tokens
+                of shape (batch, length).
+
+        Returns:
+            torch.Tensor: Features of shape (K, batch, features).
+        """
+        if x.is_floating_point():
+            hook = F.conv1d(self.pad1(x), self.conv1_weight, self.conv1_bias)
+        else:
+            hook = embedding_conv1d(x, self.conv1_weight, self.conv1_bias, self.pad1.padding)
+        hook = self.nonlin( hook )
+        hook = self.maxpool_3( hook )
+        hook = self.nonlin( self.grouped_conv(self.pad2(hook), self.conv2_weight, self.conv2_bias) )
+        hook = self.maxpool_4( hook )
+        hook = self.nonlin( self.grouped_conv(self.pad3(hook), self.conv3_weight, self.conv3_bias) )
+        hook = self.maxpool_4( self.pad4( hook ) )
+        # Channels are member-major, so each member's slice flattens like the original model
+        return hook.reshape(hook.shape[0], self.n_models, -1).transpose(0, 1)
+
+    def decode(self, x):
+        """
+        Run the linear and branched layers of every member.
+
+        Args:
+            x (torch.Tensor): Features of shape (K, batch, features).
+
+        Returns:
+            torch.Tensor: Branched features of shape (K * n_outputs, batch, branched_channels).
+        """
+        hook = x
+        for i in range(1, self.n_linear_layers+1):
+            hook = self.nonlin( torch.baddbmm(getattr(self, f'linear{i}_bias'), hook, getattr(self, f'linear{i}_weight')) )
+        hook = hook.unsqueeze(1).expand(-1, self.n_outputs, -1, -1).reshape(self.n_models*self.n_outputs, *hook.shape[1:])
+        for i in range(1, self.n_branched_layers+1):
+            hook = torch.baddbmm(getattr(self, f'branched{i}_bias'), hook, getattr(self, f'branched{i}_weight'))
+            if i < self.n_branched_layers:
+                hook = self.branched_nonlin( hook )
+        return hook
+
+    def classify(self, x):
+        """
+        Apply the output layer of every member.
+
+        Args:
+            x (torch.Tensor): Branched features of shape (K * n_outputs, batch, branched_channels).
+
+        Returns:
+            torch.Tensor: Outputs of shape (K, batch, n_outputs).
+        """
+        hook = torch.baddbmm(self.output_bias, x, self.output_weight)
+        return hook.view(self.n_models, self.n_outputs, -1).transpose(1, 2)
+
+    def forward(self, x):
+        """
+        Predict with every member in one pass.
+
+        Args:
+            x (torch.Tensor): One-hot input of shape (batch, 4, length).
+
+        Returns:
+            torch.Tensor: Mean outputs of shape (batch, n_outputs), or per-member outputs
+            of shape (K, batch, n_outputs) when reduction is 'none'.
+        """
+        preds = self.classify( self.decode( self.encode(x) ) )
+        return preds.mean(dim=0) if self.reduction == 'mean' else preds
+
+def fuse_ensemble(models, reduction='mean'):
+    """
+    Fuse same-architecture BassetBranched models into one FusedBassetEnsemble.
+
+    Args:
+        models (list): Models to fuse. Put them in eval mode first.
+        reduction (str, optional): 'mean' or 'none'. Default is 'mean'.
+
+    Returns:
+        FusedBassetEnsemble: The fused ensemble, in eval mode on the models' device.
+    """
+    assert all( not model.training for model in models ), "Fusing uses batch norm running statistics; call model.eval() first."
+    return FusedBassetEnsemble(models, reduction=reduction).eval()
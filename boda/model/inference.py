@@ -0,0 +1,246 @@
+import sys
+import copy
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .custom_layers import Conv1dNorm, LinearNorm, GroupedLinear, BranchedLinear, folded_parameters
+
+class GroupedMatmul(nn.Module):
+    """
+    Independent linear maps for each group, applied with one batched matmul.
+
+    Args:
+        weight (torch.Tensor): Weights of shape (groups, in_features, out_features).
+        bias (torch.Tensor): Biases of shape (groups, 1, out_features).
+    """
+
+    def __init__(self, weight, bias):
+        super().__init__()
+        self.register_buffer('weight', weight.detach().clone().contiguous())
+        self.register_buffer('bias', bias.detach().clone().contiguous())
+
+    def forward(self, x):
+        """
+        Args:
+            x (torch.Tensor): Input of shape (groups, batch, in_features).
+
+        Returns:
+            torch.Tensor: Output of shape (groups, batch, out_features).
+        """
+        return torch.baddbmm(self.bias, x, self.weight)
+
+class FrozenGroupedLinear(nn.Module):
+    """
+    Inference version of GroupedLinear: one batched matmul on contiguous weights.
+
+    Args:
+        layer (GroupedLinear): The layer to freeze.
+    """
+
+    def __init__(self, layer):
+        super().__init__()
+        self.groups = layer.groups
+        self.in_group_size  = layer.in_group_size
+        self.out_group_size = layer.out_group_size
+        self.grouped = GroupedMatmul(layer.weight, layer.bias)
+
+    def forward(self, x):
+        """
+        Args:
+            x (torch.Tensor): Input of shape (batch, groups * in_group_size).
+
+        Returns:
+            torch.Tensor: Output of shape (batch, groups * out_group_size).
+        """
+        hook = x.reshape(x.shape[0], self.groups, self.in_group_size).transpose(0, 1)
+        hook = self.grouped(hook)
+        return hook.transpose(0, 1).reshape(x.shape[0], self.groups * self.out_group_size)
+
+class FrozenBranchedLinear(nn.Module):
+    """
+    Inference version of BranchedLinear.
+
+    All branches read the same input, so the first layer is one nn.Linear with the
+    branches' weights concatenated, replacing the RepeatLayer copy. Later layers are batched
+    matmuls on contiguous (branch, batch, features) activations. Dropout is removed.
+
+    Args:
+        layer (BranchedLinear): The layer to freeze.
+    """
+
+    def __init__(self, layer):
+        super().__init__()
+        self.n_branches = layer.n_branches
+        self.n_layers   = layer.n_layers
+        self.nonlin     = copy.deepcopy(layer.nonlin)
+
+        first = layer.branched_layer_1
+        self.intake = nn.Linear(first.in_group_size, first.groups * first.out_group_size)
+        self.intake.weight.data = first.weight.detach().permute(0, 2, 1).reshape(-1, first.in_group_size).contiguous()
+        self.intake.bias.data   = first.bias.detach().reshape(-1).contiguous()
+        self.intake.requires_grad_(False)
+        for i in range(2, self.n_layers+1):
+            grouped = getattr(layer, f'branched_layer_{i}')
+            setattr(self, f'branched_layer_{i}', GroupedMatmul(grouped.weight, grouped.bias))
+
+    def forward(self, x):
+        """
+        Args:
+            x (torch.Tensor): Input of shape (batch, in_features).
+
+        Returns:
+            torch.Tensor: Output of shape (batch, n_branches * out_group_size).
+        """
+        batch_size = x.shape[0]
+        hook = self.intake(x)
+        if self.n_layers == 1:
+            return hook
+        hook = self.nonlin( hook.view(batch_size, self.n_branches, -1).transpose(0, 1) )
+        for i in range(2, self.n_layers+1):
+            hook = getattr(self, f'branched_layer_{i}')(hook)
+            if i < self.n_layers:
+                hook = self.nonlin( hook )
+        return hook.transpose(0, 1).reshape(batch_size, -1)
+
+def freeze_layer(layer):
+    """
+    Convert a Conv1dNorm or LinearNorm layer into a plain nn.Conv1d or nn.Linear with
+    weight norm and batch norm folded into its parameters.
+
+    Args:
+        layer (Conv1dNorm or LinearNorm): The layer, with batch norm running statistics.
+
+    Returns:
+        nn.Module: The frozen layer.
+    """
+    weight, bias = folded_parameters(layer)
+    if isinstance(layer, Conv1dNorm):
+        conv = layer.conv
+        frozen = nn.Conv1d(conv.in_channels, conv.out_channels, conv.kernel_size,
+                           stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+                           groups=conv.groups, bias=True)
+    else:
+        frozen = nn.Linear(layer.linear.in_features, layer.linear.out_features, bias=True)
+    frozen.weight.data = weight.clone().contiguous()
+    frozen.bias.data   = bias.clone().contiguous()
+    return frozen.requires_grad_(False).to(weight.device)
+
+def fold_padding(model):
+    """
+    Move symmetric ConstantPad1d(0.) layers into the padding of the convolution they feed,
+    and replace padding layers that pad nothing with nn.Identity.
+
+    Args:
+        model (nn.Module): A frozen model with pad{i}/conv{i} pairs, modified in place.
+    """
+    for i in range(1, 10):
+        pad, conv = getattr(model, f'pad{i}', None), getattr(model, f'conv{i}', None)
+        if not isinstance(pad, nn.ConstantPad1d):
+            continue
+        left, right = pad.padding
+        if left == right == 0:
+            setattr(model, f'pad{i}', nn.Identity())
+        elif left == right and pad.value == 0. and isinstance(conv, nn.Conv1d) and conv.padding == (0,):
+            conv.padding = (left,)
+            setattr(model, f'pad{i}', nn.Identity())
+
+def check_equivalence(model, frozen, input_len=None, n_samples=64, atol=1e-4, rtol=1e-4):
+    """
+    Compare a model and its frozen copy on random one-hot sequences.
+
+    Args:
+        model (nn.Module): The original model, in eval mode.
+        frozen (nn.Module): The frozen copy.
+        input_len (int, optional): Sequence length. Defaults to model.input_len, or 600.
+        n_samples (int, optional): Number of sequences. Default is 64.
+        atol (float, optional): Absolute tolerance. Default is 1e-4.
+        rtol (float, optional): Relative tolerance. Default is 1e-4.
+
+    Returns:
+        float: Maximum absolute difference.
+
+    Raises:
+        ValueError: If outputs differ beyond the tolerances.
+    """
+    input_len = getattr(model, 'input_len', 600) if input_len is None else input_len
+    device = next(model.parameters()).device
+    generator = torch.Generator().manual_seed(0)
+    tokens = torch.randint(0, 4, (n_samples, input_len), generator=generator)
+    x = F.one_hot(tokens, 4).transpose(1, 2).float().to(device)
+    with torch.no_grad():
+        expected, observed = model(x), frozen(x)
+    diff = (expected - observed).abs().max().item()
+    if not torch.allclose(expected, observed, atol=atol, rtol=rtol):
+        raise ValueError(f"Frozen model differs from the original by up to {diff:.3g}.")
+    return diff
+
+def freeze_for_inference(model, check=True, **check_kwargs):
+    """
+    Make a frozen inference copy of a Basset-family model.
+
+    Conv1dNorm and LinearNorm layers become plain convolutions and linear layers with
+    weight norm and batch norm folded in. GroupedLinear and BranchedLinear use
+    precomputed contiguous weights. Symmetric zero padding moves into the convolutions,
+    and dropout is removed. The copy keeps the original's encode/decode/classify
+    methods and is for inference only; parameters don't require grad, but gradients
+    with respect to the input still work.
+
+    Args:
+        model (nn.Module): The model. Batch norm uses its running statistics.
+        check (bool, optional): Verify outputs against the original. Default is True.
+        **check_kwargs: Passed to check_equivalence.
+
+    Returns:
+        nn.Module: The frozen copy, in eval mode. Frozen models are returned as is.
+    """
+    if getattr(model, 'is_frozen', False):
+        return model
+    was_training = model.training
+    model.eval()
+
+    # Seed the deepcopy memo with frozen replacements, so replaced layers (including
+    # weight norm's non-leaf weights, which can't be deep copied) are never copied
+    memo = {}
+    def replace(module):
+        for child in module.children():
+            if isinstance(child, (Conv1dNorm, LinearNorm)):
+                memo[id(child)] = freeze_layer(child)
+            elif isinstance(child, BranchedLinear):
+                memo[id(child)] = FrozenBranchedLinear(child)
+            elif isinstance(child, GroupedLinear):
+                memo[id(child)] = FrozenGroupedLinear(child)
+            elif isinstance(child, nn.Dropout):
+                memo[id(child)] = nn.Identity()
+            else:
+                replace(child)
+
+    replace(model)
+    frozen = copy.deepcopy(model, memo)
+    fold_padding(frozen)
+    frozen.requires_grad_(False)
+    frozen.eval()
+    frozen.is_frozen = True
+
+    if check:
+        check_equivalence(model, frozen, **check_kwargs)
+    model.train(was_training)
+    return frozen
+
+def try_freeze_for_inference(model, **kwargs):
+    """
+    Freeze a model with freeze_for_inference, keeping the original if that fails.
+
+    Args:
+        model (nn.Module): The model.
+        **kwargs: Passed to freeze_for_inference.
+
+    Returns:
+        nn.Module: The frozen copy, or the original model.
+    """
+    try:
+        return freeze_for_inference(model, **kwargs)
+    except (ValueError, AttributeError, TypeError) as e:
+        print(f"Keeping the original model, freezing failed: {e}", file=sys.stderr)
+        return model
@@ -0,0 +1,200 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+class PointMutationEngine(nn.Module):
+    """
+    Incremental inference of point mutations for BassetBranched style models.
+
+    A point mutation only changes the convolutional activations inside its receptive
+    field. The engine caches every encoder activation of a set of reference sequences.
+    For each mutation, it recomputes only the slice of each conv and pool layer that the
+    mutated base can reach, splices the slice into the cached reference, and runs the
+    dense head. Outputs match the full forward pass up to floating point error.
+
+    The model must be in eval mode so batch norm uses running statistics and dropout is off.
+    Frozen models from freeze_for_inference, whose padding lives in the convolutions, work
+    the same way.
+
+    Args:
+        model (nn.Module): A BassetBranched model, frozen or not.
+
+    Methods:
+        set_reference(x): Cache the activations of reference sequences.
+        forward(positions, bases, ref_idx): Predict point mutants of the references.
+        saturation_mutagenesis(x, batch_size): Predict every single base substitution of x.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        # (kind, (left, right) padding, layer on padded input, kernel size) in the order of model.encode
+        self.stages = [
+            self.conv_stage(model.pad1, model.conv1),
+            ('pool', (0, 0), model.maxpool_3, model.maxpool_3.kernel_size),
+            self.conv_stage(model.pad2, model.conv2),
+            ('pool', (0, 0), model.maxpool_4, model.maxpool_4.kernel_size),
+            self.conv_stage(model.pad3, model.conv3),
+            ('pad',  tuple(model.pad4.padding), None, None),
+            ('pool', (0, 0), model.maxpool_4, model.maxpool_4.kernel_size),
+        ]
+        self.references = None
+
+    @staticmethod
+    def conv_stage(pad, layer):
+        """
+        Describe a convolution as explicit padding followed by an unpadded convolution.
+
+        Args:
+            pad (nn.Module): Padding before the convolution. nn.Identity in frozen models.
+            layer (nn.Module): Conv1dNorm, or the nn.Conv1d it was frozen into, which pads itself.
+
+        Returns:
+            tuple: ('conv', (left, right) padding, layer applied to padded inputs, kernel size).
+        """
+        padding = tuple(getattr(pad, 'padding', (0, 0)))
+        if isinstance(layer, nn.Conv1d):
+            conv = layer
+            padding = (padding[0] + conv.padding[0], padding[1] + conv.padding[0])
+            layer = lambda x: F.conv1d(x, conv.weight, conv.bias, conv.stride, 0, conv.dilation, conv.groups)
+            return ('conv', padding, layer, conv.kernel_size[0])
+        return ('conv', padding, layer, layer.conv.kernel_size[0])
+
+    @property
+    def n_tokens(self):
+        return getattr(self.model.conv1, 'conv', self.model.conv1).in_channels
+
+    @staticmethod
+    def gather_spans(reference, ref_idx, starts, width):
+        """
+        Gather fixed width spans of cached activations.
+
+        Args:
+            reference (torch.Tensor): Activations of shape (n_references, channels, length).
+            ref_idx (torch.Tensor): Reference of each span.
+            starts (torch.Tensor): Start position of each span.
+            width (int): Span width.
+
+        Returns:
+            torch.Tensor: Spans of shape (n_spans, channels, width).
+        """
+        positions = starts[:, None] + torch.arange(width, device=starts.device)
+        channels  = torch.arange(reference.shape[1], device=starts.device)
+        return reference[ref_idx[:, None, None], channels[None, :, None], positions[:, None, :]]
+
+    @staticmethod
+    def splice(spans, window, offsets):
+        """
+        Overwrite part of each span with recomputed activations.
+
+        Args:
+            spans (torch.Tensor): Spans of shape (n_spans, channels, span_width).
+            window (torch.Tensor): Recomputed activations of shape (n_spans, channels, window_width).
+            offsets (torch.Tensor): Position of each window within its span.
+
+        Returns:
+            torch.Tensor: The spans with windows spliced in.
+        """
+        positions = offsets[:, None] + torch.arange(window.shape[2], device=offsets.device)
+        return spans.scatter(2, positions[:, None, :].expand(-1, spans.shape[1], -1), window.to(spans.dtype))
+
+    @torch.no_grad()
+    def set_reference(self, x):
+        """
+        Cache the encoder activations of reference sequences.
+
+        Args:
+            x (torch.Tensor): One-hot references of shape (n_references, n_tokens, length).
+
+        Returns:
+            torch.Tensor: Model outputs for the references.
+        """
+        assert not self.model.training, "PointMutationEngine requires the model in eval mode."
+        self.references = []
+        hook = x
+        for kind, padding, layer, _ in self.stages:
+            if kind == 'conv':
+                hook = F.pad(hook, padding)
+                self.references.append(hook)
+                hook = self.model.nonlin( layer(hook) )
+            elif kind == 'pool':
+                self.references.append(hook)
+                hook = layer(hook)
+            else:
+                self.references.append(None)
+                hook = F.pad(hook, padding)
+        self.encoded = hook
+        self.reference_outputs = self.model.classify( self.model.decode( torch.flatten(hook, start_dim=1) ) )
+        return self.reference_outputs
+
+    @torch.no_grad()
+    def forward(self, positions, bases, ref_idx=None):
+        """
+        Predict point mutants of the cached references.
+
+        Args:
+            positions (torch.Tensor): Mutated position of each mutant.
+            bases (torch.Tensor): Token index of the new base. A value of n_tokens gives an all-zero column.
+            ref_idx (torch.Tensor, optional): Reference of each mutant. Defaults to the first reference.
+
+        Returns:
+            torch.Tensor: Model outputs of shape (n_mutants, n_outputs).
+        """
+        assert self.references is not None, "Call set_reference first."
+        device    = self.encoded.device
+        positions = torch.as_tensor(positions, device=device).long()
+        bases     = torch.as_tensor(bases, device=device).long()
+        ref_idx   = torch.zeros_like(positions) if ref_idx is None else torch.as_tensor(ref_idx, device=device).long()
+
+        window = F.one_hot(bases, self.n_tokens + 1)[:, :self.n_tokens, None].to(self.encoded.dtype)
+        starts = positions
+        for (kind, padding, layer, kernel_size), reference in zip(self.stages, self.references):
+            if kind == 'conv':
+                left_pad    = padding[0]
+                out_len     = reference.shape[2] - kernel_size + 1
+                width       = min(window.shape[2] + kernel_size - 1, out_len)
+                out_starts  = (starts + left_pad - kernel_size + 1).clamp(0, out_len - width)
+                spans  = self.gather_spans(reference, ref_idx, out_starts, width + kernel_size - 1)
+                spans  = self.splice(spans, window, starts + left_pad - out_starts)
+                window = self.model.nonlin( layer(spans) )
+            elif kind == 'pool':
+                pool_size  = kernel_size
+                out_len    = reference.shape[2] // pool_size
+                width      = min((window.shape[2] - 1) // pool_size + 2, out_len)
+                out_starts = (starts // pool_size).clamp(0, out_len - width)
+                spans  = self.gather_spans(reference, ref_idx, out_starts * pool_size, width * pool_size)
+                # Window positions past the span are past out_len * pool_size, which pooling
+                # drops when the length isn't a multiple of pool_size
+                spans  = F.pad(spans, (0, window.shape[2]))
+                spans  = self.splice(spans, window, starts - out_starts * pool_size)
+                window = layer(spans[..., :width * pool_size])
+            else:
+                out_starts = starts + padding[0]
+            starts = out_starts
+
+        encoded = self.splice(self.encoded[ref_idx], window, starts)
+        return self.model.classify( self.model.decode( torch.flatten(encoded, start_dim=1) ) )
+
+    @torch.no_grad()
+    def saturation_mutagenesis(self, x, batch_size=1024):
+        """
+        Predict every single base substitution of the given sequences.
+
+        Args:
+            x (torch.Tensor): One-hot sequences of shape (n_sequences, n_tokens, length).
+            batch_size (int, optional): Number of mutants per batch. Default is 1024.
+
+        Returns:
+            torch.Tensor: Outputs of shape (n_sequences, n_tokens, length, n_outputs). Entries for
+            the reference base equal the unmutated prediction.
+        """
+        self.set_reference(x)
+        n_seqs, n_tokens, length = x.shape
+        ref_idx, bases, positions = torch.meshgrid(
+            torch.arange(n_seqs, device=x.device), torch.arange(n_tokens, device=x.device),
+            torch.arange(length, device=x.device), indexing='ij'
+        )
+        ref_idx, bases, positions = ref_idx.flatten(), bases.flatten(), positions.flatten()
+        results = [ self(positions[i:i+batch_size], bases[i:i+batch_size], ref_idx[i:i+batch_size])
+                    for i in range(0, positions.numel(), batch_size) ]
+        return torch.cat(results, dim=0).view(n_seqs, n_tokens, length, -1)
@@ -0,0 +1,253 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.ao import quantization
+
+from ..common import utils
+from .inference import freeze_for_inference, GroupedMatmul
+
+QUANTIZATION_VERSION = 1
+
+def default_engine():
+    """
+    Pick the quantized kernel backend for this CPU.
+
+    Returns:
+        str: Name of a supported engine.
+    """
+    supported = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in supported:
+            return engine
+    raise RuntimeError(f"No int8 engine available, found {supported}.")
+
+def static_qconfig(engine):
+    """
+    Quantization config for convolutions: per-channel int8 weights and histogram
+    calibrated uint8 activations.
+
+    Args:
+        engine (str): Quantized engine. x86 kernels need a reduced activation range.
+
+    Returns:
+        torch.ao.quantization.QConfig: The config.
+    """
+    return quantization.QConfig(
+        activation=quantization.HistogramObserver.with_args(reduce_range=engine != 'qnnpack'),
+        weight=quantization.default_per_channel_weight_observer,
+    )
+
+class StaticQuantConv1d(nn.Module):
+    """
+    A convolution that runs in int8: the input is quantized with calibrated parameters,
+    convolved with per-channel quantized weights, and dequantized.
+
+    Args:
+        conv (nn.Conv1d): The float convolution.
+    """
+
+    def __init__(self, conv):
+        super().__init__()
+        self.quant   = quantization.QuantStub()
+        self.conv    = conv
+        self.dequant = quantization.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant( self.conv( self.quant(x) ) )
+
+class GroupedDynamicLinear(nn.Module):
+    """
+    A GroupedMatmul split into one nn.Linear per group, so each group can use dynamic
+    int8 linear kernels. PyTorch has no quantized batched matmul.
+
+    Args:
+        grouped (GroupedMatmul): The grouped layer.
+    """
+
+    def __init__(self, grouped):
+        super().__init__()
+        self.layers = nn.ModuleList()
+        for weight, bias in zip(grouped.weight, grouped.bias):
+            linear = nn.Linear(*weight.shape)
+            linear.weight.data = weight.t().contiguous()
+            linear.bias.data   = bias.reshape(-1).contiguous()
+            self.layers.append(linear.requires_grad_(False))
+
+    def forward(self, x):
+        """
+        Args:
+            x (torch.Tensor): Input of shape (groups, batch, in_features).
+
+        Returns:
+            torch.Tensor: Output of shape (groups, batch, out_features).
+        """
+        return torch.stack([ layer(group) for layer, group in zip(self.layers, x) ], dim=0)
+
+class QuantizedModel(nn.Module):
+    """
+    An int8 model for CPU inference.
+
+    Quantized kernels only run on CPU, so inputs are moved to the CPU and outputs back
+    to the input's device, and device or dtype moves of the module itself (e.g. .cuda())
+    are ignored. This lets scripts that move their model to an available GPU use
+    quantized artifacts unchanged. The model is for inference only; gradients don't flow
+    through quantized layers.
+
+    Args:
+        model (nn.Module): The converted model.
+        engine (str): The quantized engine it was converted for.
+
+    Attributes:
+        input_len (int): Input length of the original model.
+        quantization (dict): Metadata stored with quantized artifacts.
+    """
+
+    def __init__(self, model, engine):
+        super().__init__()
+        self.model     = model
+        self.engine    = engine
+        self.input_len = getattr(model, 'input_len', 600)
+        self.is_frozen = True
+        self.quantization = {'version': QUANTIZATION_VERSION, 'engine': engine,
+                             'conv': 'static_per_channel', 'linear': 'dynamic_per_channel'}
+
+    @property
+    def device(self):
+        return torch.device('cpu')
+
+    def _apply(self, fn, *args, **kwargs):
+        # Packed int8 weights stay on the CPU
+        return self
+
+    def forward(self, x):
+        torch.backends.quantized.engine = self.engine
+        if not x.is_floating_point():
+            # Quantized convolutions need one-hot input
+            return self.model( utils.tokens2tensor(x.cpu(), allow_unknown=True) ).to(x.device)
+        return self.model( x.to('cpu', torch.float32) ).to(x.device)
+
+def is_quantized(model):
+    """
+    Check whether a model (or a wrapper around one, e.g. CachedModel) is quantized.
+
+    Args:
+        model (nn.Module): The model.
+
+    Returns:
+        bool: True for QuantizedModel.
+    """
+    return any( isinstance(module, QuantizedModel) for module in model.modules() )
+
+def prepare_quantization(model, engine):
+    """
+    Make a frozen CPU copy of a model with observers on its convolutions.
+
+    Args:
+        model (nn.Module): A Basset-family model.
+        engine (str): Quantized engine.
+
+    Returns:
+        nn.Module: The prepared copy, ready for calibration.
+    """
+    prepared = freeze_for_inference(model).cpu()
+
+    def replace(module):
+        for name, child in module.named_children():
+            if isinstance(child, nn.Conv1d):
+                wrapped = StaticQuantConv1d(child)
+                wrapped.qconfig = static_qconfig(engine)
+                setattr(module, name, wrapped)
+            elif isinstance(child, GroupedMatmul):
+                setattr(module, name, GroupedDynamicLinear(child))
+            else:
+                replace(child)
+
+    replace(prepared)
+    return quantization.prepare(prepared)
+
+def convert_quantization(prepared, engine):
+    """
+    Convert a calibrated model: convolutions to static int8 and linear layers, including
+    grouped ones, to dynamic int8 with per-channel weights.
+
+    Args:
+        prepared (nn.Module): Output of prepare_quantization after calibration.
+        engine (str): Quantized engine.
+
+    Returns:
+        QuantizedModel: The int8 model.
+    """
+    torch.backends.quantized.engine = engine
+    converted = quantization.convert(prepared)
+    converted = quantization.quantize_dynamic(converted, {nn.Linear: quantization.per_channel_dynamic_qconfig}, dtype=torch.qint8)
+    return QuantizedModel(converted, engine).eval()
+
+def quantize_model(model, calibration_data, engine=None):
+    """
+    Post-training int8 quantization of a Basset-family model for CPU inference.
+
+    The model is frozen with freeze_for_inference, convolutions get per-channel int8
+    weights with activation ranges calibrated on calibration_data, and linear layers
+    (including the BranchedLinear and GroupedLinear heads) are quantized dynamically.
+
+    Args:
+        model (nn.Module): The fp32 model.
+        calibration_data (iterable): One-hot batches of shape (batch, 4, length), e.g. a
+            sample of MPRA sequences.
+        engine (str, optional): Quantized engine. Defaults to default_engine().
+
+    Returns:
+        QuantizedModel: The int8 model.
+    """
+    engine = default_engine() if engine is None else engine
+    torch.backends.quantized.engine = engine
+    prepared = prepare_quantization(model, engine)
+    with torch.no_grad():
+        for batch in calibration_data:
+            prepared( batch.to('cpu', torch.float32) )
+    return convert_quantization(prepared, engine)
+
+def quantized_checkpoint(checkpoint, quantized):
+    """
+    Make an artifact checkpoint that stores a quantized model.
+
+    Args:
+        checkpoint (dict): Contents of the fp32 artifact's torch_checkpoint.pt.
+        quantized (QuantizedModel): The quantized model.
+
+    Returns:
+        dict: Checkpoint with the quantized state dict and quantization metadata.
+        model_fn restores it with restore_quantized.
+    """
+    checkpoint = dict(checkpoint)
+    checkpoint['model_state_dict'] = quantized.state_dict()
+    checkpoint['quantization'] = dict(quantized.quantization)
+    return checkpoint
+
+def restore_quantized(model, quantization_info, state_dict):
+    """
+    Rebuild a quantized model from an artifact.
+
+    Args:
+        model (nn.Module): An fp32 model with the artifact's hyperparameters. Its weights
+            are not used.
+        quantization_info (dict): The checkpoint's quantization metadata.
+        state_dict (dict): The quantized state dict.
+
+    Returns:
+        QuantizedModel: The int8 model.
+    """
+    assert quantization_info['version'] == QUANTIZATION_VERSION, \
+           f"Unknown quantized artifact version {quantization_info['version']}."
+    engine = quantization_info['engine']
+    if engine not in torch.backends.quantized.supported_engines:
+        engine = default_engine()
+    torch.backends.quantized.engine = engine
+    prepared = prepare_quantization(model.eval(), engine)
+    # One pass initializes the observers; the stored scales replace them
+    with torch.no_grad():
+        tokens = torch.randint(0, 4, (2, getattr(model, 'input_len', 600)))
+        prepared( F.one_hot(tokens, 4).transpose(1, 2).float() )
+    quantized = convert_quantization(prepared, engine)
+    quantized.load_state_dict(state_dict)
+    return quantized
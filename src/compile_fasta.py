@@ -0,0 +1,36 @@
+import sys
+import argparse
+
+import boda
+from boda.common import utils
+
+def main(args):
+    """
+    Compile a FASTA reference into a packed genome.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments parsed by argparse.
+
+    Returns:
+        None
+    """
+    header = boda.data.compile_fasta(
+        args.fasta_file, args.output,
+        all_upper=args.all_upper,
+        buffer_size=args.buffer_size
+    )
+
+    n_bases = sum([ contig['length'] for contig in header['contigs'] ])
+    n_gaps  = sum([ end - start for contig in header['contigs'] for start, end in contig['n_runs'] ])
+    print(f"packed {len(header['contigs'])} contigs, {n_bases} bases ({n_gaps} outside alphabet) into {args.output}", file=sys.stderr)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Compile a FASTA reference into a memory-mappable packed genome.")
+    parser.add_argument('--fasta_file', type=str, required=True, help='FASTA reference file. Plain text or gzip.')
+    parser.add_argument('--output', type=str, required=True, help='Output path for the packed genome.')
+    parser.add_argument('--all_upper', type=utils.str2bool, default=True, help='Treat lowercase (soft-masked) bases as uppercase.')
+    parser.add_argument('--buffer_size', type=int, default=2**24, help='Number of bases encoded per write.')
+    args = parser.parse_args()
+
+    main(args)
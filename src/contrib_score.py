@@ -8,6 +8,7 @@ import argparse
 import multiprocessing
 
 import tqdm
+import h5py
 
 import torch
 import torch.nn as nn
@@ -17,6 +18,10 @@ import pandas as pd
 import boda
 from boda.common import constants, utils
 from boda.common.utils import unpack_artifact, model_fn
+from boda.common.work_queue import WorkQueue, chunk_output_path
+from boda.common.checkpoint import ProgressBitmap, progress_path, sync_hdf5
+from boda.common.pipeline import DevicePrefetcher, HostCopy
+from boda.common.precision import reduced_precision, PRECISIONS
 
 ###################################
 ## Contribution Scoreing helpers ##
@@ -117,11 +122,10 @@ def isg_contributions(sequences,
         adaptive_sampling (bool): Whether to adapt sampling along the path.
 
     Returns:
-        torch.Tensor: ISG contributions scores.
+        torch.Tensor: ISG contributions scores, on the device.
     """
     batch_size = eval_batch_size // (max_samples - 3)
-    temp_dataset = TensorDataset(sequences)
-    temp_dataloader = DataLoader(temp_dataset, batch_size=batch_size, shuffle=False, num_workers=2)
+    # Slices of the (device) input, without DataLoader worker startup for every call
     
     slope_coefficients = [i / num_steps for i in range(1, num_steps + 1)]
     if adaptive_sampling:
@@ -131,8 +135,8 @@ def isg_contributions(sequences,
         sample_ns = [max_samples for i in range(0, num_steps + 1)]       
       
     all_gradients = []
-    for local_batch in temp_dataloader:
-        target_thetas = (theta_factor * local_batch[0].cuda()).requires_grad_()
+    for start in range(0, sequences.shape[0], batch_size):
+        target_thetas = (theta_factor * sequences[start:start+batch_size]).requires_grad_()
         line_gradients = []
         for i in range(0, num_steps):
             point_thetas = slope_coefficients[i] * target_thetas
@@ -153,7 +157,7 @@ def isg_contributions(sequences,
         gradients = torch.stack(line_gradients).mean(dim=0).detach()
         all_gradients.append(gradients)
         
-    return theta_factor * torch.cat(all_gradients).cpu()
+    return theta_factor * torch.cat(all_gradients)
 
 
 def batch_to_contributions(onehot_sequences,
@@ -180,11 +184,11 @@ def batch_to_contributions(onehot_sequences,
         adaptive_sampling (bool): Whether to adapt sampling along the path.
 
     Returns:
-        torch.Tensor: Batch-level contributions.
+        torch.Tensor: Batch-level contributions, on the device.
     """
     extended_contributions = []
     for i in range(model_output_len):
-        predictor = mpra_predictor(model=model, pred_idx=i, ini_in_len=seq_len).cuda()
+        predictor = mpra_predictor(model=model, pred_idx=i, ini_in_len=seq_len).to(onehot_sequences.device)
         extended_contributions.append(isg_contributions(onehot_sequences, predictor,
                                                         num_steps = num_steps,
                                                         max_samples=max_samples,
@@ -225,7 +229,100 @@ def prepare_hdf5_file(fa_dataset, h5_file, subset=None):
         
     return h5_file
 
+def score_windows(args, my_model, fasta_data, fasta_subset, output):
+    """
+    Calculate contributions for FASTA windows and write them to an HDF5 file.
+
+    Finished batches are recorded in a ProgressBitmap next to the output. With
+    args.resume, an interrupted output is reopened and only the remaining batches are run.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments.
+        my_model (nn.Module): The model.
+        fasta_data (boda.data.FastaDataset): All windows.
+        fasta_subset (torch.utils.data.Dataset): The windows to score.
+        output (str): Output HDF5 path.
+
+    Returns:
+        None
+    """
+    first_chr, first_start, first_end, *first_extra  = list(fasta_subset[0][0])
+    last_chr, last_start, last_end, *last_extra      = list(fasta_subset[-1][0])
+    
+    process_span = [fasta_data.idx2key[first_chr], first_start, first_end, fasta_data.idx2key[last_chr], last_start, last_end]
+    print("Processing intervals {} {} {} to {} {} {}".format(*process_span), file=sys.stderr)
+    
+    n_batches = -(-len(fasta_subset) // args.batch_size)
+    settings  = {
+        'artifact_path': args.artifact_path, 'sequence_length': args.sequence_length, 'step_size': args.step_size,
+        'num_steps': args.num_steps, 'max_samples': args.max_samples, 'adaptive_sampling': args.adaptive_sampling,
+        'batch_size': args.batch_size, 'n_windows': len(fasta_subset), 'span': [ int(x) for x in process_span if not isinstance(x, str) ],
+        'precision': args.precision,
+    }
+    progress = ProgressBitmap(progress_path(output), n_batches, settings, resume=args.resume and os.path.isfile(output))
+    
+    if progress.resumed:
+        f = h5py.File(output,'r+')
+        print(f"Resuming: {progress.report()}", file=sys.stderr)
+    else:
+        f = h5py.File(output,'w')
+        f = prepare_hdf5_file(fasta_data, f, subset=len(fasta_subset))
     
+    # Only batches without a record in the progress bitmap are run
+    USE_CUDA = torch.cuda.device_count() >= 1
+    pending = progress.pending()
+    batches = [ list(range(i*args.batch_size, min(len(fasta_subset), (i+1)*args.batch_size))) for i in pending ]
+    # torch 1.13 rejects a prefetch_factor other than 2 without workers
+    loader_kwargs = {'num_workers': args.num_workers, 'pin_memory': USE_CUDA}
+    if args.num_workers > 0:
+        loader_kwargs['prefetch_factor'] = args.prefetch_depth
+    fasta_loader = torch.utils.data.DataLoader(
+        fasta_subset, sampler=batches, batch_size=None, 
+        **loader_kwargs,
+    )
+    # Sequences are copied to the device ahead of use, locations stay on the host
+    fasta_loader = DevicePrefetcher(fasta_loader, 'cuda' if USE_CUDA else 'cpu', depth=args.prefetch_depth, keys=(1,))
+    
+    def write_batch(batch_idx, placement, host_copy):
+        if host_copy is not None:
+            f['contribution_scores'][placement] = host_copy.result()
+        # Rows must be on disk before the batch is marked, or a resume would skip them
+        sync_hdf5(f)
+        progress.mark(batch_idx)
+    
+    # Each batch is written while the next one runs on the device
+    previous = None
+    for batch_idx, batch in zip(pending, tqdm.tqdm(fasta_loader)):
+
+        location, sequence = [ y.contiguous() for y in batch ]
+        h5_start = batch_idx * args.batch_size
+
+        current_bsz = location.shape[0]
+        f['locations'][h5_start:h5_start+current_bsz] = location
+        
+        gap_filter = np.arange(current_bsz)[(sequence.sum(dim=[-2,-1]) > 0).cpu().numpy()]
+        
+        results = None
+        if gap_filter.size >= 1:
+            results = batch_to_contributions(sequence[gap_filter], my_model, 
+                                             model_output_len=3, 
+                                             seq_len = args.sequence_length, 
+                                             num_steps=args.num_steps,
+                                             max_samples=args.max_samples,
+                                             eval_batch_size=args.internal_batch_size,
+                                             adaptive_sampling=args.adaptive_sampling)
+            results = HostCopy(results)
+
+        if previous is not None:
+            write_batch(*previous)
+        previous = (batch_idx, np.arange(h5_start, h5_start+current_bsz)[gap_filter], results)
+
+    if previous is not None:
+        write_batch(*previous)
+
+    f.close()
+    progress.close()
+
 def main(args):
     """
     Main function for calculating ISG contributions.
@@ -248,67 +345,49 @@ def main(args):
     model_dir = './artifacts'
 
     my_model = model_fn(model_dir)
-    my_model.cuda()
+    assert not boda.model.is_quantized(my_model), "Contribution scores need gradients, which int8 models don't provide."
+    if torch.cuda.device_count() >= 1:
+        my_model.cuda()
     my_model.eval()
+    if args.freeze_model:
+        my_model = boda.model.try_freeze_for_inference(my_model)
+    my_model = reduced_precision(my_model, args.precision, tolerance=args.precision_tolerance)
     
     #################
     ## Setup FASTA ##
     #################
-    fasta_dict = boda.data.Fasta(args.fasta_file)
+    fasta_dict = boda.data.load_fasta(args.fasta_file)
     n_tokens = len(fasta_dict.alphabet)
     
     fasta_data = boda.data.FastaDataset(
         fasta_dict.fasta, 
         window_size=args.sequence_length, step_size=args.step_size, 
-        reverse_complements=False
+        reverse_complements=False,
+        max_n_fraction=args.max_n_fraction
     )
     
-    if args.n_jobs > 1:
-        extra_tasks = len(fasta_data) % args.n_jobs
-        if extra_tasks > 0:
-            subset_size = (len(fasta_data)-extra_tasks) // (args.n_jobs-1)
-        else:
-            subset_size = len(fasta_data) // args.n_jobs
-        start_idx = subset_size*args.job_id
-        stop_idx  = min(len(fasta_data), subset_size*(args.job_id+1))
-        fasta_subset = torch.utils.data.Subset(fasta_data, np.arange(start_idx, stop_idx))
+    if args.work_queue is not None:
+        queue = WorkQueue(args.work_queue, stale_after=args.queue_stale_after)
+        queue.initialize(len(fasta_data), args.queue_chunk_size)
+        for chunk in queue.claims():
+            chunk_output = chunk_output_path(args.output, chunk.chunk_id)
+            fasta_subset = torch.utils.data.Subset(fasta_data, np.arange(chunk.start, chunk.stop))
+            score_windows(args, my_model, fasta_data, fasta_subset, chunk_output)
+            queue.complete(chunk.chunk_id, chunk_output)
+        print(f"Queue progress: {queue.progress()}", file=sys.stderr)
     else:
-        fasta_subset = fasta_data
-    
-    fasta_loader = torch.utils.data.DataLoader(fasta_subset, batch_size=args.batch_size, shuffle=False)
-    
-    f = h5py.File(args.output,'w')
-    f = prepare_hdf5_file(fasta_data, f, subset=stop_idx-start_idx)
-    
-    first_chr, first_start, first_end, *first_extra  = list(fasta_subset[0][0])
-    last_chr, last_start, last_end, *last_extra      = list(fasta_subset[-1][0])
-    
-    process_span = [fasta_data.idx2key[first_chr], first_start, first_end, fasta_data.idx2key[last_chr], last_start, last_end]
-    print("Processing intervals {} {} {} to {} {} {}".format(*process_span), file=sys.stderr)
-    
-    h5_start = 0
-    for i, batch in enumerate(tqdm.tqdm(fasta_loader)):
-
-        location, sequence = [ y.contiguous() for y in batch ]
-
-        current_bsz = location.shape[0]
-        f['locations'][h5_start:h5_start+current_bsz] = location
-        
-        gap_filter = np.arange(current_bsz)[sequence.sum(dim=[-2,-1]) > 0]
-        
-        if gap_filter.size >= 1:
-            results = batch_to_contributions(sequence[gap_filter], my_model, 
-                                             model_output_len=3, 
-                                             seq_len = args.sequence_length, 
-                                             num_steps=args.num_steps,
-                                             max_samples=args.max_samples,
-                                             eval_batch_size=args.internal_batch_size,
-                                             adaptive_sampling=args.adaptive_sampling)
-
-            placement = np.arange(h5_start, h5_start+current_bsz)[gap_filter]
-            f['contribution_scores'][placement] = results
-
-        h5_start = h5_start+current_bsz
+        if args.n_jobs > 1:
+            extra_tasks = len(fasta_data) % args.n_jobs
+            if extra_tasks > 0:
+                subset_size = (len(fasta_data)-extra_tasks) // (args.n_jobs-1)
+            else:
+                subset_size = len(fasta_data) // args.n_jobs
+            start_idx = subset_size*args.job_id
+            stop_idx  = min(len(fasta_data), subset_size*(args.job_id+1))
+            fasta_subset = torch.utils.data.Subset(fasta_data, np.arange(start_idx, stop_idx))
+        else:
+            fasta_subset = fasta_data
+        score_windows(args, my_model, fasta_data, fasta_subset, args.output)
 
 if __name__ == '__main__':
     
@@ -323,10 +402,20 @@ if __name__ == '__main__':
     parser.add_argument('--left_flank', type=str, default=boda.common.constants.MPRA_UPSTREAM[-200:], help='Upstream padding.')
     parser.add_argument('--right_flank', type=str, default=boda.common.constants.MPRA_DOWNSTREAM[:200], help='Downstream padding.')
     parser.add_argument('--batch_size', type=int, default=10, help='Batch size during sequence extraction from FASTA.')
+    parser.add_argument('--num_workers', type=int, default=0, help='Number of DataLoader workers for sequence extraction.')
+    parser.add_argument('--prefetch_depth', type=int, default=2, help='Number of batches extracted and copied to the device ahead of the model.')
+    parser.add_argument('--max_n_fraction', type=float, help='Skip windows where more than this fraction of bases are N. Job partitions are balanced over the kept windows.')
     parser.add_argument('--num_steps', type=int, default=100, help='Number of steps between start and target distribution for integrated grads.')
     parser.add_argument('--max_samples', type=int, default=20, help='Number of samples at each step during integrated grads.')
     parser.add_argument('--adaptive_sampling', type=utils.str2bool, default=True, help='Apply adaptive sampling during integrated grads.')
     parser.add_argument('--internal_batch_size', type=int, default=1040, help='Internal batch size for contribution scoring.')
+    parser.add_argument('--freeze_model', type=utils.str2bool, default=True, help='Fold normalization into the model weights (boda.model.freeze_for_inference). Falls back to the original model if the frozen copy is not equivalent.')
+    parser.add_argument('--precision', type=str, choices=PRECISIONS, default='fp32', help='Model precision for forward and backward passes. auto uses fp16 on CUDA and bf16 on CPUs with native support, otherwise fp32.')
+    parser.add_argument('--precision_tolerance', type=float, default=0.05, help='Refuse to run if reduced precision predictions differ from fp32 by more than this on a calibration sample.')
+    parser.add_argument('--resume', type=utils.str2bool, default=False, help='Reopen an existing output and skip batches recorded as done in OUTPUT.progress. Settings must match the interrupted run.')
+    parser.add_argument('--work_queue', type=str, help='SQLite work queue shared by workers, replacing --job_id/--n_jobs. Workers claim chunks of windows until none are left and write one HDF5 per chunk to OUTPUT.chunkNNNNNN. Combine with src/merge_chunks.py.')
+    parser.add_argument('--queue_chunk_size', type=int, default=1000, help='Number of windows per work queue chunk.')
+    parser.add_argument('--queue_stale_after', type=float, help='Seconds after which a claimed but unfinished chunk is handed to another worker.')
     args = parser.parse_args()
     
     main(args)
\ No newline at end of file
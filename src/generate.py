@@ -16,6 +16,8 @@ import torch
 import boda
 from boda.common import utils
 from boda.common.utils import unpack_artifact, model_fn
+from boda.common.prediction_cache import PredictionCache, CachedModel, model_fingerprint
+from boda.common.precision import reduced_precision, PRECISIONS
 
 import hypertune
 
@@ -95,6 +97,18 @@ def main(args):
     else:
         penalty_module = None
     current_penalty = None
+    
+    if args['Main args'].freeze_model and getattr(energy, 'model', None) is not None:
+        energy.model = boda.model.try_freeze_for_inference(energy.model)
+    if args['Main args'].precision != 'fp32' and getattr(energy, 'model', None) is not None:
+        energy.model = reduced_precision(energy.model, args['Main args'].precision, tolerance=args['Main args'].precision_tolerance, device='cuda')
+    
+    if args['Main args'].prediction_cache is not None:
+        # Gradient-based generators bypass the cache; sampling generators reuse scored sequences
+        cache = PredictionCache(args['Main args'].prediction_cache, lru_size=args['Main args'].cache_memory_size)
+        energy.model = CachedModel(energy.model, cache, model_fingerprint(energy.model))
+    else:
+        cache = None
 
     generator_constructor_args['params']    = params
     generator_constructor_args['energy_fn'] = energy
@@ -123,6 +137,9 @@ def main(args):
             generator.params = params_module(**params_args)
             
         print('finished round', file=sys.stderr)
+    
+    if cache is not None:
+        print(cache.report(), file=sys.stderr)
             
     save_proposals(proposal_sets, args_copy)
     return params, energy, generator, proposal_sets
@@ -141,6 +158,11 @@ if __name__ == '__main__':
     group.add_argument('--max_attempts', type=int, default=10000)
     group.add_argument('--reset_params', type=utils.str2bool, default=True)
     group.add_argument('--proposal_path', type=str)
+    group.add_argument('--freeze_model', type=utils.str2bool, default=True, help='Fold normalization into the energy model weights (boda.model.freeze_for_inference). Falls back to the original model if the frozen copy is not equivalent.')
+    group.add_argument('--precision', type=str, choices=PRECISIONS, default='fp32', help='Energy model precision. auto uses fp16 on CUDA and bf16 on CPUs with native support, otherwise fp32. Energies are reduced in fp32.')
+    group.add_argument('--precision_tolerance', type=float, default=0.05, help='Refuse to run if reduced precision predictions differ from fp32 by more than this on a calibration sample.')
+    group.add_argument('--prediction_cache', type=str, help='SQLite file of cached energy model predictions. Shared across runs.')
+    group.add_argument('--cache_memory_size', type=int, default=2**16, help='Number of cached predictions kept in memory.')
 
     group.add_argument('--tolerate_unknown_args', type=utils.str2bool, default=False, help='Skips unknown command line args without exceptions. Useful for HPO, but high risk of silent errors.')
     
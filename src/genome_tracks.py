@@ -0,0 +1,419 @@
+import sys
+import os
+import shutil
+import argparse
+
+import tqdm
+
+import torch
+import torch.nn as nn
+import numpy as np
+import boda
+from boda.common import utils
+from boda.common.utils import unpack_artifact, model_fn
+from boda.common.work_queue import WorkQueue, chunk_output_path
+from boda.common.pipeline import DevicePrefetcher, HostCopy
+from boda.common.precision import reduced_precision, PRECISIONS
+from boda.common.genome_tracks import TrackWriter
+
+class StrandBuilder(nn.Module):
+    """
+    Add flanks to token windows on both strands.
+
+    Args:
+        left_flank (str): Upstream flank.
+        right_flank (str): Downstream flank.
+    """
+
+    def __init__(self, left_flank, right_flank):
+        super().__init__()
+        self.register_buffer('left_flank', torch.from_numpy(utils.dna2tokens([left_flank])))
+        self.register_buffer('right_flank', torch.from_numpy(utils.dna2tokens([right_flank])))
+
+    def add_flanks(self, tokens):
+        batch_size = tokens.shape[0]
+        return torch.cat([ self.left_flank.expand(batch_size, -1), tokens,
+                           self.right_flank.expand(batch_size, -1) ], dim=-1)
+
+    def forward(self, tokens):
+        """
+        Args:
+            tokens (torch.Tensor): uint8 windows of shape (batch, length).
+
+        Returns:
+            tuple: Forward and reverse complement windows with flanks.
+        """
+        return self.add_flanks(tokens), self.add_flanks(utils.reverse_complement_tokens(tokens))
+
+def output_names(model_dir):
+    """
+    Name model outputs after the activity columns the model was trained on.
+
+    Args:
+        model_dir (str): Unpacked artifact directory.
+
+    Returns:
+        list: Cell type names, e.g. K562 for K562_log2FC, or output_{i} if unknown.
+    """
+    checkpoint = torch.load(os.path.join(model_dir, 'torch_checkpoint.pt'), map_location='cpu')
+    n_outputs = vars(checkpoint['model_hparams']).get('n_outputs', 3)
+    columns = getattr(checkpoint.get('data_hparams'), 'activity_columns', None)
+    if columns is None or len(columns) != n_outputs:
+        return [ f'output_{i}' for i in range(n_outputs) ]
+    return [ column.split('_')[0] for column in columns ]
+
+def track_writer(args, fasta_data, output, cell_types, **attrs):
+    """
+    Open a track file for the contigs of fasta_data with the run settings as attributes.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments parsed by argparse.
+        fasta_data (boda.data.FastaDataset): All windows.
+        output (str): Output HDF5 path.
+        cell_types (list): Names of the model outputs.
+        **attrs: Extra file attributes.
+
+    Returns:
+        TrackWriter: The writer.
+    """
+    settings = {
+        'artifact_path': args.artifact_path, 'fasta_file': args.fasta_file,
+        'left_flank': args.left_flank, 'right_flank': args.right_flank,
+        'max_n_fraction': -1. if args.max_n_fraction is None else args.max_n_fraction,
+        'precision': args.precision, **attrs,
+    }
+    return TrackWriter(
+        output, { key: fasta_data.key_lens[key] for key in fasta_data.idx2key }, cell_types,
+        args.sequence_length, args.step_size, chunk_length=args.chunk_length, dtype=args.dtype,
+        compression=None if args.compression == 'none' else args.compression,
+        compression_opts=args.compression_level, attrs=settings,
+    )
+
+def window_loader(args, fasta_subset):
+    """
+    Batch windows in order and copy their tokens to the inference device ahead of use.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments parsed by argparse.
+        fasta_subset (torch.utils.data.Dataset): The windows, as tokens.
+
+    Returns:
+        DevicePrefetcher: Yields window locations (on the host) and tokens.
+    """
+    USE_CUDA = torch.cuda.device_count() >= 1
+    batches = [ list(range(i, min(len(fasta_subset), i+args.batch_size))) for i in range(0, len(fasta_subset), args.batch_size) ]
+    # torch 1.13 rejects a prefetch_factor other than 2 without workers
+    loader_kwargs = {'num_workers': args.num_workers, 'pin_memory': USE_CUDA}
+    if args.num_workers > 0:
+        loader_kwargs['prefetch_factor'] = args.prefetch_depth
+    fasta_loader = torch.utils.data.DataLoader(
+        fasta_subset, sampler=batches, batch_size=None,
+        **loader_kwargs,
+    )
+    return DevicePrefetcher(fasta_loader, 'cuda' if USE_CUDA else 'cpu', depth=args.prefetch_depth, keys=(1,))
+
+def strand_average(my_model, strand_builder, tokens, cell_types):
+    """
+    Average the predictions of both strands of windows.
+
+    Args:
+        my_model (nn.Module): The model.
+        strand_builder (StrandBuilder): Adds flanks to both strands of windows.
+        tokens (torch.Tensor): uint8 windows of shape (batch, length), on the device.
+        cell_types (list): Names of the model outputs.
+
+    Returns:
+        torch.Tensor: fp32 predictions of shape (batch, n_cell_types).
+    """
+    forward, revcomp = strand_builder(tokens)
+    result = my_model(forward).float().div(2.) + my_model(revcomp).float().div(2.)
+    assert result.shape[-1] == len(cell_types), f"Model has {result.shape[-1]} outputs, got {len(cell_types)} cell types."
+    return result
+
+def predict_tracks(args, my_model, fasta_data, fasta_subset, output, strand_builder, cell_types):
+    """
+    Predict the windows of fasta_subset and write them as tracks.
+
+    Batches run across contig boundaries. Strands are averaged on the device, and each
+    batch is written while the next one runs.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments parsed by argparse.
+        my_model (nn.Module): The model.
+        fasta_data (boda.data.FastaDataset): All windows, as tokens.
+        fasta_subset (torch.utils.data.Dataset): The windows to process, in order.
+        output (str): Output HDF5 path.
+        strand_builder (StrandBuilder): Adds flanks to both strands of windows.
+        cell_types (list): Names of the model outputs.
+
+    Returns:
+        None
+    """
+    writer = track_writer(args, fasta_data, output, cell_types)
+
+    def write_batch(location, host_copy):
+        result = host_copy.result()
+        location = location.numpy()
+        k_ids, starts = location[:, 0], location[:, 1]
+        breaks = np.concatenate([[0], np.nonzero(np.diff(k_ids))[0] + 1, [k_ids.shape[0]]])
+        for lo, hi in zip(breaks[:-1], breaks[1:]):
+            writer.write(fasta_data.idx2key[k_ids[lo]], starts[lo:hi] // args.step_size, result[lo:hi])
+
+    previous = None
+    with torch.no_grad():
+        for location, tokens in tqdm.tqdm(window_loader(args, fasta_subset)):
+            result = strand_average(my_model, strand_builder, tokens, cell_types)
+            if previous is not None:
+                write_batch(*previous)
+            previous = (location, HostCopy(result))
+
+    if previous is not None:
+        write_batch(*previous)
+    writer.close()
+
+def predict_windows(args, my_model, fasta_data, idxs, strand_builder, cell_types):
+    """
+    Predict windows by index.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments parsed by argparse.
+        my_model (nn.Module): The model.
+        fasta_data (boda.data.FastaDataset): All windows, as tokens.
+        idxs (numpy.ndarray): Indices of the windows in fasta_data.
+        strand_builder (StrandBuilder): Adds flanks to both strands of windows.
+        cell_types (list): Names of the model outputs.
+
+    Returns:
+        numpy.ndarray: Strand averaged predictions of shape (len(idxs), n_cell_types).
+    """
+    results = []
+    with torch.no_grad():
+        for _, tokens in window_loader(args, torch.utils.data.Subset(fasta_data, idxs)):
+            results.append( HostCopy(strand_average(my_model, strand_builder, tokens, cell_types)) )
+    results = [ host_copy.result() for host_copy in results ]
+    return np.concatenate(results, axis=0) if results else np.zeros((0, len(cell_types)), dtype=np.float32)
+
+def refine_intervals(values, left, right, threshold, delta):
+    """
+    Pick the intervals between coarse windows to re-scan at full resolution.
+
+    An interval is refined if a coarse window at either end reaches threshold in any cell
+    type, or if the predictions at its ends differ by at least delta in any cell type.
+
+    Args:
+        values (numpy.ndarray): Predictions of shape (n_windows, n_cell_types).
+        left (numpy.ndarray): Positions of the coarse windows starting each interval.
+        right (numpy.ndarray): Positions of the coarse windows ending each interval.
+        threshold (numpy.ndarray): Activity threshold, scalar or one per cell type.
+        delta (float): Change threshold between neighbouring coarse windows.
+
+    Returns:
+        numpy.ndarray: Boolean mask of the intervals to refine.
+    """
+    active = lambda x: (x >= threshold).any(axis=1)
+    changed = (np.abs(values[right] - values[left]) >= delta).any(axis=1)
+    return active(values[left]) | active(values[right]) | changed
+
+def interval_positions(left, right):
+    """
+    Get the positions strictly between the ends of intervals.
+
+    Args:
+        left (numpy.ndarray): Interval starts.
+        right (numpy.ndarray): Interval ends.
+
+    Returns:
+        numpy.ndarray: Concatenated positions left+1, ..., right-1 of every interval.
+    """
+    n_inner = right - left - 1
+    offsets = np.arange(n_inner.sum()) - np.repeat(np.cumsum(n_inner) - n_inner, n_inner)
+    return np.repeat(left + 1, n_inner) + offsets
+
+def scan_adaptive(args, my_model, fasta_data, fasta_subset, output, strand_builder, cell_types):
+    """
+    Coarse-to-fine version of predict_tracks.
+
+    Windows are processed in blocks of chunk_length. In each block, every window starting
+    at a multiple of coarse_step is predicted first, together with the first and last window
+    of each run of kept windows, so every other window lies between two coarse windows of
+    the same run. Intervals whose ends reach refine_threshold, or differ by refine_delta,
+    are re-scanned at step_size. Bins of the remaining intervals are linearly interpolated
+    between their ends, so the output has the same layout as a dense scan, and dense and
+    adaptive tracks can be queried the same way.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments parsed by argparse.
+        my_model (nn.Module): The model.
+        fasta_data (boda.data.FastaDataset): All windows, as tokens.
+        fasta_subset (torch.utils.data.Subset): The windows to process, a consecutive range
+            of fasta_data.
+        output (str): Output HDF5 path.
+        strand_builder (StrandBuilder): Adds flanks to both strands of windows.
+        cell_types (list): Names of the model outputs.
+
+    Returns:
+        dict: Number of windows in the subset, and of coarse and refined model evaluations.
+    """
+    ratio = args.coarse_step // args.step_size
+    threshold = np.asarray(args.refine_threshold, dtype=np.float32)
+    writer = track_writer(args, fasta_data, output, cell_types, coarse_step=args.coarse_step,
+                          refine_threshold=threshold, refine_delta=args.refine_delta)
+
+    idxs = np.asarray(fasta_subset.indices, dtype=np.int64)
+    counts = {'n_windows': len(idxs), 'n_coarse': 0, 'n_refined': 0}
+    for block in tqdm.tqdm([ idxs[i:i+args.chunk_length] for i in range(0, len(idxs), args.chunk_length) ]):
+        segments = np.searchsorted(fasta_data.segment_rolling_n, block, side='right')
+        bins = fasta_data.segment_first[segments] + block - fasta_data.segment_past_n[segments]
+        run_breaks = segments[1:] != segments[:-1]
+        is_coarse = (bins % ratio == 0) | np.r_[True, run_breaks] | np.r_[run_breaks, True]
+
+        values = np.empty((len(block), len(cell_types)), dtype=np.float32)
+        coarse = np.nonzero(is_coarse)[0]
+        values[coarse] = predict_windows(args, my_model, fasta_data, block[coarse], strand_builder, cell_types)
+
+        # Intervals between consecutive coarse windows of the same run
+        left, right = coarse[:-1], coarse[1:]
+        inner = (segments[left] == segments[right]) & (right - left > 1)
+        left, right = left[inner], right[inner]
+        refine = refine_intervals(values, left, right, threshold, args.refine_delta)
+
+        fine = interval_positions(left[refine], right[refine])
+        values[fine] = predict_windows(args, my_model, fasta_data, block[fine], strand_builder, cell_types)
+
+        lo, hi = left[~refine], right[~refine]
+        skipped = interval_positions(lo, hi)
+        n_inner = hi - lo - 1
+        lo, hi = np.repeat(lo, n_inner), np.repeat(hi, n_inner)
+        weight = ((skipped - lo) / (hi - lo)).astype(np.float32)[:, None]
+        values[skipped] = (1. - weight) * values[lo] + weight * values[hi]
+
+        k_ids = fasta_data.segment_keys[segments]
+        breaks = np.concatenate([[0], np.nonzero(np.diff(k_ids))[0] + 1, [k_ids.shape[0]]])
+        for lo, hi in zip(breaks[:-1], breaks[1:]):
+            writer.write(fasta_data.idx2key[k_ids[lo]], bins[lo:hi], values[lo:hi])
+        counts['n_coarse']  += len(coarse)
+        counts['n_refined'] += len(fine)
+
+    writer.close()
+    n_evaluated = counts['n_coarse'] + counts['n_refined']
+    print(f"Evaluated {n_evaluated} of {counts['n_windows']} windows ({counts['n_coarse']} coarse, {counts['n_refined']} refined), "
+          f"{counts['n_windows'] / max(1, n_evaluated):.1f}x fewer than a dense scan", file=sys.stderr)
+    return counts
+
+def main(args):
+    """
+    Execute the main functionality of the script.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments parsed by argparse.
+
+    Returns:
+        None
+    """
+
+    ##################
+    ## Import Model ##
+    ##################
+    if os.path.isdir('./artifacts'):
+        shutil.rmtree('./artifacts')
+
+    unpack_artifact(args.artifact_path)
+
+    model_dir = './artifacts'
+
+    my_model = model_fn(model_dir)
+    if torch.cuda.device_count() >= 1:
+        my_model.cuda()
+    my_model.eval()
+    if args.freeze_model:
+        my_model = boda.model.try_freeze_for_inference(my_model)
+    my_model = reduced_precision(my_model, args.precision, tolerance=args.precision_tolerance)
+
+    input_len = len(args.left_flank) + args.sequence_length + len(args.right_flank)
+    assert input_len == getattr(my_model, 'input_len', input_len), \
+           f"Flanks and windows add up to {input_len} bp, the model takes {my_model.input_len}."
+    cell_types = output_names(model_dir) if args.cell_types is None else args.cell_types
+    print(f"Writing tracks for {cell_types}", file=sys.stderr)
+
+    if args.coarse_step is None:
+        scan = predict_tracks
+    else:
+        assert args.coarse_step % args.step_size == 0, "--coarse_step must be a multiple of --step_size."
+        assert len(args.refine_threshold) in (1, len(cell_types)), \
+               f"Give one --refine_threshold, or one per cell type ({len(cell_types)})."
+        scan = scan_adaptive
+
+    ###################
+    ## Setup helpers ##
+    ###################
+    strand_builder = StrandBuilder(args.left_flank, args.right_flank)
+    if torch.cuda.device_count() >= 1:
+        strand_builder.cuda()
+
+    #################
+    ## Setup FASTA ##
+    #################
+    fasta_dict = boda.data.load_fasta(args.fasta_file)
+    contigs = list(fasta_dict.fasta.keys()) if args.contigs is None else args.contigs
+    missing = [ key for key in contigs if key not in fasta_dict.fasta ]
+    assert len(missing) == 0, f"Contigs not in {args.fasta_file}: {missing}"
+
+    fasta_data = boda.data.FastaDataset(
+        { key: fasta_dict.fasta[key] for key in contigs },
+        window_size=args.sequence_length, step_size=args.step_size,
+        reverse_complements=False,
+        max_n_fraction=args.max_n_fraction,
+        as_codes=True,
+    )
+    print(f"Tiling {len(contigs)} contigs with {len(fasta_data)} windows", file=sys.stderr)
+
+    if args.work_queue is not None:
+        queue = WorkQueue(args.work_queue, stale_after=args.queue_stale_after)
+        queue.initialize(len(fasta_data), args.queue_chunk_size)
+        for chunk in queue.claims():
+            chunk_output = chunk_output_path(args.output, chunk.chunk_id)
+            fasta_subset = torch.utils.data.Subset(fasta_data, np.arange(chunk.start, chunk.stop))
+            scan(args, my_model, fasta_data, fasta_subset, chunk_output, strand_builder, cell_types)
+            queue.complete(chunk.chunk_id, chunk_output)
+        print(f"Queue progress: {queue.progress()}", file=sys.stderr)
+    else:
+        subset_size = -(-len(fasta_data) // args.n_jobs)
+        start_idx = min(len(fasta_data), subset_size*args.job_id)
+        stop_idx  = min(len(fasta_data), subset_size*(args.job_id+1))
+        fasta_subset = torch.utils.data.Subset(fasta_data, np.arange(start_idx, stop_idx))
+        scan(args, my_model, fasta_data, fasta_subset, args.output, strand_builder, cell_types)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Genome-wide activity tracks. Tiles contigs with windows, averages predictions over strands, and writes one chunked, compressed HDF5 dataset per contig and cell type. With --coarse_step, only regions with activity are scanned at full resolution. Query regions with boda.common.genome_tracks.TrackReader.")
+    parser.add_argument('--artifact_path', type=str, required=True, help='Pre-trained model artifacts.')
+    parser.add_argument('--fasta_file', type=str, required=True, help='FASTA reference file or packed genome.')
+    parser.add_argument('--output', type=str, required=True, help='Output HDF5 path.')
+    parser.add_argument('--contigs', type=str, nargs='+', help='Contigs to tile. Default is all.')
+    parser.add_argument('--cell_types', type=str, nargs='+', help='Track names for the model outputs. Defaults to the activity columns of the training data.')
+    parser.add_argument('--job_id', type=int, default=0, help='Job partition index for distributed computing.')
+    parser.add_argument('--n_jobs', type=int, default=1, help='Total number of job partitions.')
+    parser.add_argument('--sequence_length', type=int, default=200, help='Length of the genomic windows.')
+    parser.add_argument('--step_size', type=int, default=50, help='Distance between window starts, and the resolution of the tracks.')
+    parser.add_argument('--left_flank', type=str, default=boda.common.constants.MPRA_UPSTREAM[-200:], help='Upstream padding.')
+    parser.add_argument('--right_flank', type=str, default=boda.common.constants.MPRA_DOWNSTREAM[:200], help='Downstream padding.')
+    parser.add_argument('--batch_size', type=int, default=1024, help='Number of windows per batch. Batches span contig boundaries.')
+    parser.add_argument('--num_workers', type=int, default=0, help='Number of DataLoader workers for sequence extraction.')
+    parser.add_argument('--prefetch_depth', type=int, default=2, help='Number of batches extracted and copied to the device ahead of the model.')
+    parser.add_argument('--max_n_fraction', type=float, default=0.1, help='Skip windows where more than this fraction of bases are N. Their bins are NaN.')
+    parser.add_argument('--chunk_length', type=int, default=2**16, help='Number of bins per HDF5 chunk. Bounds the memory used for writing and the data read per query.')
+    parser.add_argument('--dtype', type=str, choices=['float16', 'float32'], default='float16', help='Storage dtype of the tracks.')
+    parser.add_argument('--compression', type=str, choices=['gzip', 'lzf', 'none'], default='gzip', help='HDF5 compression filter.')
+    parser.add_argument('--compression_level', type=int, default=4, help='gzip compression level.')
+    parser.add_argument('--coarse_step', type=int, help='Scan coarse-to-fine: predict windows every COARSE_STEP bp (a multiple of --step_size) first, and re-scan at --step_size only between coarse windows that pass --refine_threshold or --refine_delta. Other bins are interpolated. Default is a dense scan.')
+    parser.add_argument('--refine_threshold', type=float, nargs='+', default=[1.0], help='Re-scan next to coarse windows with a prediction at least this high in any cell type. One value, or one per cell type.')
+    parser.add_argument('--refine_delta', type=float, default=0.5, help='Re-scan between neighbouring coarse windows whose predictions differ by at least this much in any cell type.')
+    parser.add_argument('--freeze_model', type=utils.str2bool, default=True, help='Fold normalization into the model weights (boda.model.freeze_for_inference). Falls back to the original model if the frozen copy is not equivalent.')
+    parser.add_argument('--precision', type=str, choices=PRECISIONS, default='auto', help='Model precision. auto uses fp16 on CUDA and bf16 on CPUs with native support, otherwise fp32. Strand averages are fp32.')
+    parser.add_argument('--precision_tolerance', type=float, default=0.05, help='Refuse to run if reduced precision predictions differ from fp32 by more than this on a calibration sample.')
+    parser.add_argument('--work_queue', type=str, help='SQLite work queue shared by workers, replacing --job_id/--n_jobs. Workers claim chunks of windows until none are left and write one HDF5 per chunk to OUTPUT.chunkNNNNNN. Combine with src/merge_chunks.py.')
+    parser.add_argument('--queue_chunk_size', type=int, default=1000000, help='Number of windows per work queue chunk.')
+    parser.add_argument('--queue_stale_after', type=float, help='Seconds after which a claimed but unfinished chunk is handed to another worker.')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,35 @@
+import sys
+import argparse
+
+from boda.common.work_queue import WorkQueue, merge_outputs
+
+def main(args):
+    """
+    Merge per-chunk outputs of a work queue run into one file, in chunk order.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments parsed by argparse.
+
+    Returns:
+        None
+    """
+    if args.work_queue is not None:
+        queue = WorkQueue(args.work_queue)
+        print(f"Queue progress: {queue.progress()}", file=sys.stderr)
+        paths = queue.outputs()
+    else:
+        paths = args.inputs
+
+    merge_outputs(paths, args.output)
+    print(f"Merged {len(paths)} chunks into {args.output}", file=sys.stderr)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Merge chunk outputs of sat_mut.py, contrib_score.py, genome_tracks.py, or vcf_predict.py runs.")
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument('--work_queue', type=str, help='SQLite work queue of the run. All chunks must be done.')
+    inputs.add_argument('--inputs', type=str, nargs='+', help='Chunk outputs to merge, in order.')
+    parser.add_argument('--output', type=str, required=True, help='Merged output path.')
+    args = parser.parse_args()
+
+    main(args)
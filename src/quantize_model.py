@@ -0,0 +1,200 @@
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import tarfile
+import tempfile
+import subprocess
+
+import numpy as np
+import torch
+
+import boda
+from boda.common.utils import unpack_artifact, model_fn
+from boda.data.mpra_datamodule import gather_batch, expand_token_batch
+from boda.graph.utils import pearson_correlation, spearman_correlation
+
+def iterate_batches(dataset, idxs, batch_size):
+    """
+    Yield one-hot batches of sequences and activities from an MPRA dataset.
+
+    Args:
+        dataset (Dataset): A dataset of MPRA_DataModule.
+        idxs (numpy.ndarray): Indices of the examples to use.
+        batch_size (int): Number of examples per batch.
+
+    Yields:
+        tuple: One-hot sequences and activities.
+    """
+    for start in range(0, len(idxs), batch_size):
+        batch = gather_batch(dataset, idxs[start:start+batch_size].tolist())
+        yield expand_token_batch(batch[:2])
+
+def predict(model, dataset, batch_size):
+    """
+    Predict a dataset and time the model.
+
+    Args:
+        model (nn.Module): The model, on CPU.
+        dataset (Dataset): Dataset of sequences and activities.
+        batch_size (int): Number of examples per batch.
+
+    Returns:
+        tuple: Predictions, activities, and sequences per second of model time.
+    """
+    preds, targets, elapsed = [], [], 0.
+    with torch.no_grad():
+        for sequences, activities in iterate_batches(dataset, np.arange(len(dataset)), batch_size):
+            start = time.perf_counter()
+            preds.append( model(sequences) )
+            elapsed += time.perf_counter() - start
+            targets.append( activities )
+    return torch.cat(preds), torch.cat(targets), len(dataset) / elapsed
+
+def accuracy_report(fp32_model, int8_model, dataset, batch_size, activity_columns):
+    """
+    Compare the fp32 and int8 models on held-out sequences.
+
+    Args:
+        fp32_model (nn.Module): The original model.
+        int8_model (QuantizedModel): The quantized model.
+        dataset (Dataset): Held-out sequences and measured activities.
+        batch_size (int): Number of examples per batch.
+        activity_columns (list): Names of the model outputs.
+
+    Returns:
+        dict: Per-output correlations with the measurements for both models, agreement
+        between the models, and throughput.
+    """
+    report = {'n_sequences': len(dataset), 'activity_columns': list(activity_columns)}
+    preds = {}
+    for name, model in [('fp32', fp32_model), ('int8', int8_model)]:
+        preds[name], targets, throughput = predict(model, dataset, batch_size)
+        report[name] = {
+            'pearson' : pearson_correlation(preds[name], targets)[0].tolist(),
+            'spearman': spearman_correlation(preds[name], targets)[0].tolist(),
+            'sequences_per_second': throughput,
+        }
+    diff = (preds['int8'] - preds['fp32']).abs()
+    report['agreement'] = {
+        'pearson': pearson_correlation(preds['int8'], preds['fp32'])[0].tolist(),
+        'mean_abs_diff': diff.mean(dim=0).tolist(),
+        'max_abs_diff': diff.max(dim=0).values.tolist(),
+    }
+    report['speedup'] = report['int8']['sequences_per_second'] / report['fp32']['sequences_per_second']
+    return report
+
+def save_artifact(model_dir, checkpoint, output):
+    """
+    Pack a copy of an artifact directory with a new checkpoint.
+
+    Args:
+        model_dir (str): Unpacked artifact directory.
+        checkpoint (dict): Checkpoint to store as torch_checkpoint.pt.
+        output (str): Path of the tar.gz artifact, local or gs://.
+    """
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        artifact_dir = os.path.join(tmpdirname, 'artifacts')
+        shutil.copytree(model_dir, artifact_dir)
+        torch.save(checkpoint, os.path.join(artifact_dir, 'torch_checkpoint.pt'))
+        local_path = os.path.join(tmpdirname, os.path.basename(output))
+        with tarfile.open(local_path, 'w:gz') as tar:
+            tar.add(artifact_dir, arcname='artifacts')
+        if 'gs://' in output:
+            subprocess.check_call(['gsutil', 'cp', local_path, output])
+        else:
+            shutil.copy(local_path, output)
+
+def main(args):
+    """
+    Quantize a model artifact to int8 and report its accuracy against the fp32 model.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments parsed by argparse.
+
+    Returns:
+        None
+    """
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    ##################
+    ## Import Model ##
+    ##################
+    if os.path.isdir('./artifacts'):
+        shutil.rmtree('./artifacts')
+
+    unpack_artifact(args.artifact_path)
+
+    model_dir = './artifacts'
+
+    checkpoint = torch.load(os.path.join(model_dir, 'torch_checkpoint.pt'))
+    assert 'quantization' not in checkpoint, "Artifact is already quantized."
+    my_model = model_fn(model_dir)
+    my_model.cpu()
+    my_model.eval()
+
+    ################
+    ## Setup data ##
+    ################
+    data_hparams = vars(checkpoint['data_hparams']) if 'data_hparams' in checkpoint else {}
+    data_hparams = { **data_hparams, 'num_workers': 0, 'use_reverse_complements': False }
+    for key in ['datafile_path', 'data_project', 'test_chrs']:
+        if getattr(args, key) is not None:
+            data_hparams[key] = getattr(args, key)
+    data = boda.data.MPRA_DataModule(**data_hparams)
+    data.setup()
+    assert data.chr_dataset_test is not None, "No sequences on the held-out chromosomes (test_chrs)."
+
+    ##############
+    ## Quantize ##
+    ##############
+    generator = np.random.default_rng(args.seed)
+    calibration_set = data.dataset_train if data.dataset_train is not None else data.dataset_val
+    calibration_idxs = generator.choice(len(calibration_set), size=min(args.n_calibration, len(calibration_set)), replace=False)
+    calibration_batches = ( sequences for sequences, _ in iterate_batches(calibration_set, np.sort(calibration_idxs), args.batch_size) )
+
+    int8_model = boda.model.quantize_model(my_model, calibration_batches, engine=args.engine)
+    print(f'Quantized with {len(calibration_idxs)} calibration sequences for the {int8_model.engine} engine', file=sys.stderr)
+
+    ####################
+    ## Check accuracy ##
+    ####################
+    report = accuracy_report(my_model, int8_model, data.chr_dataset_test, args.batch_size, data.activity_columns)
+    report.update({'test_chrs': sorted(data.test_chrs), 'n_calibration': len(calibration_idxs),
+                   'quantization': int8_model.quantization, 'artifact_path': args.artifact_path})
+    print(json.dumps(report, indent=2))
+    if args.report_path is not None:
+        with open(args.report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    min_agreement = min(report['agreement']['pearson'])
+    if min_agreement < args.min_agreement:
+        raise ValueError(f"int8 predictions correlate with fp32 at {min_agreement:.4f} < {args.min_agreement}. Artifact not saved.")
+
+    ##########
+    ## Save ##
+    ##########
+    save_artifact(model_dir, boda.model.quantized_checkpoint(checkpoint, int8_model), args.output)
+    print(f'Saved int8 artifact to {args.output}', file=sys.stderr)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Post-training int8 quantization of a model artifact for CPU inference.")
+    parser.add_argument('--artifact_path', type=str, required=True, help='Pre-trained fp32 model artifacts.')
+    parser.add_argument('--output', type=str, required=True, help='Path of the quantized tar.gz artifact, local or gs://.')
+    parser.add_argument('--datafile_path', type=str, help='MPRA data file. Defaults to the one the model was trained on.')
+    parser.add_argument('--data_project', type=str, nargs='+', help='Data projects to keep from the data file. Defaults to the training data_project.')
+    parser.add_argument('--test_chrs', type=str, nargs='+', help='Held-out chromosomes for the accuracy report. Defaults to the training test_chrs.')
+    parser.add_argument('--n_calibration', type=int, default=2048, help='Number of training sequences used to calibrate activation ranges.')
+    parser.add_argument('--batch_size', type=int, default=128, help='Batch size for calibration and evaluation.')
+    parser.add_argument('--engine', type=str, help='Quantized engine (x86, fbgemm, or qnnpack). Defaults to the best available.')
+    parser.add_argument('--num_threads', type=int, help='Number of CPU threads.')
+    parser.add_argument('--min_agreement', type=float, default=0.99, help='Minimum Pearson correlation between int8 and fp32 predictions for every output.')
+    parser.add_argument('--report_path', type=str, help='Write the accuracy report as JSON.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for choosing calibration sequences.')
+    args = parser.parse_args()
+
+    main(args)
@@ -8,6 +8,7 @@ import argparse
 import multiprocessing
 
 import tqdm
+import h5py
 
 import torch
 import torch.nn as nn
@@ -17,6 +18,11 @@ import pandas as pd
 import boda
 from boda.common import constants
 from boda.common.utils import unpack_artifact, model_fn
+from boda.common.prediction_cache import PredictionCache, CachedModel, artifact_fingerprint
+from boda.common.work_queue import WorkQueue, chunk_output_path
+from boda.common.checkpoint import ProgressBitmap, progress_path, sync_hdf5
+from boda.common.pipeline import DevicePrefetcher, HostCopy
+from boda.common.precision import reduced_precision, PRECISIONS
 
 class FlankBuilder(nn.Module):
     """
@@ -167,6 +173,122 @@ class Mutagenizer(nn.Module):
         return self.windower( hook.flatten(0,-3) )
 
 
+def mutagenize_windows(args, my_model, fasta_data, fasta_subset, output, flank_builder, mutagenizer):
+    """
+    Run saturation mutagenesis over FASTA windows and write the results to an HDF5 file.
+
+    The file has one dataset per contig. Each dataset records the (start, stop) range of
+    rows written from fasta_subset in its 'written_rows' attribute, so outputs of work
+    queue chunks can be merged with src/merge_chunks.py. Finished batches are recorded
+    in a ProgressBitmap next to the output, and with args.resume an interrupted output
+    is reopened and only the remaining batches are run.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments parsed by argparse.
+        my_model (nn.Module): The model.
+        fasta_data (boda.data.FastaDataset): All windows.
+        fasta_subset (torch.utils.data.Dataset): The windows to process.
+        output (str): Output HDF5 path.
+        flank_builder (FlankBuilder): Adds flanks to windows.
+        mutagenizer (Mutagenizer): Generates point mutants of windows.
+
+    Returns:
+        None
+    """
+    n_tokens = mutagenizer.n_tokens
+    
+    first_chr, first_start, first_end, *first_extra  = list(fasta_subset[0][0])
+    last_chr, last_start, last_end, *last_extra      = list(fasta_subset[-1][0])
+    
+    process_span = [fasta_data.idx2key[first_chr], first_start, first_end, fasta_data.idx2key[last_chr], last_start, last_end]
+    print("Processing intervals {} {} {} to {} {} {}".format(*process_span), file=sys.stderr)
+    
+    ###########################
+    ## Setup output/progress ##
+    ###########################
+    n_batches = -(-len(fasta_subset) // args.batch_size)
+    settings  = {
+        'artifact_path': args.artifact_path, 'sequence_length': args.sequence_length, 
+        'left_flank': args.left_flank, 'right_flank': args.right_flank, 
+        'batch_size': args.batch_size, 'n_windows': len(fasta_subset), 'span': [ int(x) for x in process_span if not isinstance(x, str) ],
+        'precision': args.precision,
+    }
+    progress = ProgressBitmap(progress_path(output), n_batches, settings, resume=args.resume and os.path.isfile(output))
+    
+    if progress.resumed:
+        f = h5py.File(output,'r+')
+        written_rows = { key: tuple(f[key].attrs['written_rows']) for key in fasta_data.idx2key if 'written_rows' in f[key].attrs }
+        print(f"Resuming: {progress.report()}", file=sys.stderr)
+    else:
+        f = h5py.File(output,'w')
+        # Chunked storage only allocates the rows this job writes
+        h5_datasets = [ f.create_dataset(key, (fasta_data.key_lens[key], 4, 3), dtype=np.float16, 
+                                         chunks=(max(1, min(fasta_data.key_lens[key], 2**14)), 4, 3)) 
+                        for key in fasta_data.idx2key ]
+        for dset in h5_datasets:
+            dset.set_fill_value = np.nan
+        written_rows = {}
+    
+    # Only batches without a record in the progress bitmap are run
+    USE_CUDA = torch.cuda.device_count() >= 1
+    pending = progress.pending()
+    batches = [ list(range(i*args.batch_size, min(len(fasta_subset), (i+1)*args.batch_size))) for i in pending ]
+    # torch 1.13 rejects a prefetch_factor other than 2 without workers
+    loader_kwargs = {'num_workers': args.num_workers, 'pin_memory': USE_CUDA}
+    if args.num_workers > 0:
+        loader_kwargs['prefetch_factor'] = args.prefetch_depth
+    fasta_loader = torch.utils.data.DataLoader(
+        fasta_subset, sampler=batches, batch_size=None, 
+        **loader_kwargs,
+    )
+    # Sequences are copied to the device ahead of use, locations stay on the host
+    fasta_loader = DevicePrefetcher(fasta_loader, 'cuda' if USE_CUDA else 'cpu', depth=args.prefetch_depth, keys=(1,))
+    
+    def write_batch(batch_idx, location, host_copy):
+        result = host_copy.result()
+        for (chrom_idx, start, end, strand), position_activity in zip(location, result):
+            key, row = fasta_data.idx2key[chrom_idx], int(start+args.sequence_length-1)
+            f[ key ][row] = position_activity.astype(np.float16)
+            lo, hi = written_rows.get(key, (row, row+1))
+            written_rows[key] = (min(lo, row), max(hi, row+1))
+        
+        for key in set( fasta_data.idx2key[chrom_idx] for chrom_idx in location[:,0] ):
+            f[key].attrs['written_rows'] = written_rows[key]
+        # Rows must be on disk before the batch is marked, or a resume would skip them
+        sync_hdf5(f)
+        progress.mark(batch_idx)
+    
+    # Each batch is written while the next one runs on the device
+    previous = None
+    # Reduced precision, if any, is applied inside my_model; strand and position averages are fp32
+    with torch.no_grad():
+        for batch_idx, batch in zip(pending, tqdm.tqdm(fasta_loader)):
+            
+            location, sequence = [ y.contiguous() for y in batch ]
+            
+            current_bsz = location.shape[0]
+            
+            mutated = mutagenizer(sequence)
+            forward = flank_builder(mutated)
+            revcomp = flank_builder(mutated.flip(dims=(1,2)))
+            
+            result = my_model(forward).float().div(2.) + my_model(revcomp).float().div(2.)
+            
+            result = result.unflatten(0,(current_bsz, n_tokens, args.sequence_length)).mean(dim=2)
+            
+            if previous is not None:
+                write_batch(*previous)
+            previous = (batch_idx, location, HostCopy(result))
+    
+    if previous is not None:
+        write_batch(*previous)
+
+    for key in fasta_data.idx2key:
+        if key not in written_rows:
+            f[key].attrs['written_rows'] = (0, 0)
+    f.close()
+    progress.close()
+
 def main(args):
     """
     Execute the main functionality of the script.
@@ -189,8 +311,18 @@ def main(args):
     model_dir = './artifacts'
 
     my_model = model_fn(model_dir)
-    my_model.cuda()
+    if torch.cuda.device_count() >= 1:
+        my_model.cuda()
     my_model.eval()
+    if args.freeze_model:
+        my_model = boda.model.try_freeze_for_inference(my_model)
+    my_model = reduced_precision(my_model, args.precision, tolerance=args.precision_tolerance)
+    
+    if args.prediction_cache is not None:
+        cache = PredictionCache(args.prediction_cache, lru_size=args.cache_memory_size)
+        my_model = CachedModel(my_model, cache, artifact_fingerprint([args.artifact_path]))
+    else:
+        cache = None
     
     ###################
     ## Setup helpers ##
@@ -212,63 +344,49 @@ def main(args):
     
     mutagenizer = Mutagenizer(args.sequence_length)
     
+    # Mutants and flanks are built on the device from the prefetched windows
+    if torch.cuda.device_count() >= 1:
+        flank_builder.cuda()
+        mutagenizer.cuda()
+    
     #################
     ## Setup FASTA ##
     #################
-    fasta_dict = boda.data.Fasta(args.fasta_file)
+    fasta_dict = boda.data.load_fasta(args.fasta_file)
     n_tokens = len(fasta_dict.alphabet)
     
     fasta_data = boda.data.FastaDataset(
         fasta_dict.fasta, 
         window_size=args.sequence_length*2-1, step_size=1, 
-        reverse_complements=False
+        reverse_complements=False,
+        max_n_fraction=args.max_n_fraction
     )
     
-    if args.n_jobs > 1:
-        extra_tasks = len(fasta_data) % args.n_jobs
-        if extra_tasks > 0:
-            subset_size = (len(fasta_data)-extra_tasks) // (args.n_jobs-1)
-        else:
-            subset_size = len(fasta_data) // args.n_jobs
-        start_idx = subset_size*args.job_id
-        stop_idx  = min(len(fasta_data), subset_size*(args.job_id+1))
-        fasta_subset = torch.utils.data.Subset(fasta_data, np.arange(start_idx, stop_idx))
+    if args.work_queue is not None:
+        queue = WorkQueue(args.work_queue, stale_after=args.queue_stale_after)
+        queue.initialize(len(fasta_data), args.queue_chunk_size)
+        for chunk in queue.claims():
+            chunk_output = chunk_output_path(args.output, chunk.chunk_id)
+            fasta_subset = torch.utils.data.Subset(fasta_data, np.arange(chunk.start, chunk.stop))
+            mutagenize_windows(args, my_model, fasta_data, fasta_subset, chunk_output, flank_builder, mutagenizer)
+            queue.complete(chunk.chunk_id, chunk_output)
+        print(f"Queue progress: {queue.progress()}", file=sys.stderr)
     else:
-        fasta_subset = fasta_data
-    
-    fasta_loader = torch.utils.data.DataLoader(fasta_subset, batch_size=args.batch_size, shuffle=False)
-    
-    current_contig = ''
+        if args.n_jobs > 1:
+            extra_tasks = len(fasta_data) % args.n_jobs
+            if extra_tasks > 0:
+                subset_size = (len(fasta_data)-extra_tasks) // (args.n_jobs-1)
+            else:
+                subset_size = len(fasta_data) // args.n_jobs
+            start_idx = subset_size*args.job_id
+            stop_idx  = min(len(fasta_data), subset_size*(args.job_id+1))
+            fasta_subset = torch.utils.data.Subset(fasta_data, np.arange(start_idx, stop_idx))
+        else:
+            fasta_subset = fasta_data
+        mutagenize_windows(args, my_model, fasta_data, fasta_subset, args.output, flank_builder, mutagenizer)
 
-    f = h5py.File(args.output,'w')
-    h5_datasets = [ f.create_dataset(key, (fasta_data.key_lens[key], 4, 3), dtype=np.float16) for key in fasta_data.idx2key ]
-    for dset in h5_datasets:
-        dset.set_fill_value = np.nan
-        
-    first_chr, first_start, first_end, *first_extra  = list(fasta_subset[0][0])
-    last_chr, last_start, last_end, *last_extra      = list(fasta_subset[-1][0])
-    
-    process_span = [fasta_data.idx2key[first_chr], first_start, first_end, fasta_data.idx2key[last_chr], last_start, last_end]
-    print("Processing intervals {} {} {} to {} {} {}".format(*process_span), file=sys.stderr)
-    
-    with torch.no_grad():
-        with torch.autocast(device_type='cuda', dtype=torch.float16):
-            for i, batch in enumerate(tqdm.tqdm(fasta_loader)):
-                
-                location, sequence = [ y.contiguous() for y in batch ]
-                
-                current_bsz = location.shape[0]
-                
-                mutated = mutagenizer(sequence)
-                forward = flank_builder(mutated)
-                revcomp = flank_builder(mutated.flip(dims=(1,2)))
-                
-                result = my_model(forward.cuda()).div(2.) + my_model(revcomp.cuda()).div(2.)
-                
-                result = result.unflatten(0,(current_bsz, n_tokens, args.sequence_length)).mean(dim=2)
-                
-                for (chrom_idx, start, end, strand), position_activity in zip(location, result):
-                    f[ fasta_data.idx2key[chrom_idx] ][start+args.sequence_length-1] = position_activity.cpu().half().numpy()
+    if cache is not None:
+        print(cache.report(), file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -283,6 +401,18 @@ if __name__ == '__main__':
     parser.add_argument('--left_flank', type=str, default=boda.common.constants.MPRA_UPSTREAM[-200:], help='Upstream padding.')
     parser.add_argument('--right_flank', type=str, default=boda.common.constants.MPRA_DOWNSTREAM[:200], help='Downstream padding.')
     parser.add_argument('--batch_size', type=int, default=10, help='Batch size during sequence extraction from FASTA.')
+    parser.add_argument('--num_workers', type=int, default=0, help='Number of DataLoader workers for sequence extraction.')
+    parser.add_argument('--prefetch_depth', type=int, default=2, help='Number of batches extracted and copied to the device ahead of the model.')
+    parser.add_argument('--max_n_fraction', type=float, help='Skip windows where more than this fraction of bases are N. Job partitions are balanced over the kept windows.')
+    parser.add_argument('--prediction_cache', type=str, help='SQLite file of cached predictions keyed by artifact and input window. Shared across runs and jobs.')
+    parser.add_argument('--cache_memory_size', type=int, default=2**16, help='Number of cached predictions kept in memory.')
+    parser.add_argument('--freeze_model', type=boda.common.utils.str2bool, default=True, help='Fold normalization into the model weights (boda.model.freeze_for_inference). Falls back to the original model if the frozen copy is not equivalent.')
+    parser.add_argument('--precision', type=str, choices=PRECISIONS, default='auto', help='Model precision. auto uses fp16 on CUDA and bf16 on CPUs with native support, otherwise fp32.')
+    parser.add_argument('--precision_tolerance', type=float, default=0.05, help='Refuse to run if reduced precision predictions differ from fp32 by more than this on a calibration sample.')
+    parser.add_argument('--resume', type=boda.common.utils.str2bool, default=False, help='Reopen an existing output and skip batches recorded as done in OUTPUT.progress. Settings must match the interrupted run.')
+    parser.add_argument('--work_queue', type=str, help='SQLite work queue shared by workers, replacing --job_id/--n_jobs. Workers claim chunks of windows until none are left and write one HDF5 per chunk to OUTPUT.chunkNNNNNN. Combine with src/merge_chunks.py.')
+    parser.add_argument('--queue_chunk_size', type=int, default=100000, help='Number of windows per work queue chunk.')
+    parser.add_argument('--queue_stale_after', type=float, help='Seconds after which a claimed but unfinished chunk is handed to another worker.')
     args = parser.parse_args()
     
     main(args)
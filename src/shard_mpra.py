@@ -0,0 +1,55 @@
+import sys
+import argparse
+
+import boda
+from boda.common import constants, utils
+
+def main(args):
+    """
+    Write an MPRA table as binary shards for ShardedMPRA_DataModule.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments parsed by argparse.
+
+    Returns:
+        None
+    """
+    manifest = boda.data.write_mpra_shards(
+        args.datafile_path, args.output_dir,
+        sep=args.sep,
+        sequence_column=args.sequence_column,
+        activity_columns=args.activity_columns,
+        stderr_columns=args.stderr_columns,
+        chr_column=args.chr_column,
+        project_column=args.project_column,
+        padded_seq_len=args.padded_seq_len,
+        left_flank=args.left_flank,
+        right_flank=args.right_flank,
+        shard_size=args.shard_size,
+        chunksize=args.chunksize
+    )
+
+    groups = sorted(set( (shard['chr'], shard['project']) for shard in manifest['shards'] ))
+    print(f"{len(groups)} chromosome/project groups written to {args.output_dir}", file=sys.stderr)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Write an MPRA table as memory-mappable shards for out-of-core training.")
+    parser.add_argument('--datafile_path', type=str, required=True, help="Path to MPRA data table.")
+    parser.add_argument('--output_dir', type=str, required=True, help="Directory for the shards and manifest.")
+    parser.add_argument('--sep', type=str, choices={'space', 'tab', 'comma', " ", "\t", ","}, default='tab', help="Delimiter used in the data file.")
+    parser.add_argument('--sequence_column', type=str, default='sequence', help="Name of column with DNA sequences.")
+    parser.add_argument('--activity_columns', type=str, nargs='+', default=['K562_log2FC', 'HepG2_log2FC', 'SKNSH_log2FC'], help="Column names with activity values.")
+    parser.add_argument('--stderr_columns', type=str, nargs='+', default=['K562_lfcSE', 'HepG2_lfcSE', 'SKNSH_lfcSE'], help="Column names with stderr of activity values.")
+    parser.add_argument('--chr_column', type=str, default='chr', help="Name of column with chromosome info.")
+    parser.add_argument('--project_column', type=str, default='data_project', help="Name of column with data project info.")
+    parser.add_argument('--padded_seq_len', type=int, default=600, help="Desired total sequence length after padding.")
+    parser.add_argument('--left_flank', type=str, default=constants.MPRA_UPSTREAM, help="Upstream padding sequence.")
+    parser.add_argument('--right_flank', type=str, default=constants.MPRA_DOWNSTREAM, help="Downstream padding sequence.")
+    parser.add_argument('--shard_size', type=int, default=2**16, help="Number of examples per shard.")
+    parser.add_argument('--chunksize', type=int, default=2**18, help="Number of table rows parsed at a time.")
+    args = parser.parse_args()
+
+    args.sep = {'space': ' ', 'tab': '\t', 'comma': ','}.get(args.sep, args.sep)
+
+    main(args)
@@ -5,6 +5,7 @@ import shutil
 import gzip
 import csv
 import argparse
+import contextlib
 import multiprocessing
 
 import tqdm
@@ -19,14 +20,21 @@ import pandas as pd
 import boda
 from boda.common import constants, utils
 from boda.common.utils import unpack_artifact, model_fn
+from boda.common.prediction_cache import PredictionCache, CachedModel, artifact_fingerprint
+from boda.common.result_writer import TableResultWriter, ColumnarResultWriter, PickleResultWriter, BackgroundWriter, ChunkReorderBuffer
+from boda.common.work_queue import WorkQueue, chunk_output_path
+from boda.common.pipeline import DevicePrefetcher, HostCopy
+from boda.common.precision import reduced_precision, ReducedPrecision, PRECISIONS
 
 
-def load_model(artifact_path):
+def load_model(artifact_path, freeze=False):
     """
     Load a trained model from the specified artifact path.
 
     Args:
         artifact_path (str): Path to the model artifact.
+        freeze (bool, optional): Return a frozen inference copy (boda.model.freeze_for_inference).
+            Default is False.
 
     Returns:
         nn.Module: The loaded trained model.
@@ -43,6 +51,8 @@ def load_model(artifact_path):
     my_model.eval()
     if USE_CUDA:
         my_model.cuda()
+    if freeze:
+        my_model = boda.model.try_freeze_for_inference(my_model)
     
     return my_model
 
@@ -128,17 +138,18 @@ class VariableModelPool(nn.Module):
     """
     
     def __init__(self,
-                 path_list
+                 path_list, freeze=False
                 ):
         """
         Initialize the VariableModelPool with a list of model paths.
 
         Args:
             path_list (list): List of paths to model artifacts.
+            freeze (bool, optional): Use frozen inference copies of the models. Default is False.
         """
         super().__init__()
         
-        self.models = [ load_model(model_path) for model_path in path_list ]
+        self.models = [ load_model(model_path, freeze=freeze) for model_path in path_list ]
             
     def forward(self, batch):
         """
@@ -160,24 +171,82 @@ class VepTester(nn.Module):
 
     Args:
         model (nn.Module): A PyTorch model for variant effect prediction.
+        cache (PredictionCache, optional): Cache of predictions. Windows found in it skip the model. Default is None.
+        namespace (str, optional): Identifies the model in the cache. Required with cache.
+        incremental_snv (bool, optional): Score alt windows that differ from their ref window
+            by one base with boda.model.PointMutationEngine. Only used for single BassetBranched
+            models without a cache. Default is False.
 
     Attributes:
         use_cuda (bool): Flag indicating whether CUDA is available.
         model (nn.Module): The model to be tested.
+        engine (PointMutationEngine): Incremental SNV scorer, or None.
     """
     
     def __init__(self,
-                 model
+                 model,
+                 cache=None,
+                 namespace=None,
+                 incremental_snv=False
                 ):
         """
         Initialize the VepTester with the variant effect predictor model.
 
         Args:
             model (nn.Module): A PyTorch model for variant effect prediction.
+            cache (PredictionCache, optional): Cache of predictions. Default is None.
+            namespace (str, optional): Identifies the model in the cache. Default is None.
+            incremental_snv (bool, optional): Score SNV windows incrementally. Default is False.
         """
         super().__init__()
         self.use_cuda = torch.cuda.device_count() >= 1
-        self.model = torch.nn.DataParallel(model) if torch.cuda.device_count() > 1 else model
+        self.engine, self.autocast_dtype = None, None
+        if incremental_snv:
+            base_model = model.model if isinstance(model, ReducedPrecision) else model
+            if isinstance(base_model, boda.model.BassetBranched) and cache is None:
+                self.engine = boda.model.PointMutationEngine(base_model)
+                self.autocast_dtype = getattr(model, 'autocast_dtype', None)
+            else:
+                print("Incremental SNV scoring needs a single BassetBranched model and no prediction cache, scoring all windows in full.", file=sys.stderr)
+        self.model = torch.nn.DataParallel(model) if torch.cuda.device_count() > 1 and not boda.model.is_quantized(model) else model
+        if cache is not None:
+            self.model = CachedModel(self.model, cache, namespace)
+    
+    def predict_pair(self, ref_batch, alt_batch):
+        """
+        Predict matched reference and alternate windows.
+
+        With the engine, reference windows are cached as they are predicted, and alternate
+        windows that differ from their reference at a single position are scored by
+        recomputing only the activations that position reaches.
+
+        Args:
+            ref_batch (torch.Tensor): One-hot reference windows of shape (n_windows, n_tokens, length).
+            alt_batch (torch.Tensor): Matching alternate windows.
+
+        Returns:
+            tuple: fp32 reference and alternate predictions.
+        """
+        if self.engine is None:
+            return self.model(ref_batch.contiguous()).float(), self.model(alt_batch.contiguous()).float()
+        
+        changed = (ref_batch != alt_batch).any(dim=1)
+        is_snv  = changed.sum(dim=1) == 1
+        snv_idx = torch.nonzero(is_snv).flatten()
+        positions = changed[snv_idx].float().argmax(dim=1)
+        columns   = alt_batch[snv_idx, :, positions]
+        bases     = torch.where(columns.any(dim=1), columns.argmax(dim=1), self.engine.n_tokens)
+        
+        autocast = contextlib.nullcontext() if self.autocast_dtype is None else \
+                   torch.autocast(device_type=ref_batch.device.type, dtype=self.autocast_dtype)
+        with autocast:
+            ref_preds = self.engine.set_reference(ref_batch.contiguous()).float()
+            alt_preds = torch.empty_like(ref_preds)
+            if snv_idx.numel() > 0:
+                alt_preds[snv_idx] = self.engine(positions, bases, snv_idx).float()
+        if not is_snv.all():
+            alt_preds[~is_snv] = self.model(alt_batch[~is_snv].contiguous()).float()
+        return ref_preds, alt_preds
         
     def forward(self, ref_batch, alt_batch, average_full_revcomp=False):
         """
@@ -198,19 +267,13 @@ class VepTester(nn.Module):
         ref_batch = ref_batch.flatten(0,1)
         alt_batch = alt_batch.flatten(0,1)
         
-        with torch.cuda.amp.autocast():
-            ref_preds = self.model(ref_batch.contiguous())
-            alt_preds = self.model(alt_batch.contiguous())
-            
-            if average_full_revcomp:
-                ref_preds = torch.stack([
-                    ref_preds,
-                    self.model(ref_batch.flip(dims=[1,2]).contiguous())
-                ], dim=0).mean(dim=0, keepdim=False)
-                alt_preds = torch.stack([
-                    alt_preds,
-                    self.model(alt_batch.flip(dims=[1,2]).contiguous())
-                ], dim=0).mean(dim=0, keepdim=False)
+        # Reduced precision, if any, is applied inside the model; strand means and skews are fp32
+        ref_preds, alt_preds = self.predict_pair(ref_batch, alt_batch)
+        
+        if average_full_revcomp:
+            ref_flip, alt_flip = self.predict_pair(ref_batch.flip(dims=[1,2]), alt_batch.flip(dims=[1,2]))
+            ref_preds = torch.stack([ref_preds, ref_flip], dim=0).mean(dim=0, keepdim=False)
+            alt_preds = torch.stack([alt_preds, alt_flip], dim=0).mean(dim=0, keepdim=False)
 
         ref_preds = ref_preds.unflatten(0, ref_shape[0:2])
         ref_preds = ref_preds.unflatten(1, (2, ref_shape[1]//2))
@@ -555,106 +618,76 @@ class activity_filtering(object):
         indexing_tensor = preds[indexer] * _filter.add(_mask.mul(1/epsilon))
         return indexing_tensor
 
-def main(args):
+def run_predictions(args, vep_tester, vcf_subset, vcf_table, output, flank_builder, window_expander=None):
     """
-    Run the main processing pipeline for the given command-line arguments.
-
-    This function executes the main processing pipeline, including loading models, processing input data from FASTA and VCF files,
-    and generating predictions. The resulting predictions are then post-processed based on specified reduction and filtering methods.
+    Predict variant effects for a dataset and write them to an output.
 
     Args:
         args (argparse.Namespace): Parsed command-line arguments.
+        vep_tester (VepTester): The variant effect tester.
+        vcf_subset (torch.utils.data.Dataset): Variants to test.
+        vcf_table (pd.DataFrame): VCF records of vcf_subset, or None for a StreamingVcfDataset.
+        output (str): Output path.
+        flank_builder (utils.FlankBuilder): Adds flanks to windows.
+        window_expander (boda.data.WindowExpander, optional): Expands token-coded spans into windows.
 
     Returns:
-        None
+        int: Number of records written.
     """
     USE_CUDA = torch.cuda.device_count() >= 1
-    print(sys.argv)
-    ##################
-    ## Import Model ##
-    ##################
-    if len(args.artifact_path) == 1:
-        my_model = load_model(args.artifact_path[0])
-    elif len(args.artifact_path) > 1 and args.use_vmap:
-        my_model = ConsistentModelPool(args.artifact_path)
-    elif len(args.artifact_path) > 1:
-        my_model = VariableModelPool(args.artifact_path)
-    
-    #########################
-    ## Setup FASTA and VCF ##
-    #########################
-    fasta_data = boda.data.Fasta(args.fasta_file)
-    
-    vcf = boda.data.VCF(
-        args.vcf_file, chr_prefix=args.vcf_contig_prefix, 
-        max_allele_size=20, max_indel_size=20,
-    )
-    
-    WINDOW_SIZE = args.window_size
-    RELATIVE_START = args.relative_start
-    RELATIVE_END = args.relative_end
-    
-    vcf_data = boda.data.VcfDataset(
-        vcf.vcf, fasta_data.fasta, WINDOW_SIZE, 
-        RELATIVE_START, RELATIVE_END, step_size=args.step_size, 
-        left_flank='', right_flank='', use_contigs=args.use_contigs,
-    )
-
-    ########################
-    ## determine chunking ##
-    ########################
-    if args.n_jobs > 1:
-        extra_tasks = len(vcf_data) % args.n_jobs
-        if extra_tasks > 0:
-            subset_size = ((len(vcf_data) // args.n_jobs) + 1)
-        else:
-            subset_size = len(vcf_data) // args.n_jobs
-        start_idx = subset_size*args.job_id
-        stop_idx  = min(len(vcf_data), subset_size*(args.job_id+1))
-        vcf_subset = torch.utils.data.Subset(vcf_data, np.arange(start_idx, stop_idx))
-        vcf_table  = vcf_data.vcf.iloc[start_idx:stop_idx]
-    else:
-        vcf_subset = vcf_data
-        vcf_table  = vcf_data.vcf
-
-    print(f"Dataset length: {len(vcf_subset)}, VCF length: {vcf_table.shape}")
-    assert len(vcf_subset) == vcf_table.shape[0], "size mismatch"
     ###########################
     ## prepare data pipeline ##
     ###########################
-    vcf_loader = torch.utils.data.DataLoader( vcf_subset, batch_size=args.batch_size*max(1,torch.cuda.device_count()) )
-    
-    left_flank = boda.common.utils.dna2tensor( 
-        args.left_flank 
-    ).unsqueeze(0).unsqueeze(0)
-
-    right_flank= boda.common.utils.dna2tensor( 
-        args.right_flank
-    ).unsqueeze(0).unsqueeze(0)
-    
-    flank_builder = utils.FlankBuilder(
-        left_flank=left_flank,
-        right_flank=right_flank,
+    # torch 1.13 rejects a prefetch_factor other than 2 without workers
+    loader_kwargs = {'num_workers': args.num_workers, 'pin_memory': USE_CUDA}
+    if args.num_workers > 0:
+        loader_kwargs['prefetch_factor'] = args.prefetch_depth
+    vcf_loader = torch.utils.data.DataLoader( 
+        vcf_subset, batch_size=args.batch_size*max(1,torch.cuda.device_count()), 
+        collate_fn=boda.data.collate_streaming_vcf if vcf_table is None else None,
+        **loader_kwargs,
+    )
+    # Alleles are copied to the device ahead of use, records stay on the host
+    vcf_loader = DevicePrefetcher(
+        vcf_loader, 'cuda' if USE_CUDA else 'cpu', depth=args.prefetch_depth, keys=('ref', 'alt')
     )
-    if USE_CUDA:
-        flank_builder.cuda()
-    
-    vep_tester = VepTester(my_model)
     
-    ref_preds = []
-    alt_preds = []
-    skew_preds= []
+    ###################
+    ## setup outputs ##
+    ###################
+    if args.raw_predictions and args.raw_format == 'columnar':
+        writer = ColumnarResultWriter(output)
+    elif args.raw_predictions:
+        writer = PickleResultWriter(output)
+    else:
+        compression = None if args.output_compression == 'none' else args.output_compression
+        writer = TableResultWriter(output, feature_ids=args.feature_ids, compression=compression)
+    writer = BackgroundWriter(writer)
+    
+    if vcf_table is None:
+        # Streamed records can arrive out of order across workers
+        n_workers = max(1, args.num_workers)
+        reorder_buffer = ChunkReorderBuffer(
+            writer.write, 
+            shard_ids=range(args.job_id*n_workers, (args.job_id+1)*n_workers), 
+            n_shards=args.n_jobs*n_workers
+        )
+    n_written = 0
 
     ######################
     ## run through data ##
     ######################
     with torch.no_grad():
         for i, batch in enumerate(tqdm.tqdm(vcf_loader)):
+            if 'ref' not in batch:
+                # Only chunk completion markers, e.g. for chunks with no usable records
+                reorder_buffer.complete(batch['chunk_complete'])
+                continue
             ref_allele, alt_allele = batch['ref'], batch['alt']
             
-            if USE_CUDA:
-                ref_allele = ref_allele.cuda()
-                alt_allele = alt_allele.cuda()
+            if window_expander is not None:
+                ref_allele = window_expander(ref_allele)
+                alt_allele = window_expander(alt_allele)
 
             ref_allele = flank_builder(ref_allele).contiguous()
             alt_allele = flank_builder(alt_allele).contiguous()
@@ -706,33 +739,178 @@ def main(args):
                 proc_preds['skew']= getattr(reductions, args.window_reduction) \
                                     (proc_preds['skew'], dim=1, **window_kwargs)
                 
-                ref_preds.append(proc_preds['ref'].cpu())
-                alt_preds.append(proc_preds['alt'].cpu())
-                skew_preds.append(proc_preds['skew'].cpu())
+                batch_preds = { k: proc_preds[k] for k in ['ref', 'alt', 'skew'] }
+            
+            else:
+                batch_preds = { k: all_preds[k] for k in ['ref', 'alt'] }
             
+            # Results are copied off the device without waiting for it
+            batch_size  = batch_preds['ref'].shape[0]
+            batch_preds = HostCopy(batch_preds)
+            if vcf_table is None:
+                record = { k: v.numpy() if torch.is_tensor(v) else v for k, v in batch['record'].items() }
+                records = pd.DataFrame(record, index=batch['index'].numpy())
+                reorder_buffer.push(batch['chunk'].numpy(), records, batch_preds.result())
+                reorder_buffer.complete(batch['chunk_complete'])
             else:
-                ref_preds.append(all_preds['ref'].cpu())
-                alt_preds.append(all_preds['alt'].cpu())
+                writer.write(vcf_table.iloc[n_written:n_written+batch_size], batch_preds)
+            n_written += batch_size
 
     ##################
     ## dump outputs ##
     ##################
-    if not args.raw_predictions:
-        ref_preds = torch.cat(ref_preds, dim=0)
-        alt_preds = torch.cat(alt_preds, dim=0)
-        skew_preds= torch.cat(skew_preds, dim=0)
-        
-        print(f"ref dims: {ref_preds.shape}, alt dims: {alt_preds.shape}, skew dims: {skew_preds.shape}")
-        
-        full_results = combine_ref_alt_skew_tensors(ref_preds, alt_preds, skew_preds, args.feature_ids)
-        
-        print(f"results table shape: {full_results.shape}")
-        vcf_table = pd.concat([vcf_table.reset_index(drop=True), pd.DataFrame(full_results, columns=['INFO'])], axis=1)
-        vcf_table.to_csv(args.output, sep='\t', index=False, header=True, quoting=csv.QUOTE_NONE)
+    if vcf_table is None:
+        reorder_buffer.finish()
+    writer.close()
+    return n_written
+
+def main(args):
+    """
+    Run the main processing pipeline for the given command-line arguments.
+
+    This function executes the main processing pipeline, including loading models, processing input data from FASTA and VCF files,
+    and generating predictions. The resulting predictions are then post-processed based on specified reduction and filtering methods.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+
+    Returns:
+        None
+    """
+    USE_CUDA = torch.cuda.device_count() >= 1
+    print(sys.argv)
+    ##################
+    ## Import Model ##
+    ##################
+    if len(args.artifact_path) == 1:
+        my_model = load_model(args.artifact_path[0], freeze=args.freeze_model)
+    elif len(args.artifact_path) > 1 and args.fuse_ensemble:
+        my_model = boda.model.fuse_ensemble([ load_model(model_path) for model_path in args.artifact_path ])
+    elif len(args.artifact_path) > 1 and args.use_vmap:
+        my_model = ConsistentModelPool(args.artifact_path)
+    elif len(args.artifact_path) > 1:
+        my_model = VariableModelPool(args.artifact_path, freeze=args.freeze_model)
+    my_model = reduced_precision(my_model, args.precision, tolerance=args.precision_tolerance,
+                                 device='cuda' if USE_CUDA else 'cpu')
+    
+    #########################
+    ## Setup FASTA and VCF ##
+    #########################
+    fasta_data = boda.data.load_fasta(args.fasta_file)
+    
+    vcf = boda.data.VCF(
+        args.vcf_file, chr_prefix=args.vcf_contig_prefix, 
+        max_allele_size=20, max_indel_size=20,
+        chunk_size=args.vcf_chunk_size,
+    )
+    
+    WINDOW_SIZE = args.window_size
+    RELATIVE_START = args.relative_start
+    RELATIVE_END = args.relative_end
+    
+    if args.vcf_chunk_size is not None:
+        assert args.work_queue is None, "--work_queue partitions records by index and can't be combined with --vcf_chunk_size."
+        # Streaming: job partitioning is handled chunk-wise by the dataset
+        vcf_subset = boda.data.StreamingVcfDataset(
+            vcf, fasta_data.fasta, WINDOW_SIZE, 
+            RELATIVE_START, RELATIVE_END, step_size=args.step_size, 
+            left_flank='', right_flank='', use_contigs=args.use_contigs,
+            compact=args.expand_on_device,
+            job_id=args.job_id, n_jobs=args.n_jobs,
+        )
+        vcf_table = None
     else:
-        ref_preds = torch.cat(ref_preds, dim=0)
-        alt_preds = torch.cat(alt_preds, dim=0)
-        torch.save({'ref': ref_preds, 'alt': alt_preds, 'vcf': vcf_table}, args.output)
+        vcf_data = boda.data.VcfDataset(
+            vcf.vcf, fasta_data.fasta, WINDOW_SIZE, 
+            RELATIVE_START, RELATIVE_END, step_size=args.step_size, 
+            left_flank='', right_flank='', use_contigs=args.use_contigs,
+            compact=args.expand_on_device,
+        )
+
+        ########################
+        ## determine chunking ##
+        ########################
+        if args.work_queue is not None:
+            # Records are claimed from the queue in chunks below
+            vcf_subset, vcf_table = None, None
+        elif args.n_jobs > 1:
+            extra_tasks = len(vcf_data) % args.n_jobs
+            if extra_tasks > 0:
+                subset_size = ((len(vcf_data) // args.n_jobs) + 1)
+            else:
+                subset_size = len(vcf_data) // args.n_jobs
+            start_idx = subset_size*args.job_id
+            stop_idx  = min(len(vcf_data), subset_size*(args.job_id+1))
+            vcf_subset = torch.utils.data.Subset(vcf_data, np.arange(start_idx, stop_idx))
+            vcf_table  = vcf_data.vcf.iloc[start_idx:stop_idx]
+        else:
+            vcf_subset = vcf_data
+            vcf_table  = vcf_data.vcf
+
+        if vcf_table is not None:
+            print(f"Dataset length: {len(vcf_subset)}, VCF length: {vcf_table.shape}")
+            assert len(vcf_subset) == vcf_table.shape[0], "size mismatch"
+    
+    ###################
+    ## setup testers ##
+    ###################
+    left_flank = boda.common.utils.dna2tensor( 
+        args.left_flank 
+    ).unsqueeze(0).unsqueeze(0)
+
+    right_flank= boda.common.utils.dna2tensor( 
+        args.right_flank
+    ).unsqueeze(0).unsqueeze(0)
+    
+    flank_builder = utils.FlankBuilder(
+        left_flank=left_flank,
+        right_flank=right_flank,
+    )
+    if USE_CUDA:
+        flank_builder.cuda()
+    
+    window_expander = None
+    if args.expand_on_device:
+        window_expander = boda.data.WindowExpander(
+            constants.STANDARD_NT, WINDOW_SIZE, step_size=args.step_size
+        )
+        if USE_CUDA:
+            window_expander.cuda()
+    
+    if args.prediction_cache is not None:
+        cache = PredictionCache(args.prediction_cache, lru_size=args.cache_memory_size)
+        namespace = artifact_fingerprint(args.artifact_path)
+    else:
+        cache, namespace = None, None
+    
+    vep_tester = VepTester(my_model, cache=cache, namespace=namespace, incremental_snv=args.incremental_snv)
+    
+    ######################
+    ## run through data ##
+    ######################
+    if args.work_queue is not None:
+        queue = WorkQueue(args.work_queue, stale_after=args.queue_stale_after)
+        queue.initialize(len(vcf_data), args.queue_chunk_size)
+        n_written = 0
+        for chunk in queue.claims():
+            chunk_output = chunk_output_path(args.output, chunk.chunk_id)
+            print(f"Chunk {chunk.chunk_id}: records {chunk.start} to {chunk.stop}")
+            n_written += run_predictions(
+                args, vep_tester, 
+                torch.utils.data.Subset(vcf_data, np.arange(chunk.start, chunk.stop)), 
+                vcf_data.vcf.iloc[chunk.start:chunk.stop], 
+                chunk_output, flank_builder, window_expander
+            )
+            queue.complete(chunk.chunk_id, chunk_output)
+        print(f"Queue progress: {queue.progress()}")
+    else:
+        n_written = run_predictions(
+            args, vep_tester, vcf_subset, vcf_table, args.output, flank_builder, window_expander
+        )
+
+    if cache is not None:
+        print(cache.report(), file=sys.stderr)
+    print(f"Wrote {n_written} records to {args.output if args.work_queue is None else args.output + '.chunk*'}")
 
 if __name__ == '__main__':
     
@@ -740,12 +918,19 @@ if __name__ == '__main__':
     # Input info
     parser.add_argument('--artifact_path', type=str, nargs='*', required=True, help='Pre-trained model artifacts. Supply multiple to ensemble.')
     parser.add_argument('--use_vmap', type=utils.str2bool, default=False, help='If ensemble members have consistent architecture can speed up with functorch.vmap.')
+    parser.add_argument('--fuse_ensemble', type=utils.str2bool, default=False, help='Fuse same-architecture BassetBranched ensemble members into one grouped network (boda.model.fuse_ensemble). Takes precedence over USE_VMAP.')
+    parser.add_argument('--precision', type=str, choices=PRECISIONS, default='auto', help='Model precision. auto uses fp16 on CUDA and bf16 on CPUs with native support, otherwise fp32. Strand averages and skews are always fp32.')
+    parser.add_argument('--precision_tolerance', type=float, default=0.05, help='Refuse to run if reduced precision predictions differ from fp32 by more than this on a calibration sample.')
+    parser.add_argument('--freeze_model', type=utils.str2bool, default=True, help='Fold normalization into the weights of single models and VariableModelPool members (boda.model.freeze_for_inference). Falls back to the original model if the frozen copy is not equivalent.')
+    parser.add_argument('--incremental_snv', type=utils.str2bool, default=True, help='Score alt windows that differ from their ref window by one base with boda.model.PointMutationEngine, which recomputes only the activations the changed base reaches. Single BassetBranched models without --prediction_cache only.')
     parser.add_argument('--vcf_file', type=str, required=True, help='Variants to test in VCF format.')
     parser.add_argument('--fasta_file', type=str, required=True, help='FASTA reference file.')
     # Output info
     parser.add_argument('--output', type=str, required=True, help='Output path. Simple VCF if not RAW_PREDICTIONS else PT pickle.')
     parser.add_argument('--feature_ids', type=str, nargs='*', help='Custom feature IDs for outputs in INFO column.')
     parser.add_argument('--raw_predictions', type=utils.str2bool, default=False, help='Dump raw ref/alt predictions as tensors. Output will be a PT pickle.')
+    parser.add_argument('--raw_format', type=str, choices=('pt', 'columnar'), default='pt', help='Format of raw predictions. pt: a PT pickle written at the end. columnar: a directory of binary columns appended as batches finish, read with boda.common.result_writer.load_columnar_results.')
+    parser.add_argument('--output_compression', type=str, choices=('none', 'gzip', 'bgzip'), default='none', help='Compression of the output table.')
     # Data preprocessing
     parser.add_argument('--window_size', type=int, default=200, help='Window size to be extracted from the genome.')
     parser.add_argument('--left_flank', type=str, default=boda.common.constants.MPRA_UPSTREAM[-200:], help='Upstream padding.')
@@ -769,6 +954,15 @@ if __name__ == '__main__':
     parser.add_argument('--batch_size', type=int, default=10, help='Batch size during sequence extraction from FASTA.')
     parser.add_argument('--job_id', type=int, default=0, help='Job partition index for distributed computing.')
     parser.add_argument('--n_jobs', type=int, default=1, help='Total number of job partitions.')
+    parser.add_argument('--vcf_chunk_size', type=int, help='Stream the VCF in chunks of this many lines instead of loading it up front. Jobs are partitioned by chunk.')
+    parser.add_argument('--expand_on_device', type=utils.str2bool, default=True, help='Send token-coded variant spans to the device and expand them into windows there.')
+    parser.add_argument('--num_workers', type=int, default=0, help='Number of DataLoader workers for sequence extraction.')
+    parser.add_argument('--prefetch_depth', type=int, default=2, help='Number of batches extracted and copied to the device ahead of the model.')
+    parser.add_argument('--prediction_cache', type=str, help='SQLite file of cached predictions keyed by artifact and input window. Shared across runs and jobs.')
+    parser.add_argument('--cache_memory_size', type=int, default=2**16, help='Number of cached predictions kept in memory.')
+    parser.add_argument('--work_queue', type=str, help='SQLite work queue shared by workers, replacing --job_id/--n_jobs. Workers claim chunks of records until none are left and write one output per chunk to OUTPUT.chunkNNNNNN. Combine with src/merge_chunks.py.')
+    parser.add_argument('--queue_chunk_size', type=int, default=10000, help='Number of records per work queue chunk.')
+    parser.add_argument('--queue_stale_after', type=float, help='Seconds after which a claimed but unfinished chunk is handed to another worker.')
     args = parser.parse_args()
     
     main(args)
\ No newline at end of file
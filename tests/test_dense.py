@@ -0,0 +1,41 @@
+import torch
+import torch.nn.functional as F
+
+from boda.model import BassetBranched, dense_scanner
+
+def random_model(seed=0):
+    torch.manual_seed(seed)
+    model = BassetBranched(input_len=600, n_outputs=3).eval()
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm1d):
+            module.running_mean.normal_(0., 0.1)
+            module.running_var.uniform_(0.5, 1.5)
+    return model
+
+def strided_windows(model, x, stride):
+    windows = x.unfold(2, model.input_len, stride).permute(0, 2, 1, 3)
+    with torch.no_grad():
+        return model(windows.flatten(0, 1)).view(x.shape[0], windows.shape[1], -1)
+
+def test_dense_scan_matches_windowed_model():
+    model  = random_model()
+    tokens = torch.randint(0, 4, (2, 1000), generator=torch.Generator().manual_seed(0))
+    x = F.one_hot(tokens, 4).transpose(1, 2).float()
+    expected = strided_windows(model, x, stride=7)
+    with torch.no_grad():
+        observed = dense_scanner(model)(x)[:, ::7]
+        from_tokens = dense_scanner(model)(tokens)[:, ::7]
+    # Exact up to float32 error
+    torch.testing.assert_close(observed, expected, atol=1e-5, rtol=1e-4)
+    torch.testing.assert_close(from_tokens, expected, atol=1e-5, rtol=1e-4)
+
+def test_dense_scan_without_exact_edges_is_approximate():
+    model  = random_model()
+    tokens = torch.randint(0, 4, (2, 1000), generator=torch.Generator().manual_seed(0))
+    x = F.one_hot(tokens, 4).transpose(1, 2).float()
+    expected = strided_windows(model, x, stride=7)
+    with torch.no_grad():
+        observed = dense_scanner(model, exact_edges=False)(x)[:, ::7]
+    # Edge features differ, by up to about 10% of the output spread
+    error = (observed - expected).abs().max()
+    assert 0 < error < 0.1 * expected.std()
@@ -0,0 +1,71 @@
+import gzip
+
+import numpy as np
+
+from boda.data.fasta_datamodule import Fasta, FastaDataset, IndexedFasta, load_fasta
+
+def onehot_contig(length, n_runs=()):
+    tokens = np.arange(length) % 4
+    contig = (np.arange(4)[:, None] == tokens[None, :])
+    for start, end in n_runs:
+        contig[:, start:end] = False
+    return contig
+
+def onehot_sequence(seq):
+    return np.array(list('ACGT'))[:, None] == np.array(list(seq))[None, :]
+
+def test_keep_windows_with_n_run_past_last_window():
+    # Windows start at 0 and 300, so the N run at [950, 1000) is never tiled
+    fasta = {'chr1': onehot_contig(1000, n_runs=[(950, 1000)])}
+    data = FastaDataset(fasta, window_size=600, step_size=300,
+                        reverse_complements=False, max_n_fraction=0.1)
+    assert data.keep_windows('chr1') == [(0, 2)]
+    assert len(data) == 2
+
+def test_keep_windows_drops_n_heavy_windows():
+    fasta = {'chr1': onehot_contig(1200, n_runs=[(0, 300)])}
+    data = FastaDataset(fasta, window_size=600, step_size=300,
+                        reverse_complements=False, max_n_fraction=0.1)
+    assert data.keep_windows('chr1') == [(1, 2)]
+    assert len(data) == 2
+
+def test_keep_windows_drops_n_heavy_windows_at_both_ends():
+    # Windows start at 0, 300, 600 and 900; the first and last hold 200 N each
+    fasta = {'chr1': onehot_contig(1500, n_runs=[(0, 200), (1300, 1500)])}
+    data = FastaDataset(fasta, window_size=600, step_size=300,
+                        reverse_complements=False, max_n_fraction=0.1)
+    assert data.keep_windows('chr1') == [(1, 2)]
+    assert len(data) == 2
+    assert [ data.get_fasta_coords(i)['start'] for i in range(len(data)) ] == [300, 600]
+
+def write_fasta(path, contigs, opener=open):
+    with opener(path, 'wt') as f:
+        for key, seq in contigs.items():
+            f.write(f'>{key}\n')
+            f.writelines( seq[i:i+60] + '\n' for i in range(0, len(seq), 60) )
+
+def write_fai(path, contigs):
+    with open(path, 'w') as f:
+        offset = 0
+        for key, seq in contigs.items():
+            offset += len(key) + 2
+            f.write(f'{key}\t{len(seq)}\t{offset}\t60\t61\n')
+            offset += len(seq) + -(-len(seq) // 60)
+
+def test_load_fasta_ignores_fai_next_to_plain_gzip(tmp_path):
+    contigs = {'chr1': 'ACGT' * 50, 'chr2': 'TTGCA' * 30}
+    path = str(tmp_path / 'genome.fa.gz')
+    write_fasta(path, contigs, opener=gzip.open)
+    write_fai(path + '.fai', contigs)
+    fasta = load_fasta(path)
+    assert isinstance(fasta, Fasta)
+    assert fasta.contig_lengths == {'chr1': 200, 'chr2': 150}
+
+def test_load_fasta_reads_plain_text_through_fai(tmp_path):
+    contigs = {'chr1': 'ACGT' * 50, 'chr2': 'TTGCA' * 30}
+    path = str(tmp_path / 'genome.fa')
+    write_fasta(path, contigs)
+    write_fai(path + '.fai', contigs)
+    fasta = load_fasta(path)
+    assert isinstance(fasta, IndexedFasta)
+    np.testing.assert_array_equal(np.asarray(fasta.fasta['chr2'][:, :10]), onehot_sequence('TTGCATTGCA'))
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from boda.data.mpra_datamodule import MPRA_DataModule
+from boda.data.shard_datamodule import ShardedMPRA_DataModule, load_shard, write_mpra_shards
+
+ACTIVITY_COLUMNS = ['K562_log2FC', 'HepG2_log2FC', 'SKNSH_log2FC']
+STDERR_COLUMNS   = ['K562_lfcSE', 'HepG2_lfcSE', 'SKNSH_lfcSE']
+
+def write_mpra_table(path, n_rows=300, seed=0):
+    rng = np.random.default_rng(seed)
+    table = pd.DataFrame({
+        'sequence': [ ''.join(rng.choice(list('ACGT'), size=200)) for _ in range(n_rows) ],
+        'chr': rng.choice(['1', '2', 'X'], size=n_rows),
+        'data_project': 'BODA',
+    })
+    # Far from zero mean, so raw and normalized cutoffs pick different rows
+    for column in ACTIVITY_COLUMNS:
+        table[column] = rng.normal(3., 2., size=n_rows)
+    for column in STDERR_COLUMNS:
+        table[column] = rng.uniform(0., 0.5, size=n_rows)
+    table.to_csv(path, sep='\t', index=False)
+
+def test_duplicated_rows_match_mpra_datamodule_with_normalize(tmp_path):
+    datafile = str(tmp_path / 'mpra.txt')
+    write_mpra_table(datafile)
+    write_mpra_shards(datafile, str(tmp_path / 'shards'), shard_size=64)
+
+    common = dict(data_project=['BODA'], val_chrs=['2'], test_chrs=['X'],
+                  normalize=True, duplication_cutoff=1.0, num_workers=0)
+    in_memory = MPRA_DataModule(datafile, store_tokens=True, **common)
+    in_memory.setup()
+    sharded = ShardedMPRA_DataModule(str(tmp_path / 'shards'), **common)
+    sharded.setup()
+
+    train = in_memory.chr_dataset_train
+    expected = { bytes(row) for row in train.dna_tensor[:train.n_duplicated].numpy() }
+
+    dataset = sharded.dataset_train
+    duplicated = set()
+    for shard in dataset.shards:
+        tokens, _, _ = dataset.read_shard(shard)
+        fields = load_shard(dataset.shard_dir, shard, fields=('row_ids', 'activities', 'stderr'))
+        n_kept = int(dataset.row_filter(shard, fields).sum())
+        duplicated |= { bytes(row) for row in tokens[n_kept:] }
+
+    assert 0 < len(expected) < train.n_examples
+    assert duplicated == expected
+    assert dataset.count_rows() == train.n_examples
+    assert sum(dataset.shard_rows.values()) == len(train)
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+
+from boda.data.table_datamodule import InputSequences, SeqDataModule
+
+def write_table(path, n_rows=20, seed=0):
+    rng = np.random.default_rng(seed)
+    with open(path, 'w') as f:
+        for _ in range(n_rows):
+            seq = ''.join(rng.choice(list('ACGTN'), size=150))
+            f.write(f'{seq}\t{rng.normal():.4f}\t{rng.normal():.4f}\n')
+
+def test_cached_tokens_go_to_cache_dir(tmp_path):
+    data_dir, cache_dir = tmp_path / 'data', tmp_path / 'cache'
+    data_dir.mkdir()
+    path = str(data_dir / 'train.txt')
+    write_table(path)
+    cached = InputSequences(path, 'A' * 300, 'C' * 300, seq_len=200, cache_tokens=True, cache_dir=str(cache_dir))
+    assert os.listdir(data_dir) == ['train.txt']
+    assert len(os.listdir(cache_dir)) == 2
+
+    plain = InputSequences(path, 'A' * 300, 'C' * 300, seq_len=200)
+    for idx in [0, 7, 19]:
+        np.testing.assert_array_equal(cached[idx][0].numpy(), plain[idx][0].numpy())
+        np.testing.assert_allclose(cached[idx][1].numpy(), plain[idx][1].numpy())
+
+def test_dataloaders_use_num_workers(tmp_path):
+    path = str(tmp_path / 'train.txt')
+    write_table(path)
+    for cache_tokens in (False, True):
+        data = SeqDataModule(path, path, path, batch_size=4, left_flank='A' * 300, right_flank='C' * 300,
+                             seq_len=200, cache_tokens=cache_tokens, cache_dir=str(tmp_path / 'cache'), num_workers=2)
+        data.setup()
+        assert data.train_dataloader().num_workers == 2